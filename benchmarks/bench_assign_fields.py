@@ -0,0 +1,53 @@
+"""
+Проверка эквивалентности и замер скорости сопоставления граф текстовым линиям.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_assign_fields --lines 5000 --fields 5000
+
+Прежний вложенный цикл на iterrows() запускается только на уменьшенной выборке,
+на полной таблице он работает минутами.
+"""
+import argparse
+import time
+import numpy as np
+from core.image_processing import assign_fields_to_lines, assign_graph_to_line
+from benchmarks.synthetic import make_table_boxes
+
+
+def assign_fields_reference(lines, fields, horizontal_shift_threshold=50) -> np.ndarray:
+    """
+    Прежний вложенный цикл из process_image().
+    """
+    matched = np.full(len(fields), -1, dtype=np.int64)
+    for position, (_, text_line) in enumerate(lines.iterrows()):
+        for index, graph in fields.iterrows():
+            if assign_graph_to_line(graph, text_line, horizontal_shift_threshold):
+                matched[index] = position
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--fields", type=int, default=5000)
+    parser.add_argument("--reference-size", type=int, default=200)
+    args = parser.parse_args()
+
+    lines, fields = make_table_boxes(args.reference_size, args.reference_size, seed=1)
+    start = time.perf_counter()
+    expected = assign_fields_reference(lines, fields)
+    reference_time = time.perf_counter() - start
+    actual = assign_fields_to_lines(lines, fields)
+    assert np.array_equal(actual, expected), "Результаты сопоставления различаются"
+    print(f"{args.reference_size}x{args.reference_size}: эквивалентно, "
+          f"{int((expected >= 0).sum())} граф привязано, цикл {reference_time:.2f} с")
+
+    lines, fields = make_table_boxes(args.lines, args.fields, seed=2)
+    start = time.perf_counter()
+    matched = assign_fields_to_lines(lines, fields)
+    elapsed = time.perf_counter() - start
+    print(f"{args.lines}x{args.fields}: {elapsed * 1000:.1f} мс, {int((matched >= 0).sum())} граф привязано")
+
+
+if __name__ == "__main__":
+    main()
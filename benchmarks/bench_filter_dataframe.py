@@ -0,0 +1,87 @@
+"""
+Проверка эквивалентности и замер скорости filter_dataframe() против прежней реализации на groupby.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_filter_dataframe --runs 20
+
+Если установлен Tesseract, эквивалентность дополнительно проверяется на изображениях из test_files.
+"""
+import argparse
+import glob
+import timeit
+import numpy as np
+import pandas as pd
+from PIL import Image
+from core.image_processing import filter_dataframe, process_image
+from benchmarks.synthetic import make_ocr_dataframe
+
+
+def filter_dataframe_reference(df: pd.DataFrame, threshold=25):
+    """
+    Прежняя реализация filter_dataframe() на groupby().apply() и groupby().agg().
+    """
+    df = df[(0 >= df['conf']) | (df['conf'] >= threshold)]
+    df.reset_index(drop=True, inplace=True)
+
+    df_concatenated = df.groupby(['block_num', 'par_num', 'line_num']).apply(lambda group: group.sort_values(by='left')).reset_index(drop=True)
+    df_concatenated = df_concatenated.groupby(['block_num', 'par_num', 'line_num']).agg({
+        'text': lambda x: [str(e).strip() for e in x if not pd.isna(e) and str(e).strip()],
+        'left': 'first',
+        'top': 'first',
+        'width': 'first',
+        'height': 'first',
+        'field_id': lambda x: [e for e in x if not pd.isna(e)] if [e for e in x if not pd.isna(e)] else None
+    }).reset_index()
+    df_filtered = df_concatenated[df_concatenated['text'].apply(lambda x: any(x))]
+    df_filtered = df_filtered.sort_values(by='top')
+    df_filtered.reset_index(drop=True, inplace=True)
+    df_filtered = df_filtered.drop(['block_num', 'par_num', 'line_num'], axis=1)
+
+    return df_filtered
+
+
+def assert_equivalent(df: pd.DataFrame, threshold: int, name: str) -> None:
+    """
+    Сравнивает результаты новой и прежней реализации на одном DataFrame.
+    """
+    expected = filter_dataframe_reference(df.copy(), threshold=threshold)
+    actual = filter_dataframe(df.copy(), threshold=threshold)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    print(f"{name}: эквивалентно ({len(actual)} линий)")
+
+
+def load_test_images():
+    """
+    Распознает изображения из test_files, если доступен Tesseract.
+    """
+    frames = []
+    for path in sorted(glob.glob("test_files/*.jpg")):
+        try:
+            df, _, _ = process_image(Image.open(path))
+        except Exception as e:
+            print(f"Пропуск {path}: {e}")
+            return frames
+        frames.append((path, df))
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=400)
+    args = parser.parse_args()
+
+    samples = [(f"synthetic seed={seed}", make_ocr_dataframe(n_lines=args.lines, seed=seed)) for seed in range(5)]
+    samples += load_test_images()
+    for name, df in samples:
+        for threshold in (0, 25):
+            assert_equivalent(df, threshold, f"{name}, threshold={threshold}")
+
+    df = samples[0][1]
+    for name, func in (("groupby", filter_dataframe_reference), ("lexsort", filter_dataframe)):
+        times = timeit.repeat(lambda: func(df.copy(), threshold=0), number=1, repeat=args.runs)
+        print(f"{name:8s} медиана {np.median(times) * 1000:.2f} мс на {len(df)} строк")
+
+
+if __name__ == "__main__":
+    main()
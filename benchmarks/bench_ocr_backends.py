@@ -0,0 +1,68 @@
+"""
+Сравнение пропускной способности бэкендов OCR на изображениях из test_files.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_ocr_backends --runs 3 --workers 4
+
+Для каждого бэкенда выводится время на изображение при последовательном вызове и
+пропускная способность в пуле потоков, а также совпадение распознанных слов с pytesseract.
+Нужен установленный Tesseract, для бэкенда tesserocr - пакет tesserocr.
+"""
+import argparse
+import glob
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from core.image_processing import OCR_BACKENDS, get_ocr_backend, recognize_text
+from core.utilities import preprocess_image, to_uint8
+
+
+def words(df) -> list:
+    """
+    Возвращает распознанные слова в порядке вывода tesseract.
+    """
+    return [str(text).strip() for text in df["text"] if isinstance(text, str) and text.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--backends", nargs="+", default=list(OCR_BACKENDS))
+    args = parser.parse_args()
+
+    images = [to_uint8(preprocess_image(np.array(Image.open(path).convert("RGB"))))
+              for path in sorted(glob.glob("test_files/*.jpg"))]
+    print(f"Изображений: {len(images)}")
+
+    reference = None
+    for name in args.backends:
+        try:
+            get_ocr_backend(name)
+            results = [recognize_text(image, backend=name) for image in images]
+        except Exception as e:
+            print(f"{name:12s} недоступен: {e}")
+            continue
+
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            for image in images:
+                recognize_text(image, backend=name)
+        sequential = (time.perf_counter() - start) / (args.runs * len(images))
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda image: recognize_text(image, backend=name), images * args.runs))
+            throughput = args.runs * len(images) / (time.perf_counter() - start)
+
+        recognized = [words(df) for df in results]
+        if reference is None:
+            reference = recognized
+        matches = np.mean([a == b for a, b in zip(recognized, reference)])
+        print(f"{name:12s} {sequential * 1000:8.1f} мс/изобр.  {throughput:6.2f} изобр./с в {args.workers} потоках"
+              f"  совпадение слов с {args.backends[0]}: {matches:.0%}")
+
+
+if __name__ == "__main__":
+    main()
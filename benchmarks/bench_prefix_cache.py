@@ -0,0 +1,63 @@
+"""
+Замер времени до первого токена (TTFT) с восстановлением снимка префикса и без него.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_prefix_cache --model model-q8_0.gguf --runs 5
+"""
+import argparse
+import statistics
+import time
+from constant import MODEL_PATH, BOT_TOKEN, LINEBREAK_TOKEN
+from llm.model_registry import get_model
+from llm.prefix_cache import PrefixCache
+from llm.utiils import get_prompt_prefix_tokens, get_ocr_message_tokens
+
+SAMPLE_OCR_TEXT = """Йогурт Агуша с персиком с 8 месяцев 2,7% 200 г
+Состав: молоко нормализованное, пюре персиковое, закваска.
+Пищевая ценность в 100 г: белки 2,8 г, жиры 2,7 г, углеводы 10,4 г.
+Энергетическая ценность 77 ккал.
+"""
+
+
+def time_to_first_token(model, tokens) -> float:
+    """
+    Измеряет время от запуска генерации до получения первого токена.
+
+    :param model: Модель LLAMA.
+    :param tokens: Токены запроса.
+    :return: Время в секундах.
+    """
+    start = time.perf_counter()
+    for _ in model.generate(tokens, top_k=30, top_p=0.9, temp=0.2, repeat_penalty=1.1):
+        break
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    model = get_model(args.model)
+    prefix_tokens = get_prompt_prefix_tokens(model)
+    request_tokens = prefix_tokens + get_ocr_message_tokens(model, SAMPLE_OCR_TEXT) + [model.token_bos(), BOT_TOKEN, LINEBREAK_TOKEN]
+    cache = PrefixCache()
+    cache.restore(model, args.model, prefix_tokens)
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        model.reset()
+        cold.append(time_to_first_token(model, request_tokens))
+
+        start = time.perf_counter()
+        cache.restore(model, args.model, prefix_tokens)
+        warm.append(time.perf_counter() - start + time_to_first_token(model, request_tokens))
+
+    print(f"Токенов префикса: {len(prefix_tokens)}, токенов запроса: {len(request_tokens)}")
+    print(f"TTFT без снимка:  {statistics.median(cold):.3f} с")
+    print(f"TTFT со снимком:  {statistics.median(warm):.3f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Сравнение способов улучшения контраста preprocess_image(): skimage (float64) и opencv (uint8).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_preprocess --runs 3 --megapixels 12
+
+Для каждого изображения из test_files и его копии, увеличенной до размера снимка телефона,
+выводится медианное время, пик выделенной памяти (tracemalloc) и среднее отличие результата
+от пути skimage. Если установлен Tesseract, дополнительно сравнивается распознанный текст.
+"""
+import argparse
+import difflib
+import glob
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from PIL import Image
+from core.document_conversion import ImageData
+from core.document_generator import image_to_text
+from core.utilities import preprocess_image, to_uint8
+
+METHODS = ("skimage", "opencv")
+
+
+def measure(image: np.ndarray, method: str, runs: int):
+    """
+    Возвращает медианное время, пик памяти и результат preprocess_image().
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        to_uint8(preprocess_image(image, method=method))
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = to_uint8(preprocess_image(image, method=method))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return float(np.median(times)), peak, result
+
+
+def ocr_text(image: np.ndarray):
+    """
+    Распознает текст изображения или возвращает None, если Tesseract недоступен.
+    """
+    try:
+        return image_to_text(ImageData(array=image), detection_threshold=0, use_cache=False)
+    except Exception as e:
+        print(f"  OCR пропущен: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--megapixels", type=float, default=12.0, help="Размер увеличенной копии изображения.")
+    parser.add_argument("--ocr", action="store_true", help="Сравнить текст OCR после обоих способов.")
+    args = parser.parse_args()
+
+    samples = []
+    for path in sorted(glob.glob("test_files/*.jpg")):
+        image = np.array(Image.open(path).convert("RGB"))
+        samples.append((path, image))
+        scale = (args.megapixels * 1e6 / (image.shape[0] * image.shape[1])) ** 0.5
+        if scale > 1:
+            size = (round(image.shape[1] * scale), round(image.shape[0] * scale))
+            samples.append((f"{path} x{scale:.1f}", cv2.resize(image, size, interpolation=cv2.INTER_CUBIC)))
+
+    for name, image in samples:
+        print(f"{name} ({image.shape[1]}x{image.shape[0]})")
+        results = {}
+        for method in METHODS:
+            seconds, peak, results[method] = measure(image, method, args.runs)
+            difference = np.abs(results[method].astype(np.int16) - results["skimage"]).mean()
+            print(f"  {method:8s} {seconds * 1000:8.1f} мс  пик {peak / 2 ** 20:7.1f} МБ  отличие {difference:.2f}")
+
+        if args.ocr:
+            texts = {method: ocr_text(result) for method, result in results.items()}
+            if all(text is not None for text in texts.values()):
+                ratio = difflib.SequenceMatcher(None, texts["skimage"], texts["opencv"]).ratio()
+                print(f"  сходство текста OCR: {ratio:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Сравнение обычной и спекулятивной (prompt lookup) генерации JSON при temperature=0.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_speculative --model model-q8_0.gguf --runs 3
+    python -m benchmarks.bench_speculative --stub --runs 3
+
+Модель создается с logits_all=True, JSON в обоих режимах генерируется с грамматикой
+get_product_grammar(), как в pipeline(). Для каждого режима печатается медианная скорость
+декодирования по трассе (замер llm.json.decode), а для спекулятивного - доля принятых
+токенов черновика и количество токенов на проход.
+Если тексты JSON двух режимов различаются, скрипт завершается с кодом 1.
+"""
+import argparse
+import statistics
+import sys
+from constant import MODEL_PATH, BOT_TOKEN, LINEBREAK_TOKEN
+from benchmarks.synthetic import SAMPLE_LABEL_LINES
+from core.tracing import start_trace
+from llm.json_schema import get_product_grammar
+from llm.model_registry import get_model, set_model_factory
+from llm.stub import StubLlama
+from llm.utiils import get_prompt_prefix_tokens, get_ocr_message_tokens, stream_generate
+
+
+def create_llama(**params):
+    from llama_cpp import Llama
+    return Llama(**dict(params, logits_all=True))
+
+
+def create_stub(**params):
+    # Проход по короткому батчу почти не дороже шага декодирования, как у llama.cpp на CPU
+    return StubLlama(**dict(params, logits_all=True), prefill_seconds=0.002, decode_seconds=0.03)
+
+
+def run_json_stage(model, tokens, speculative: bool):
+    """
+    Генерирует JSON по готовым токенам запроса.
+
+    :param model: Модель LLAMA.
+    :param tokens: Токены запроса.
+    :param speculative: Использовать спекулятивную генерацию.
+    :return: Текст JSON, количество токенов, время декодирования в секундах и статистика черновиков.
+    """
+    model.reset()
+    with start_trace("bench_speculative", enabled=True, log_path=None) as trace:
+        text = "".join(stream_generate(model, list(tokens), temperature=0.0, grammar=get_product_grammar(),
+                                       stop_on_json_end=True, stage="json", speculative=speculative))
+    decode = next(span for span in trace.spans if span.name == "llm.json.decode")
+    return text, decode.attrs["generated_tokens"], decode.duration, decode.attrs.get("speculative", {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--stub", action="store_true", help="заглушка llm.stub.StubLlama вместо файла GGUF")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    set_model_factory(create_stub if args.stub else create_llama)
+    model = get_model(args.model)
+    ocr_text = "\n".join(SAMPLE_LABEL_LINES) + "\n"
+    tokens = get_prompt_prefix_tokens(model) + get_ocr_message_tokens(model, ocr_text) + [model.token_bos(), BOT_TOKEN, LINEBREAK_TOKEN]
+
+    results = {}
+    for speculative in (False, True):
+        runs = [run_json_stage(model, tokens, speculative) for _ in range(args.runs)]
+        results[speculative] = runs
+        speeds = [generated / elapsed for _, generated, elapsed, _ in runs]
+        line = f"{'спекулятивная' if speculative else 'обычная':>14}: {statistics.median(speeds):8.1f} ток/с"
+        if speculative:
+            stats = runs[-1][3]
+            if not stats:
+                print("Спекулятивная генерация недоступна: установленный llama_cpp не дает применить грамматику к логитам")
+                sys.exit(1)
+            line += f", принято {stats['acceptance_rate']:.0%} черновика, {stats['tokens_per_step']:.2f} ток/проход"
+        print(line)
+
+    baseline = statistics.median(generated / elapsed for _, generated, elapsed, _ in results[False])
+    speculative = statistics.median(generated / elapsed for _, generated, elapsed, _ in results[True])
+    print(f"Ускорение декодирования: x{speculative / baseline:.2f}")
+
+    texts = {text for runs in results.values() for text, _, _, _ in runs}
+    if len(texts) != 1:
+        print("Результаты обычной и спекулятивной генерации различаются")
+        sys.exit(1)
+    print("Результаты совпадают")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Воспроизводимый сквозной бенчмарк: этапы и полный result_pipeline на test_files и синтетических снимках.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_suite --runs 3
+    python -m benchmarks.bench_suite --save-baseline            # сохранить эталон
+    python -m benchmarks.bench_suite --check --threshold 0.2    # сравнить с эталоном, код 1 при регрессии
+    python -m benchmarks.bench_suite --model model-q8_0.gguf    # настоящая модель GGUF вместо заглушки
+
+По умолчанию модель заменяется llm.stub.StubLlama с имитацией стоимости предзаполнения и
+декодирования, а OCR - настоящим Tesseract, если он установлен, иначе заглушкой StubOCRBackend.
+Кеши OCR и ответов модели выключаются. Задержки этапов берутся из трасс core.tracing,
+память этапов - отдельным проходом с tracemalloc. Результаты сохраняются в JSON и сравниваются
+с эталоном только при совпадающей конфигурации (модель, OCR, параметры заглушек).
+"""
+import argparse
+import contextlib
+import functools
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from PIL import Image
+from conversation_pipeline import result_pipeline
+from core.image_processing import OCR_BACKENDS, crop_fields, detect_text_regions, recognize_text, set_ocr_backend
+from core.ocr_cache import get_tesseract_version, ocr_cache
+from core.quality_gate import quality_gate
+from core.tracing import get_peak_rss, start_trace
+from core.utilities import preprocess_image, to_uint8
+from llm.model_registry import set_model_factory
+from llm.response_cache import response_cache
+from llm.stub import StubLlama
+from benchmarks.synthetic import StubOCRBackend, make_packaging_photo
+
+DEFAULT_OUTPUT = "benchmarks/results/latest.json"
+DEFAULT_BASELINE = "benchmarks/baseline.json"
+PERCENTILES = (50, 90, 99)
+
+
+def load_inputs(synthetic: int, megapixels: float) -> List[Tuple[str, np.ndarray]]:
+    """
+    Загружает изображения из test_files и строит синтетические снимки упаковки.
+    """
+    labels = [(os.path.basename(path), np.array(Image.open(path).convert("RGB")))
+              for path in sorted(glob.glob("test_files/*.jpg"))]
+    side = int((megapixels * 1e6) ** 0.5)
+    size = (side * 3 // 4, side * 4 // 3)
+    samples = list(labels)
+    for seed in range(synthetic):
+        name, label = labels[seed % len(labels)]
+        samples.append((f"packaging-{seed}", make_packaging_photo(label, size=size, seed=seed)))
+    return samples
+
+
+def configure(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Настраивает модель, OCR и кеши и возвращает описание конфигурации для сравнения с эталоном.
+    """
+    ocr_cache.enabled = False
+    response_cache.enabled = False
+
+    ocr = args.ocr
+    if ocr == "auto":
+        ocr = "tesseract" if get_tesseract_version() != "unknown" else "stub"
+    if ocr == "stub":
+        OCR_BACKENDS["stub"] = functools.partial(StubOCRBackend, args.ocr_ms_per_mp / 1000)
+        set_ocr_backend("stub")
+
+    if args.model:
+        set_model_factory(None)
+        model = {"kind": "gguf", "path": os.path.abspath(args.model)}
+    else:
+        set_model_factory(functools.partial(StubLlama, prefill_seconds=args.prefill_ms / 1000,
+                                            decode_seconds=args.decode_ms / 1000))
+        model = {"kind": "stub", "prefill_ms": args.prefill_ms, "decode_ms": args.decode_ms}
+
+    return {
+        "model": model,
+        "ocr": {"kind": ocr, "ms_per_mp": args.ocr_ms_per_mp if ocr == "stub" else None,
+                "tesseract": get_tesseract_version() if ocr == "tesseract" else None},
+        "synthetic": args.synthetic,
+        "megapixels": args.megapixels,
+    }
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Возвращает количество, среднее и процентили выборки.
+    """
+    values = np.asarray(values, dtype=float)
+    summary = {"count": int(len(values)), "mean": float(values.mean())}
+    for q in PERCENTILES:
+        summary[f"p{q}"] = float(np.percentile(values, q))
+    return summary
+
+
+def run_pipeline(samples: List[Tuple[str, np.ndarray]], runs: int, pipeline_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Прогоняет result_pipeline по всем изображениям и собирает задержки этапов из трасс.
+    """
+    totals = []
+    stages = defaultdict(list)
+    tokens = defaultdict(lambda: defaultdict(int))
+    stage_rss = defaultdict(int)
+    started = time.perf_counter()
+    for _ in range(runs):
+        for name, image in samples:
+            # Трасса включается явно, независимо от TRACING_ENABLED
+            with contextlib.redirect_stdout(io.StringIO()), start_trace("result_pipeline", enabled=True, log_path=None) as trace:
+                result_pipeline([image], **pipeline_kwargs)
+            totals.append(trace.duration)
+            per_trace = defaultdict(float)
+            for item in trace.spans:
+                per_trace[item.name] += item.duration
+                stage_rss[item.name] = max(stage_rss[item.name], item.rss_delta or 0)
+                for kind in ("prompt_tokens", "generated_tokens"):
+                    tokens[item.name][kind] += item.attrs.get(kind, 0)
+            for stage, seconds in per_trace.items():
+                stages[stage].append(seconds)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "pipeline": dict(summarize(totals), throughput=len(totals) / elapsed, peak_rss=get_peak_rss()),
+        "stages": {},
+    }
+    for stage, values in sorted(stages.items()):
+        result["stages"][stage] = dict(summarize(values), max_rss_delta=stage_rss[stage], **tokens[stage])
+        generated = tokens[stage].get("generated_tokens")
+        if generated:
+            result["stages"][stage]["tokens_per_second"] = generated / sum(values)
+    return result
+
+
+def measure_memory(samples: List[Tuple[str, np.ndarray]]) -> Dict[str, int]:
+    """
+    Измеряет пик выделенной Python/NumPy памяти для каждого этапа обработки изображения.
+    """
+    stages = {
+        "quality_gate": quality_gate.check,
+        "preprocess_image": lambda image: to_uint8(preprocess_image(image)),
+        "detect_text_regions": detect_text_regions,
+        "crop_fields": crop_fields,
+        "recognize_text": recognize_text,
+    }
+    peaks = defaultdict(int)
+    tracemalloc.start()
+    try:
+        for _, image in samples:
+            for stage, func in stages.items():
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                func(image)
+                peaks[stage] = max(peaks[stage], tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return dict(peaks)
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Описывает окружение запуска.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "commit": commit, "timestamp": time.time()}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta: float) -> List[str]:
+    """
+    Сравнивает медианы и p90 задержек с эталоном.
+
+    Возвращает:
+    List[str]: Описания регрессий (рост больше threshold и больше min_delta секунд).
+    """
+    rows = [("pipeline", current["pipeline"], baseline.get("pipeline", {}))]
+    rows += [(stage, values, baseline.get("stages", {}).get(stage, {})) for stage, values in current["stages"].items()]
+    regressions = []
+    print(f"\n{'этап':28s} {'p50':>10s} {'эталон':>10s} {'изм.':>8s}")
+    for stage, values, base in rows:
+        if "p50" not in base:
+            continue
+        change = values["p50"] / base["p50"] - 1 if base["p50"] else 0.0
+        print(f"{stage:28s} {values['p50'] * 1000:8.1f}мс {base['p50'] * 1000:8.1f}мс {change:+7.1%}")
+        for key in ("p50", "p90"):
+            if values[key] > base[key] * (1 + threshold) and values[key] - base[key] > min_delta:
+                regressions.append(f"{stage} {key}: {base[key] * 1000:.1f} -> {values[key] * 1000:.1f} мс")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """
+    Печатает задержки, пропускную способность и память.
+    """
+    pipeline = report["pipeline"]
+    print(f"result_pipeline: p50 {pipeline['p50'] * 1000:.1f} мс, p90 {pipeline['p90'] * 1000:.1f} мс, "
+          f"p99 {pipeline['p99'] * 1000:.1f} мс, {pipeline['throughput']:.2f} прод./с, "
+          f"пик RSS {pipeline['peak_rss'] / 2 ** 20:.0f} МБ")
+    print(f"\n{'этап':28s} {'p50':>9s} {'p90':>9s} {'p99':>9s} {'ток/с':>9s} {'память':>9s}")
+    for stage, values in report["stages"].items():
+        memory = report["memory"].get(stage)
+        print(f"{stage:28s} {values['p50'] * 1000:7.1f}мс {values['p90'] * 1000:7.1f}мс {values['p99'] * 1000:7.1f}мс "
+              f"{values.get('tokens_per_second', 0):9.0f} {'' if memory is None else f'{memory / 2 ** 20:7.1f}МБ':>9s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Повторов на каждое изображение.")
+    parser.add_argument("--synthetic", type=int, default=2, help="Количество синтетических снимков упаковки.")
+    parser.add_argument("--megapixels", type=float, default=12.0, help="Размер синтетических снимков.")
+    parser.add_argument("--model", default=None, help="Путь к GGUF; без него используется StubLlama.")
+    parser.add_argument("--prefill-ms", type=float, default=0.2, help="Стоимость токена контекста в заглушке.")
+    parser.add_argument("--decode-ms", type=float, default=2.0, help="Стоимость генерации токена в заглушке.")
+    parser.add_argument("--ocr", choices=("auto", "tesseract", "stub"), default="auto")
+    parser.add_argument("--ocr-ms-per-mp", type=float, default=300.0, help="Стоимость мегапикселя в заглушке OCR.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Сравнить с эталоном и завершиться с кодом 1 при регрессии.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый относительный рост задержки.")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Игнорировать рост меньше этого значения.")
+    args = parser.parse_args()
+
+    config = configure(args)
+    pipeline_kwargs = {"model_path": args.model} if args.model else {}
+    samples = load_inputs(args.synthetic, args.megapixels)
+    print(f"Изображений: {len(samples)}, повторов: {args.runs}, модель: {config['model']['kind']}, OCR: {config['ocr']['kind']}")
+
+    # Прогрев: загрузка модели и снимок префикса промпта не входят в замер
+    run_pipeline(samples[:1], 1, pipeline_kwargs)
+    report = {"config": config, "environment": environment()}
+    report.update(run_pipeline(samples, args.runs, pipeline_kwargs))
+    report["memory"] = measure_memory(samples)
+    print_report(report)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {args.output}")
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Эталон сохранен: {args.baseline}")
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"Эталон {args.baseline} не найден")
+            sys.exit(2)
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if report["config"] != baseline.get("config"):
+            print("Конфигурация отличается от эталона, сравнение невозможно")
+            sys.exit(2)
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms / 1000)
+        if regressions:
+            print("\nРегрессии:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
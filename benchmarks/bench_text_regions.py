@@ -0,0 +1,58 @@
+"""
+Замер поиска областей текста и времени OCR по областям и по всему кадру.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_text_regions --photos 5
+
+Для изображений из test_files и синтетических снимков упаковки (этикетка из test_files на
+пестром фоне 12 Мп) выводится время detect_text_regions() и доля кадра, которая уходит в OCR.
+Если установлен Tesseract, дополнительно сравнивается время recognize_text() на всем кадре
+и recognize_regions() на найденных областях.
+"""
+import argparse
+import glob
+import time
+import numpy as np
+from PIL import Image
+from core.image_processing import detect_text_regions, recognize_regions, recognize_text
+from benchmarks.synthetic import make_packaging_photo
+
+
+def timed(func, *args):
+    """
+    Возвращает результат функции и время ее выполнения в секундах.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--photos", type=int, default=5, help="Количество синтетических снимков упаковки.")
+    parser.add_argument("--ocr", action="store_true", help="Сравнить время Tesseract на кадре и на областях.")
+    args = parser.parse_args()
+
+    labels = [(path, np.array(Image.open(path).convert("RGB"))) for path in sorted(glob.glob("test_files/*.jpg"))]
+    samples = list(labels)
+    for seed in range(args.photos):
+        path, label = labels[seed % len(labels)]
+        samples.append((f"упаковка seed={seed} ({path})", make_packaging_photo(label, seed=seed)))
+
+    for name, image in samples:
+        regions, seconds = timed(detect_text_regions, image)
+        area = image.shape[0] * image.shape[1]
+        coverage = sum(w * h for _, _, w, h in regions) / area if regions else 1.0
+        print(f"{name}\n  поиск {seconds * 1000:6.1f} мс, областей {len(regions)}, доля кадра для OCR {coverage:.0%}")
+        if args.ocr and regions:
+            try:
+                _, full = timed(recognize_text, image)
+                _, cropped = timed(recognize_regions, image, regions)
+            except Exception as e:
+                print(f"  OCR пропущен: {e}")
+                continue
+            print(f"  OCR кадра {full:.2f} с, OCR областей {cropped:.2f} с, ускорение x{full / cropped:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Замер нормализации масштаба перед OCR: время и точность распознавания с ней и без нее.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_text_scale --runs 3 --megapixels 12
+
+Для каждого изображения из test_files и его копии, увеличенной до размера снимка телефона,
+выводится оценка x-высоты текста (estimate_x_height()) и выбранный масштаб. Если установлен
+Tesseract, изображение распознается image_to_text() без нормализации и с ней, и для каждого
+режима печатается медианное время и точность относительно эталона test_files/<имя>.txt:
+- символьная точность - 1 - (расстояние Левенштейна / длина эталона) по тексту с пробелами вместо
+  переводов строк; зависит от порядка строк, поэтому на макетах в несколько колонок занижена;
+- символы в верных словах - доля символов эталона в словах, распознанных без ошибок (без учета порядка).
+"""
+import argparse
+import glob
+import os
+import time
+from collections import Counter
+import cv2
+import numpy as np
+from PIL import Image
+from core import image_processing
+from core.document_conversion import ImageData
+from core.document_generator import image_to_text
+from core.image_processing import estimate_x_height, normalize_text_scale
+from core.utilities import preprocess_image, to_uint8
+
+
+def levenshtein(a: str, b: str) -> int:
+    """
+    Возвращает расстояние Левенштейна между строками.
+    """
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def character_accuracy(text: str, truth: str) -> float:
+    """
+    Возвращает символьную точность текста относительно эталона (пробельные символы схлопываются).
+    """
+    text, truth = " ".join(text.split()), " ".join(truth.split())
+    return max(0.0, 1 - levenshtein(text, truth) / max(1, len(truth)))
+
+
+def word_character_recall(text: str, truth: str) -> float:
+    """
+    Возвращает долю символов эталона в словах, распознанных без ошибок.
+    """
+    found, expected = Counter(text.split()), Counter(truth.split())
+    total = sum(len(word) * count for word, count in expected.items())
+    matched = sum(len(word) * min(count, found[word]) for word, count in expected.items())
+    return matched / max(1, total)
+
+
+def recognize(image: np.ndarray, normalize: bool, runs: int):
+    """
+    Распознает текст с нормализацией масштаба или без нее.
+
+    :return: Медианное время в секундах и текст или None, если Tesseract недоступен.
+    """
+    image_processing.OCR_SCALE_NORMALIZATION = normalize
+    times, text = [], None
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            text = image_to_text(ImageData(array=image), detection_threshold=0, use_cache=False)
+            times.append(time.perf_counter() - start)
+    except Exception as e:
+        print(f"  OCR пропущен: {e}")
+        return None, None
+    return float(np.median(times)), text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--megapixels", type=float, default=12.0, help="Размер увеличенной копии изображения.")
+    args = parser.parse_args()
+
+    samples = []
+    for path in sorted(glob.glob("test_files/*.jpg")):
+        truth_path = os.path.splitext(path)[0] + ".txt"
+        truth = open(truth_path, encoding="utf-8").read() if os.path.exists(truth_path) else None
+        image = to_uint8(preprocess_image(np.array(Image.open(path).convert("RGB"))))
+        samples.append((path, image, truth))
+        scale = (args.megapixels * 1e6 / (image.shape[0] * image.shape[1])) ** 0.5
+        if scale > 1:
+            size = (round(image.shape[1] * scale), round(image.shape[0] * scale))
+            samples.append((f"{path} x{scale:.1f}", cv2.resize(image, size, interpolation=cv2.INTER_CUBIC), truth))
+
+    default = image_processing.OCR_SCALE_NORMALIZATION
+    totals = {False: [], True: []}
+    for name, image, truth in samples:
+        start = time.perf_counter()
+        x_height, source = estimate_x_height(image)
+        estimate_seconds = time.perf_counter() - start
+        _, scale = normalize_text_scale(image)
+        x_height = f"{x_height:.1f}" if x_height is not None else "-"
+        print(f"{name} ({image.shape[1]}x{image.shape[0]}): x-высота {x_height} ({source}), "
+              f"масштаб {scale:.2f}, оценка {estimate_seconds * 1000:.1f} мс")
+
+        for normalize in (False, True):
+            seconds, text = recognize(image, normalize, args.runs)
+            if text is None:
+                break
+            line = f"  {'с нормализацией' if normalize else 'без нормализации':17s} {seconds:7.2f} с"
+            if truth is not None:
+                accuracy, recall = character_accuracy(text, truth), word_character_recall(text, truth)
+                totals[normalize].append((seconds, accuracy, recall))
+                line += f"  символьная точность {accuracy:.3f}  символы в верных словах {recall:.3f}"
+            print(line)
+    image_processing.OCR_SCALE_NORMALIZATION = default
+
+    if totals[False] and totals[True]:
+        print("Итого по изображениям с эталоном:")
+        for normalize, rows in totals.items():
+            seconds, accuracy, recall = (float(np.mean(column)) for column in zip(*rows))
+            print(f"  {'с нормализацией' if normalize else 'без нормализации':17s} {seconds:7.2f} с/изобр.  "
+                  f"символьная точность {accuracy:.3f}  символы в верных словах {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
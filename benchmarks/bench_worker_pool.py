@@ -0,0 +1,116 @@
+"""
+Подбор соотношения процессов и потоков пула модели (llm.worker_pool) на текущем CPU.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_worker_pool --model model-q8_0.gguf --requests 16
+    python -m benchmarks.bench_worker_pool --layouts 1x8,2x4,4x2 --requests 16
+    python -m benchmarks.bench_worker_pool --stub --requests 16
+
+По умолчанию проверяются все раскладки "процессы x потоки", занимающие все доступные ядра.
+Для каждой раскладки одинаковый набор текстов (кеш ответов выключен) отправляется в пул сразу
+целиком, и печатаются запросы в секунду, суммарная скорость генерации, медианное время запроса в процессе
+и память: RSS каждого процесса, общие страницы файла модели и собственная память процессов.
+"""
+import argparse
+import functools
+import statistics
+import time
+from typing import List, Tuple
+from constant import MODEL_PATH
+from benchmarks.synthetic import SAMPLE_LABEL_LINES
+from llm.stub import StubLlama
+from llm.worker_pool import ModelWorkerPool, get_available_cpus
+
+MB = 1024 ** 2
+
+
+def default_layouts(cores: int) -> List[Tuple[int, int]]:
+    """
+    Возвращает раскладки, занимающие все ядра: (1, cores), (2, cores // 2), ...
+
+    :param cores: Количество доступных ядер.
+    :return: Пары (процессов, потоков на процесс).
+    """
+    return [(workers, cores // workers) for workers in range(1, cores + 1) if cores % workers == 0]
+
+
+def parse_layouts(value: str) -> List[Tuple[int, int]]:
+    """
+    Разбирает раскладки вида "1x8,2x4".
+
+    :param value: Строка раскладок через запятую.
+    :return: Пары (процессов, потоков на процесс).
+    """
+    return [tuple(int(part) for part in layout.lower().split("x")) for layout in value.split(",") if layout]
+
+
+def run_layout(model_path: str, workers: int, threads: int, texts: List[str], factory=None) -> dict:
+    """
+    Прогоняет тексты через пул с заданной раскладкой.
+
+    :param model_path: Путь к модели.
+    :param workers: Количество процессов.
+    :param threads: Потоков на процесс.
+    :param texts: Тексты OCR.
+    :param factory: Конструктор модели в процессах (None - llama_cpp.Llama).
+    :return: Время запуска и прогона, задержки запросов и статистика процессов.
+    """
+    started = time.perf_counter()
+    with ModelWorkerPool(model_path, workers=workers, threads=threads, factory=factory) as pool:
+        load_seconds = time.perf_counter() - started
+        # Прогрев: первый запрос каждого процесса вычисляет и запоминает префикс промпта
+        for future in [pool.submit(SAMPLE_LABEL_LINES[0], use_cache=False) for _ in range(workers)]:
+            future.result()
+        warm = {item["worker"]: (item["generated_tokens"], item["busy_seconds"]) for item in pool.stats()}
+
+        started = time.perf_counter()
+        submitted = {}
+        futures = []
+        for text in texts:
+            future = pool.submit(text, use_cache=False)
+            submitted[id(future)] = time.perf_counter()
+            future.add_done_callback(lambda done: setattr(done, "latency", time.perf_counter() - submitted[id(done)]))
+            futures.append(future)
+        for future in futures:
+            future.result()
+        wall = time.perf_counter() - started
+        stats = pool.stats()
+
+    generated = sum(item["generated_tokens"] - warm[item["worker"]][0] for item in stats)
+    return {"load_seconds": load_seconds, "wall": wall, "generated": generated,
+            "latency": statistics.median(future.latency for future in futures), "stats": stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--stub", action="store_true", help="заглушка llm.stub.StubLlama вместо файла GGUF")
+    parser.add_argument("--layouts", default=None, help="раскладки вида 1x8,2x4 (по умолчанию все, занимающие ядра)")
+    parser.add_argument("--requests", type=int, default=16)
+    args = parser.parse_args()
+
+    cores = len(get_available_cpus())
+    layouts = parse_layouts(args.layouts) if args.layouts else default_layouts(cores)
+    factory = functools.partial(StubLlama, prefill_seconds=0.0002, decode_seconds=0.01) if args.stub else None
+    # Разные тексты, чтобы каждый запрос вычислял свою часть промпта
+    texts = ["\n".join(SAMPLE_LABEL_LINES + [f"Партия № {index:05d}"]) for index in range(args.requests)]
+
+    print(f"Доступно ядер: {cores}, запросов: {args.requests}")
+    print(f"{'раскладка':>10} {'запуск, с':>10} {'запр/с':>8} {'ток/с':>8} {'задержка, с':>12} "
+          f"{'RSS max, МБ':>12} {'общие, МБ':>10} {'собств., МБ':>12}")
+    for workers, threads in layouts:
+        result = run_layout(args.model, workers, threads, texts, factory=factory)
+        stats = result["stats"]
+        print(f"{f'{workers}x{threads}':>10} {result['load_seconds']:10.2f} {args.requests / result['wall']:8.2f} "
+              f"{result['generated'] / result['wall']:8.1f} {result['latency']:12.2f} "
+              f"{max(item.get('rss', 0) for item in stats) / MB:12.0f} "
+              f"{max(item.get('rss_file', 0) for item in stats) / MB:10.0f} "
+              f"{sum(item.get('rss_anon', 0) for item in stats) / MB:12.0f}")
+        for item in stats:
+            print(f"{'':>10} процесс {item['worker']} (ядра {item['cpus']}): {item['completed']} запр., "
+                  f"{item['tokens_per_second']:.1f} ток/с, загрузка {item['utilization']:.0%}, "
+                  f"RSS {item.get('rss', 0) / MB:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
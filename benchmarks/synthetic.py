@@ -0,0 +1,175 @@
+"""
+Генерация синтетических результатов распознавания и снимков для бенчмарков.
+"""
+import time
+import cv2
+import numpy as np
+import pandas as pd
+
+WORDS = ["Состав:", "молоко", "нормализованное,", "пюре", "персиковое,", "сахар,", "Белки", "2,8", "г", "Жиры", "2,7", "ккал", "|", "  "]
+
+
+def make_ocr_dataframe(n_lines: int = 200, words_per_line: int = 8, n_fields: int = 20, seed: int = 0) -> pd.DataFrame:
+    """
+    Строит DataFrame в формате process_image(): строки уровня 4 и 5 Tesseract и найденные графы.
+
+    :param n_lines: Количество текстовых линий.
+    :param words_per_line: Среднее количество слов в линии.
+    :param n_fields: Количество граф (горизонтальных линий таблицы).
+    :param seed: Зерно генератора случайных чисел.
+    :return: DataFrame с колонками block_num, par_num, line_num, word_num, left, top, width, height, conf, text, field_id.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for line in range(n_lines):
+        block, par, line_num = line // 50 + 1, line // 10 % 5 + 1, line % 10 + 1
+        top = line * 30 + int(rng.integers(0, 5))
+        count = max(1, int(rng.poisson(words_per_line)))
+        lefts = np.sort(rng.choice(2000, size=count, replace=False))
+        rows.append(dict(block_num=block, par_num=par, line_num=line_num, word_num=0, left=int(lefts[0]), top=top,
+                         width=int(lefts[-1] - lefts[0] + 60), height=25, conf=-1.0, text=np.nan))
+        for word_index, left in enumerate(rng.permutation(lefts), start=1):
+            word = WORDS[int(rng.integers(0, len(WORDS)))]
+            text = int(rng.integers(0, 300)) if rng.random() < 0.1 else word
+            rows.append(dict(block_num=block, par_num=par, line_num=line_num, word_num=word_index, left=int(left),
+                             top=top + int(rng.integers(0, 3)), width=60, height=22, conf=float(rng.integers(0, 100)), text=text))
+    df = pd.DataFrame(rows)
+    df["field_id"] = None
+    fields = []
+    for i in range(1, n_fields + 1):
+        line = int(rng.integers(0, n_lines))
+        assigned = rng.random() < 0.7
+        key = df.loc[df["word_num"] == 0].iloc[line][["block_num", "par_num", "line_num"]] if assigned else (-i, -i, -i)
+        fields.append(dict(text=" ", left=int(rng.integers(0, 1500)), top=line * 30 + 20, width=400, height=2, field_id=i,
+                           block_num=key[0], par_num=key[1], line_num=key[2], conf=90))
+    return pd.concat([df, pd.DataFrame(fields)], ignore_index=True)
+
+
+def make_table_boxes(n_lines: int = 2000, n_fields: int = 2000, seed: int = 0):
+    """
+    Строит текстовые линии уровня 4 и графы таблицы с пересекающимися координатами.
+
+    :param n_lines: Количество текстовых линий.
+    :param n_fields: Количество граф.
+    :param seed: Зерно генератора случайных чисел.
+    :return: Кортеж (lines, fields) из двух DataFrame с колонками left, top, width, height и ключами линий.
+    """
+    rng = np.random.default_rng(seed)
+    columns = max(1, n_lines // 500)
+    lines = pd.DataFrame({
+        "left": rng.integers(0, 1500, n_lines) + (np.arange(n_lines) % columns) * 2000,
+        "top": np.arange(n_lines) // columns * 28 + rng.integers(0, 6, n_lines),
+        "width": rng.integers(100, 900, n_lines),
+        "height": rng.integers(18, 40, n_lines),
+        "block_num": np.arange(n_lines) // 100 + 1,
+        "par_num": np.arange(n_lines) // 10 % 10 + 1,
+        "line_num": np.arange(n_lines) % 10 + 1,
+    })
+    height = int(lines["top"].max()) + 40
+    fields = pd.DataFrame({
+        "left": rng.integers(0, 2000 * columns, n_fields),
+        "top": rng.integers(0, height, n_fields),
+        "width": rng.integers(20, 1200, n_fields),
+        "height": rng.integers(1, 5, n_fields),
+        "block_num": -np.arange(1, n_fields + 1),
+        "par_num": -np.arange(1, n_fields + 1),
+        "line_num": -np.arange(1, n_fields + 1),
+    })
+    return lines, fields
+
+
+def make_packaging_photo(label: np.ndarray, size=(3000, 4000), n_shapes: int = 15, seed: int = 0) -> np.ndarray:
+    """
+    Генерирует снимок упаковки: плавный цветной фон с крупными фигурами и вставленной этикеткой.
+
+    Параметры:
+    - label (np.ndarray): Изображение этикетки RGB, которое вставляется в случайное место.
+    - size (Tuple[int, int]): Высота и ширина снимка.
+    - n_shapes (int): Количество залитых кругов, имитирующих рисунки на упаковке.
+    - seed (int): Зерно генератора.
+
+    Возвращает:
+    np.ndarray: Снимок RGB uint8.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = size
+    photo = cv2.resize(rng.integers(0, 255, (12, 16, 3), dtype=np.uint8), (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(n_shapes):
+        color = tuple(int(value) for value in rng.integers(0, 255, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(photo, center, int(rng.integers(height // 40, height // 7)), color, -1)
+    top = int(rng.integers(0, height - label.shape[0]))
+    left = int(rng.integers(0, width - label.shape[1]))
+    photo[top:top + label.shape[0], left:left + label.shape[1]] = label
+    return photo
+
+
+# Кодировка цифр EAN-13: наборы L и G для левой половины (выбор по первой цифре) и R для правой
+EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+EAN_G = ["0100111", "0110011", "0011011", "0100001", "0011101", "0111001", "0000101", "0010001", "0001001", "0010111"]
+EAN_R = ["1110010", "1100110", "1101100", "1000010", "1011100", "1001110", "1010000", "1000100", "1001000", "1110100"]
+EAN_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+
+def make_ean13_barcode(code: str, module: int = 3, height: int = 180, quiet: int = 11) -> np.ndarray:
+    """
+    Рисует штрихкод EAN-13.
+
+    Параметры:
+    - code (str): 13 цифр с контрольной.
+    - module (int): Ширина одного модуля в пикселях.
+    - height (int): Высота штрихов в пикселях.
+    - quiet (int): Ширина белых полей в модулях.
+
+    Возвращает:
+    np.ndarray: Изображение RGB uint8.
+    """
+    digits = [int(digit) for digit in code]
+    left = "".join((EAN_L if parity == "L" else EAN_G)[digit] for parity, digit in zip(EAN_PARITY[digits[0]], digits[1:7]))
+    pattern = "0" * quiet + "101" + left + "01010" + "".join(EAN_R[digit] for digit in digits[7:]) + "101" + "0" * quiet
+    row = np.array([0 if bit == "1" else 255 for bit in pattern], dtype=np.uint8).repeat(module)
+    return np.repeat(np.repeat(row[None, :, None], height, axis=0), 3, axis=2)
+
+
+SAMPLE_LABEL_LINES = [
+    "Йогурт «Агуша» с персиком, обогащенный пробиотическими микроорганизмами",
+    "Состав: молоко нормализованное, фруктовый наполнитель «Персик» (сахар, вода,",
+    "концентрированное персиковое пюре, крахмал кукурузный, загуститель - пектины),",
+    "пребиотик - олигофруктоза, концентрат сывороточных белков, закваска.",
+    "Пищевая ценность в 100 г продукта: жиры - 2,7 г, белки - 2,8 г, углеводы - 9,4 г",
+    "(в т.ч. сахароза - 5,8 г), кальций - 88 мг. Энергетическая ценность 307 кДж/73 ккал.",
+    "Для питания детей старше 8 месяцев. Хранить при температуре от +2 до +6 °С.",
+]
+
+
+class StubOCRBackend:
+    """
+    Детерминированная замена Tesseract для бенчмарков без установленного OCR.
+
+    Возвращает строки текста этикетки в формате TSV-вывода tesseract и имитирует
+    стоимость распознавания, пропорциональную площади изображения.
+
+    :param seconds_per_megapixel: Имитируемое время распознавания одного мегапикселя.
+    """
+    name = "stub"
+
+    def __init__(self, seconds_per_megapixel: float = 0.3):
+        self.seconds_per_megapixel = seconds_per_megapixel
+
+    def image_to_data(self, image: np.ndarray, lang: str, config: str) -> pd.DataFrame:
+        height, width = image.shape[:2]
+        time.sleep(self.seconds_per_megapixel * height * width / 1e6)
+        rows = [dict(level=1, page_num=1, block_num=0, par_num=0, line_num=0, word_num=0,
+                     left=0, top=0, width=width, height=height, conf=-1.0, text=np.nan)]
+        line_height = max(1, height // (len(SAMPLE_LABEL_LINES) + 1))
+        for line_num, line in enumerate(SAMPLE_LABEL_LINES, start=1):
+            top = line_num * line_height // 2
+            rows.append(dict(level=4, page_num=1, block_num=1, par_num=1, line_num=line_num, word_num=0,
+                             left=0, top=top, width=width, height=line_height // 2, conf=-1.0, text=np.nan))
+            words = line.split()
+            word_width = max(1, width // len(words))
+            for word_num, word in enumerate(words, start=1):
+                rows.append(dict(level=5, page_num=1, block_num=1, par_num=1, line_num=line_num, word_num=word_num,
+                                 left=(word_num - 1) * word_width, top=top, width=word_width, height=line_height // 2,
+                                 conf=90.0, text=word))
+        return pd.DataFrame(rows)
@@ -0,0 +1,457 @@
+from core.document_conversion import extract_images
+from core.document_generator import generate_output_text
+from core.quality_gate import quality_gate, summarize_rejections
+from core.staged_pipeline import Stage, StagedPipeline
+from core.tracing import start_trace
+from conversation_pipeline import get_data
+from llm.model_registry import get_model
+from llm.utiils import pipeline, parse_json_string, compact_ocr_text_for_model
+from llm.verdict_index import lookup_product, remember_product
+from llm.worker_pool import ModelWorkerPool
+from constant import CATALOG_STAGE_QUEUE_SIZE, CATALOG_STAGE_WORKERS, LLM_POOL_THREADS, LLM_POOL_WORKERS, MODEL_PATH
+import numpy as np
+from PIL import Image
+import argparse
+import csv
+import functools
+import itertools
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+# Суффиксы номера снимка одного продукта: "name_1.jpg", "name-2.jpg", "name (3).jpg"
+PHOTO_SUFFIX_RE = re.compile(r"(?:[ _-]\d{1,2}|\s*\(\d{1,2}\))$")
+
+
+def product_key(file_name: str) -> str:
+    """
+    Определяет идентификатор продукта по имени файла фотографии.
+
+    Параметры:
+    - file_name (str): Имя файла.
+
+    Возвращает:
+    str: Имя файла без расширения и суффикса номера снимка.
+    """
+    stem = os.path.splitext(file_name)[0]
+    return PHOTO_SUFFIX_RE.sub("", stem).strip() or stem
+
+
+def iter_directory(root: str) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Обходит каталог и группирует фотографии по продуктам.
+
+    Параметры:
+    - root (str): Каталог с фотографиями.
+
+    Возвращает:
+    Iterator[Tuple[str, List[str]]]: Пары (идентификатор продукта, пути к фотографиям).
+
+    Подробности:
+    - Фотографии во вложенном каталоге считаются одним продуктом с идентификатором - путем каталога.
+    - Фотографии в корне группируются по имени файла без суффикса номера снимка.
+    - Порядок обхода детерминирован, что позволяет продолжать прерванный запуск.
+    """
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        images = sorted(name for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not images:
+            continue
+        relative = os.path.relpath(directory, root)
+        if relative != ".":
+            yield relative, [os.path.join(directory, name) for name in images]
+            continue
+        images.sort(key=lambda name: (product_key(name), name))
+        for key, names in itertools.groupby(images, key=product_key):
+            yield key, [os.path.join(directory, name) for name in names]
+
+
+def iter_manifest(path: str) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Читает манифест каталога и группирует фотографии по продуктам.
+
+    Параметры:
+    - path (str): Файл CSV с колонками product_id и path или JSONL с полями product_id и path/paths.
+
+    Возвращает:
+    Iterator[Tuple[str, List[str]]]: Пары (идентификатор продукта, пути к фотографиям).
+
+    Подробности:
+    - Строки одного продукта должны идти подряд. Относительные пути считаются от каталога манифеста.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8", newline="") as file:
+        if path.lower().endswith(".csv"):
+            rows = ({"product_id": row["product_id"], "paths": [row["path"]]} for row in csv.DictReader(file))
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for product_id, group in itertools.groupby(rows, key=lambda row: str(row["product_id"])):
+            paths = []
+            for row in group:
+                paths.extend(row.get("paths") or [row["path"]])
+            yield product_id, [os.path.join(base, p) for p in paths]
+
+
+def iter_products(source: str) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Возвращает продукты каталога из каталога с фотографиями или из манифеста.
+
+    Параметры:
+    - source (str): Каталог или файл манифеста.
+
+    Возвращает:
+    Iterator[Tuple[str, List[str]]]: Пары (идентификатор продукта, пути к фотографиям).
+    """
+    if os.path.isdir(source):
+        return iter_directory(source)
+    return iter_manifest(source)
+
+
+def new_record(product_id: str, paths: List[str]) -> Dict[str, Any]:
+    """
+    Создает пустую запись результата продукта.
+
+    Параметры:
+    - product_id (str): Идентификатор продукта.
+    - paths (List[str]): Пути к фотографиям продукта.
+
+    Возвращает:
+    dict: Запись с текстом OCR, сжатым текстом для модели, JSON, правилами, вердиктом,
+    штрихкодом и признаком результата из индекса, отчетами проверки качества снимков,
+    временем этапов и ошибкой (если была).
+    """
+    return {"product_id": product_id, "paths": paths, "ocr_text": None, "compacted_text": None,
+            "compaction": None, "json": None, "rules": None, "verdict": None, "barcode": None,
+            "indexed": False, "quality": None, "timings": {}, "error": None}
+
+
+def set_result(record: Dict[str, Any], result: Tuple[str, str, str]) -> None:
+    """
+    Заполняет запись результатом pipeline().
+
+    Параметры:
+    - record (dict): Запись продукта.
+    - result (Tuple[str, str, str]): Правила, JSON и ответ.
+    """
+    rules, json_data, answer = result
+    record.update(json=parse_json_string(json_data) or json_data, rules=rules, verdict=answer.strip())
+
+
+def load_product(record: Dict[str, Any], **pipeline_kwargs: Any) -> Dict[str, Any]:
+    """
+    Этап предобработки: чтение фотографий, поиск штрихкода в индексе, проверка качества и предобработка снимков.
+
+    Параметры:
+    - record (dict): Запись продукта.
+    - pipeline_kwargs: Дополнительные параметры для pipeline() (область индекса по штрихкоду).
+
+    Возвращает:
+    dict: Та же запись; обработанные снимки сохраняются в record["files"] до этапа OCR.
+    Если продукт найден в индексе, запись сразу заполняется результатом и indexed=True.
+    """
+    timings = record["timings"]
+    images = [np.array(Image.open(path).convert("RGB")) for path in record["paths"]]
+
+    start = time.perf_counter()
+    record["barcode"], cached = lookup_product(images, **pipeline_kwargs)
+    timings["barcode"] = time.perf_counter() - start
+    if cached is not None:
+        set_result(record, cached)
+        record["indexed"] = True
+        return record
+
+    start = time.perf_counter()
+    reports = [quality_gate.check(image) for image in images]
+    record["quality"] = [report.to_dict() for report in reports]
+    timings["quality"] = time.perf_counter() - start
+    if not any(report.passed for report in reports):
+        record["error"] = summarize_rejections(reports)
+        return record
+
+    start = time.perf_counter()
+    record["files"] = [get_data(image, source=path) for image, path, report in zip(images, record["paths"], reports) if report.passed]
+    timings["preprocess"] = time.perf_counter() - start
+    return record
+
+
+def recognize_product(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Этап OCR: распознавание текста обработанных снимков.
+
+    Параметры:
+    - record (dict): Запись продукта после load_product().
+
+    Возвращает:
+    dict: Та же запись с заполненным ocr_text или ошибкой, если текст не распознан.
+    """
+    files = record.pop("files", None)
+    if record["error"] or record["indexed"]:
+        return record
+    start = time.perf_counter()
+    text_from_ocr = generate_output_text(extract_images(files=files), detection_threshold=0)
+    record["timings"]["ocr"] = time.perf_counter() - start
+    record["ocr_text"] = text_from_ocr
+    if len(text_from_ocr.strip()) <= 40:
+        record["error"] = "Не удалось распознать текст"
+    return record
+
+
+def compact_product(record: Dict[str, Any], model_path: str = MODEL_PATH, n_ctx: int = 4096,
+                    explain: bool = False, **pipeline_kwargs: Any) -> Dict[str, Any]:
+    """
+    Этап сжатия: отбор строк текста OCR под бюджет контекста модели.
+
+    Параметры:
+    - record (dict): Запись продукта после recognize_product().
+    - model_path (str): Путь к модели (нужен ее токенизатор).
+    - n_ctx (int): Максимальная длина контекста.
+    - explain (bool): Будут ли генерироваться правила и ответ моделью.
+    - pipeline_kwargs: Прочие параметры pipeline() (не используются).
+
+    Возвращает:
+    dict: Та же запись с compacted_text и отчетом compaction.
+    """
+    if record["error"] or record["indexed"]:
+        return record
+    start = time.perf_counter()
+    model = get_model(model_path, n_ctx=n_ctx, reset=False)
+    text, report = compact_ocr_text_for_model(record["ocr_text"], model, n_ctx, explain=explain)
+    record["timings"]["compaction"] = time.perf_counter() - start
+    record.update(compacted_text=text, compaction=report.to_dict())
+    return record
+
+
+def analyze_product(record: Dict[str, Any], run: Callable[..., Tuple[str, str, str]] = pipeline,
+                    **pipeline_kwargs: Any) -> Dict[str, Any]:
+    """
+    Этап модели: извлечение JSON и проверка требований.
+
+    Параметры:
+    - record (dict): Запись продукта после compact_product() или recognize_product().
+    - run (Callable): Функция генерации (pipeline() или ModelWorkerPool.run).
+    - pipeline_kwargs: Дополнительные параметры для pipeline().
+
+    Возвращает:
+    dict: Та же запись с JSON, правилами и вердиктом.
+
+    Подробности:
+    - Если этапа сжатия не было (compacted_text не заполнен), текст OCR сжимает сама функция генерации.
+    """
+    if record["error"] or record["indexed"]:
+        return record
+    start = time.perf_counter()
+    compacted = record["compacted_text"] is not None
+    result = run(record["compacted_text"] if compacted else record["ocr_text"], compact=not compacted, **pipeline_kwargs)
+    record["timings"]["llm"] = time.perf_counter() - start
+    set_result(record, result)
+    remember_product(record["barcode"], result, **pipeline_kwargs)
+    return record
+
+
+@start_trace("catalog_product")
+def process_product(product_id: str, paths: List[str], **pipeline_kwargs: Any) -> Dict[str, Any]:
+    """
+    Выполняет полный пайплайн для одного продукта и формирует запись результата.
+
+    Параметры:
+    - product_id (str): Идентификатор продукта.
+    - paths (List[str]): Пути к фотографиям продукта.
+    - pipeline_kwargs: Дополнительные параметры для pipeline().
+
+    Возвращает:
+    dict: Запись результата (см. new_record()).
+    """
+    record = new_record(product_id, paths)
+    try:
+        load_product(record, **pipeline_kwargs)
+        recognize_product(record)
+        compact_product(record, **pipeline_kwargs)
+        analyze_product(record, **pipeline_kwargs)
+    except Exception as e:
+        record.pop("files", None)
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def build_stages(stage_workers: Optional[Dict[str, int]] = None, queue_size: int = CATALOG_STAGE_QUEUE_SIZE,
+                 pool: Optional[ModelWorkerPool] = None, **pipeline_kwargs: Any) -> List[Stage]:
+    """
+    Создает этапы конвейера каталога.
+
+    Параметры:
+    - stage_workers (Optional[Dict[str, int]]): Количество потоков этапов preprocess, ocr и compaction
+      (по умолчанию CATALOG_STAGE_WORKERS из constant.py).
+    - queue_size (int): Емкость очереди перед каждым этапом.
+    - pool (Optional[ModelWorkerPool]): Запущенный пул процессов модели.
+    - pipeline_kwargs: Дополнительные параметры для pipeline().
+
+    Возвращает:
+    List[Stage]: Этапы preprocess, ocr, compaction и llm (с пулом - без compaction).
+
+    Подробности:
+    - Без пула этап llm работает в одном потоке: экземпляр модели из реестра общий и не потокобезопасен.
+      С пулом у этапа по потоку на процесс модели, а этапа compaction нет: текст сжимают процессы пула
+      своей моделью, чтобы основной процесс не загружал еще один экземпляр с контекстом только ради
+      токенизатора (отчет сжатия - в замере llm.compaction трассы продукта).
+    """
+    workers = dict(CATALOG_STAGE_WORKERS, **(stage_workers or {}))
+    stages = [
+        Stage("preprocess", functools.partial(load_product, **pipeline_kwargs), workers=workers["preprocess"], queue_size=queue_size),
+        Stage("ocr", recognize_product, workers=workers["ocr"], queue_size=queue_size),
+    ]
+    if pool is not None:
+        return stages + [Stage("llm", functools.partial(analyze_product, run=pool.run, **pipeline_kwargs), workers=pool.workers, queue_size=queue_size)]
+    return stages + [
+        Stage("compaction", functools.partial(compact_product, **pipeline_kwargs), workers=workers["compaction"], queue_size=queue_size),
+        Stage("llm", functools.partial(analyze_product, **pipeline_kwargs), workers=1, queue_size=queue_size),
+    ]
+
+
+def iter_records(products: Iterable[Tuple[str, List[str]]], staged: bool = True, stage_workers: Optional[Dict[str, int]] = None,
+                 pool: Optional[ModelWorkerPool] = None, stage_stats: Optional[Dict[str, dict]] = None,
+                 **pipeline_kwargs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Обрабатывает продукты и отдает записи результатов в порядке входа.
+
+    Параметры:
+    - products (Iterable[Tuple[str, List[str]]]): Пары (идентификатор продукта, пути к фотографиям).
+    - staged (bool): Обрабатывать продукты конвейером с перекрытием этапов (False - по одному).
+    - stage_workers (Optional[Dict[str, int]]): Количество потоков этапов конвейера.
+    - pool (Optional[ModelWorkerPool]): Запущенный пул процессов модели (только в режиме конвейера).
+    - stage_stats (Optional[Dict[str, dict]]): Словарь, в который после обработки записывается
+      статистика этапов конвейера (StagedPipeline.stats()).
+    - pipeline_kwargs: Дополнительные параметры для pipeline().
+
+    Возвращает:
+    Iterator[Dict[str, Any]]: Записи результатов.
+
+    Подробности:
+    - В режиме конвейера OCR и предобработка следующих продуктов выполняются, пока модель
+      обрабатывает текущий; ошибка одного продукта записывается в его запись и не влияет на остальные.
+    - Этап с загрузкой (utilization в stage_stats) около 100% ограничивает пропускную способность.
+    """
+    if not staged:
+        for product_id, paths in products:
+            yield process_product(product_id, paths, **pipeline_kwargs)
+        return
+
+    staged_pipeline = StagedPipeline(build_stages(stage_workers, pool=pool, **pipeline_kwargs), trace_name="catalog_product")
+    for item in staged_pipeline.run(new_record(product_id, paths) for product_id, paths in products):
+        record = item.value
+        record.pop("files", None)
+        if item.error is not None:
+            record["error"] = f"{type(item.error).__name__}: {item.error}"
+        yield record
+    if stage_stats is not None:
+        stage_stats.update(staged_pipeline.stats())
+
+
+def load_completed(output_path: str) -> Set[str]:
+    """
+    Читает идентификаторы завершенных продуктов из выходного файла и удаляет недописанную последнюю строку.
+
+    Параметры:
+    - output_path (str): Путь к выходному JSONL.
+
+    Возвращает:
+    Set[str]: Значения product_id полностью записанных продуктов.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    valid_size = 0
+    with open(output_path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            valid_size += len(line)
+            try:
+                completed.add(str(json.loads(line)["product_id"]))
+            except (ValueError, KeyError, TypeError):
+                print(f"Пропущена поврежденная строка в {output_path}")
+    if valid_size != os.path.getsize(output_path):
+        with open(output_path, "r+b") as file:
+            file.truncate(valid_size)
+    return completed
+
+
+def run_catalog(source: str, output_path: str, resume: bool = True, limit: int = None, staged: bool = True,
+                stage_workers: Optional[Dict[str, int]] = None, pool: Optional[ModelWorkerPool] = None,
+                stage_stats: Optional[Dict[str, dict]] = None, **pipeline_kwargs: Any) -> int:
+    """
+    Обрабатывает каталог продуктов и потоково пишет результаты в JSONL.
+
+    Параметры:
+    - source (str): Каталог с фотографиями или файл манифеста.
+    - output_path (str): Путь к выходному JSONL.
+    - resume (bool): Продолжить с места остановки, если выходной файл уже существует.
+    - limit (int): Максимальное количество продуктов за запуск.
+    - staged (bool): Обрабатывать продукты конвейером с перекрытием этапов (см. iter_records()).
+    - stage_workers (Optional[Dict[str, int]]): Количество потоков этапов конвейера.
+    - pool (Optional[ModelWorkerPool]): Запущенный пул процессов модели (см. iter_records()).
+    - stage_stats (Optional[Dict[str, dict]]): Словарь для статистики этапов конвейера (см. iter_records()).
+    - pipeline_kwargs: Дополнительные параметры для pipeline().
+
+    Возвращает:
+    int: Количество продуктов, обработанных за этот запуск.
+
+    Подробности:
+    - Продукты обрабатываются в детерминированном порядке, каждая запись дописывается
+      и сбрасывается на диск сразу после обработки.
+    - При продолжении пропускаются продукты, чей product_id уже записан в выходной файл,
+      поэтому добавление, удаление и перестановка продуктов между запусками не приводят
+      к пропуску необработанных или повторной обработке готовых продуктов.
+    """
+    completed = load_completed(output_path) if resume else set()
+    products = ((product_id, paths) for product_id, paths in iter_products(source) if product_id not in completed)
+    if limit is not None:
+        products = itertools.islice(products, limit)
+
+    processed = 0
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as output:
+        for record in iter_records(products, staged=staged, stage_workers=stage_workers, pool=pool,
+                                   stage_stats=stage_stats, **pipeline_kwargs):
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            os.fsync(output.fileno())
+            processed += 1
+            print(f"[{len(completed) + processed}] {record['product_id']}: {record['verdict'] or record['error']}")
+    return processed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Пакетная проверка каталога продуктов с записью результатов в JSONL.")
+    parser.add_argument("source", nargs="?", default="test_files", help="Каталог с фотографиями или манифест (CSV/JSONL).")
+    parser.add_argument("--output", default="catalog_results.jsonl", help="Выходной JSONL.")
+    parser.add_argument("--no-resume", action="store_true", help="Начать заново, перезаписав выходной файл.")
+    parser.add_argument("--limit", type=int, default=None, help="Максимальное количество продуктов за запуск.")
+    parser.add_argument("--sequential", action="store_true", help="Обрабатывать продукты по одному, без конвейера.")
+    parser.add_argument("--preprocess-workers", type=int, default=CATALOG_STAGE_WORKERS["preprocess"])
+    parser.add_argument("--ocr-workers", type=int, default=CATALOG_STAGE_WORKERS["ocr"])
+    parser.add_argument("--compaction-workers", type=int, default=CATALOG_STAGE_WORKERS["compaction"])
+    parser.add_argument("--llm-workers", type=int, default=LLM_POOL_WORKERS, help="Процессов модели (общие веса через mmap).")
+    parser.add_argument("--llm-threads", type=int, default=LLM_POOL_THREADS, help="Потоков llama.cpp на процесс модели.")
+    args = parser.parse_args()
+
+    start = time.time()
+    stage_workers = {"preprocess": args.preprocess_workers, "ocr": args.ocr_workers, "compaction": args.compaction_workers}
+    pool = ModelWorkerPool(workers=args.llm_workers, threads=args.llm_threads).start() if args.llm_workers > 1 and not args.sequential else None
+    stage_stats = {}
+    try:
+        count = run_catalog(args.source, args.output, resume=not args.no_resume, limit=args.limit,
+                            staged=not args.sequential, stage_workers=stage_workers, pool=pool, stage_stats=stage_stats)
+        # Этап с загрузкой около 100% ограничивает пропускную способность
+        if stage_stats:
+            print("Загрузка этапов: " + ", ".join(f"{name} {stats['utilization']:.0%} ({stats['workers']} пот.)"
+                                                  for name, stats in stage_stats.items()))
+        for stats in pool.stats() if pool is not None else []:
+            print(f"Процесс модели {stats['worker']}: {stats['completed']} прод., {stats['tokens_per_second']:.1f} ток/с, "
+                  f"RSS {stats.get('rss', 0) / 1024 ** 2:.0f} МБ (общих {stats.get('rss_file', 0) / 1024 ** 2:.0f} МБ)")
+    finally:
+        if pool is not None:
+            pool.close()
+    print(f"Обработано продуктов: {count} за {time.time() - start:.1f} с")
@@ -15,6 +15,7 @@ Highlight the following parameters, JSON format:
     "old" : Возрастная маркировка и рекомендованный возраст. String.
     "HasSugar" : Наличие сахара. Boolean.
     "HasSodium" : Наличие натрия. Boolean.
+    "sodium" : Содержание натрия в мг на 100 г; если указана только соль в г на 100 г, умножь ее на 400. Float.
     "HasSubSugar" : Наличие подсластителей. Boolean.
     "HasTransFat" : Наличие транс-жиров. Boolean.
     "HasGMO" : Наличие ГМО. Boolean.
@@ -46,6 +47,77 @@ FROM_JSON_2_RULE_PROMPT = """Теперь твоя задача понять н
 """
 
 MODEL_PATH = "model-q8_0.gguf"
+# Каталог для снимков состояния модели после постоянного префикса промпта (None - только в памяти)
+PREFIX_CACHE_DIR = None
+
+# Способ улучшения контраста перед OCR: "opencv" (CLAHE в uint8) или "skimage" (equalize_adapthist в float64).
+# По умолчанию "skimage", пока качество OCR с "opencv" не сравнено (python -m benchmarks.bench_preprocess)
+PREPROCESS_METHOD = "skimage"
+
+# Кеш результатов OCR на диске
+OCR_CACHE_ENABLED = True
+OCR_CACHE_DIR = ".cache/ocr"
+OCR_CACHE_SIZE_LIMIT = 1024 ** 3
+
+# Бэкенд OCR: "pytesseract" (процесс tesseract на вызов) или "tesserocr" (постоянный API в памяти)
+OCR_BACKEND = "pytesseract"
+# Распознавать только найденные области текста; если они занимают большую долю кадра, распознается весь кадр.
+# Выключено, пока текст по областям не сравнен с распознаванием всего кадра: мелкие блоки меньше min_area
+# в detect_text_regions() отбрасываются
+OCR_REGIONS_ENABLED = False
+OCR_REGIONS_MAX_COVERAGE = 0.6
+# Нормализация масштаба перед OCR и поиском граф: снимок масштабируется так, чтобы x-высота строчных букв
+# была около OCR_TARGET_X_HEIGHT пикселей (точность Tesseract падает при меньшей, а время растет с площадью).
+# Высота оценивается по связным компонентам, похожим на буквы, а если их мало - по DPI и типичному кеглю этикетки.
+# Выключена, пока точность и время OCR не сравнены на эталонах (python -m benchmarks.bench_text_scale)
+OCR_SCALE_NORMALIZATION = False
+OCR_TARGET_X_HEIGHT = 20
+OCR_SCALE_LIMITS = (0.25, 2.0)
+OCR_SCALE_TOLERANCE = 0.15
+LABEL_TEXT_POINTS = 7
+# Поиск штрихкода EAN-13 до предобработки и индекс результатов по штрихкоду: известный продукт
+# возвращается без OCR и модели. Записи индекса привязаны к версии промптов и правил
+BARCODE_ENABLED = True
+BARCODE_MAX_SIDE = 1280
+VERDICT_INDEX_DIR = ".cache/verdicts"
+VERDICT_INDEX_SIZE_LIMIT = 64 * 1024 ** 2
+# Быстрая проверка качества снимков (размытие, экспозиция, наличие текста) до предобработки и OCR
+QUALITY_GATE_ENABLED = True
+
+# Сжатие текста OCR перед моделью: удаление мусора и повторов, отбор строк по приоритету под бюджет токенов.
+# Бюджет None - вычисляется из n_ctx за вычетом префикса промпта и резерва на генерацию
+OCR_COMPACTION_ENABLED = True
+OCR_TOKEN_BUDGET = None
+OCR_GENERATION_RESERVE = 512
+
+# Спекулятивная генерация JSON при temperature=0: черновики из n-грамм промпта проверяются одним батчем.
+# Требует Llama(logits_all=True): логиты хранятся для всех позиций контекста (n_ctx * n_vocab * 4 байт)
+SPECULATIVE_DECODING = False
+SPECULATIVE_MAX_DRAFT = 10
+SPECULATIVE_NGRAM = 3
+
+# Конвейер каталога: потоки этапов и емкость очередей между ними (этап модели всегда в одном потоке)
+CATALOG_STAGE_WORKERS = {"preprocess": 2, "ocr": 2, "compaction": 1}
+CATALOG_STAGE_QUEUE_SIZE = 2
+
+# Пул процессов модели: каждый процесс открывает тот же GGUF через mmap (веса общие в page cache)
+# и получает свои потоки и ядра. Потоков на процесс None - поровну делить доступные ядра
+LLM_POOL_WORKERS = 1
+LLM_POOL_THREADS = None
+LLM_POOL_PIN_CPUS = True
+
+# Трассировка этапов запроса (время, токены, пиковая память) и файл JSONL для трасс (None - не писать)
+TRACING_ENABLED = True
+TRACE_LOG_PATH = None
+
+# Кеш ответов модели на диске
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_DIR = ".cache/responses"
+RESPONSE_CACHE_SIZE_LIMIT = 256 * 1024 ** 2
+RESPONSE_CACHE_TTL = 30 * 24 * 60 * 60
+# Поиск почти совпадающих текстов OCR по MinHash и порог их сходства
+RESPONSE_CACHE_NEAR_DUPLICATES = False
+RESPONSE_CACHE_SIMILARITY = 0.9
 
 SYSTEM_TOKEN = 1587
 USER_TOKEN = 2188
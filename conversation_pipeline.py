@@ -1,59 +1,63 @@
-from core.document_conversion import extract_images
+from core.document_conversion import extract_images, ImageData
 from llm.utiils import pipeline
-from core.utilities import  preprocess_image
+from llm.verdict_index import lookup_product, remember_product
+from core.utilities import  preprocess_image, to_uint8
 from core.document_generator import generate_output_text
+from core.quality_gate import quality_gate, summarize_rejections
+from core.tracing import current_trace, start_trace, traced
 import numpy as np
 from PIL import Image
-import io
 import time
-from typing import List, Tuple
+from typing import Any, List, Optional, Tuple
 
-def get_data(image_np: np.array) -> bytes:
+@traced()
+def get_data(image_np: np.array, source: Optional[str] = None) -> ImageData:
     """
-    Предварительная обработка изображения и преобразование его в байтовый формат PNG.
+    Предварительная обработка изображения и упаковка его в ImageData для передачи в OCR.
 
     Параметры:
     - image_np (np.array): Массив NumPy, представляющий изображение.
+    - source (Optional[str]): Источник изображения (например, путь к файлу).
 
     Возвращает:
-    bytes: Байтовое представление обработанного изображения в формате PNG.
+    ImageData: Обработанное изображение в памяти.
 
     Пример использования:
     ```python
     image_array = np.array(Image.open("image.jpg"))
-    image_bytes = get_data(image_array)
+    image = get_data(image_array, source="image.jpg")
     ```
 
     Подробности:
     - Функция принимает массив NumPy, представляющий изображение.
     - Изображение подвергается предварительной обработке.
-    - Затем изображение преобразуется в формат PNG и сохраняется в байтовом формате.
-    - Байтовое представление изображения в формате PNG возвращается в качестве результата.
+    - Результат приводится к uint8 и передается дальше без кодирования в PNG;
+      при необходимости файл можно получить через ImageData.to_png().
     """
     # Удалить путь и применить предварительную обработку к изображению
     image_np = preprocess_image(image_np)
     
-    # Преобразовать массив в формат uint8
-    image_np = (image_np * 255).astype(np.uint8)
+    # Преобразовать массив в формат uint8 (путь skimage возвращает float в [0, 1])
+    image_np = to_uint8(image_np)
     
-    # Сохранить изображение в формате PNG в байтовом представлении
-    with io.BytesIO() as output:
-        Image.fromarray(image_np).save(output, format='PNG')
-        image_bytes = output.getvalue()
-    
-    return image_bytes
+    return ImageData(array=image_np, source=source)
 
-def result_pipeline(files: List[np.array]) -> Tuple[str, str]:
+@start_trace("result_pipeline")
+def result_pipeline(files: List[np.array], **pipeline_kwargs: Any) -> Tuple[str, str]:
     """
     Обработка изображений и генерация JSON на основе распознанного текста.
 
     Параметры:
     - files (List[np.array]): Список массивов NumPy, представляющих изображения для обработки.
+    - pipeline_kwargs: Дополнительные параметры для pipeline() (например, model_path).
 
     Возвращает:
     Tuple[str, str]: Кортеж, содержащий сгенерированный JSON и правила обработки текста.
 
     Если текст не удалось распознать, возвращается кортеж с сообщением об ошибке и пустой строкой.
+    Если ни один снимок не прошел проверку качества, возвращается кортеж с сообщением о причинах
+    отказа и пустой строкой; отчеты QualityReport по каждому снимку записываются в атрибут
+    "quality" активной трассы.
 
     Пример использования:
     ```python
@@ -64,20 +68,38 @@ def result_pipeline(files: List[np.array]) -> Tuple[str, str]:
     Подробности:
     - Функция принимает список массивов NumPy, представляющих изображения для обработки.
     - Если список файлов пуст, будет использован тестовый файл по умолчанию.
-    - Если в списке файлов только один элемент, он будет преобразован в список.
+    - Сначала на уменьшенных копиях снимков ищется штрихкод EAN-13; если для него есть результат
+      в индексе (llm.verdict_index), он возвращается без OCR и модели. Результат полного прохода
+      по снимкам со штрихкодом сохраняется в индекс.
+    - Перед предобработкой каждый снимок проходит быструю проверку качества на уменьшенной копии;
+      снимки, не прошедшие проверку, отбрасываются.
     - Для каждого файла выполняется предварительная обработка для подготовки к извлечению данных.
-    - Изображения извлекаются из предварительно обработанных файлов.
+    - Обработанные изображения передаются в OCR в памяти, без кодирования в PNG.
     - Производится генерация текста из изображений с использованием определенного порога распознавания.
     - Если распознанный текст короче или равен 40 символам, возвращается сообщение об ошибке.
     - В противном случае применяются правила обработки и создается JSON на основе распознанного текста.
+    - Вызов записывается в трассу (core.tracing): время этапов, токены модели и пиковая память.
     """
     # Проверка наличия файлов
     if not files:
         print("Запускаем тестовый файл")
         file_path = "test_files/Йогурт Агуша с персиком с 8 месяцев 2.7% 200 г.jpg"
         files = [np.array(Image.open(file_path))]
-    elif len(files) == 1:
-        files = [files]
+
+    # Поиск штрихкода и сохраненного результата: известный продукт возвращается без OCR и модели
+    ean, cached = lookup_product(files, **pipeline_kwargs)
+    if cached is not None:
+        rules, json_data, answer = cached
+        return json_data, rules, answer
+
+    # Проверка качества снимков до предобработки и OCR
+    reports = [quality_gate.check(file) for file in files]
+    if not any(report.passed for report in reports):
+        trace = current_trace()
+        if trace is not None:
+            trace.attrs["quality"] = [report.to_dict() for report in reports]
+        return summarize_rejections(reports), ""
+    files = [file for file, report in zip(files, reports) if report.passed]
     
     # Предварительная обработка файлов
     preprocess_files = [get_data(file) for file in files]
@@ -94,14 +116,19 @@ def result_pipeline(files: List[np.array]) -> Tuple[str, str]:
         return "Не удалось распознать текст", ""
     
     # Применение правил и создание JSON
-    rules, json_data, answer = pipeline(text_from_ocr)
+    rules, json_data, answer = pipeline(text_from_ocr, **pipeline_kwargs)
+    remember_product(ean, (rules, json_data, answer), **pipeline_kwargs)
     
     return json_data, rules, answer
 
 if __name__ == '__main__':
     start = time.time()
-    result = result_pipeline([])
+    with start_trace("result_pipeline") as trace:
+        result = result_pipeline([])
     print(time.time() - start)
+    if trace is not None:
+        for item in trace.spans:
+            print(f"{item.name:24s} {item.duration * 1000:9.1f} мс", item.attrs or "")
     if len(result) == 3:
         print("json:")
         print(result[0])
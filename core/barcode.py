@@ -0,0 +1,108 @@
+import threading
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+from constant import BARCODE_MAX_SIDE
+from core.tracing import traced
+
+_local = threading.local()
+
+
+def get_detector() -> "cv2.barcode.BarcodeDetector":
+    """
+    Возвращает детектор штрихкодов OpenCV текущего потока (экземпляр не потокобезопасен).
+    """
+    detector = getattr(_local, "detector", None)
+    if detector is None:
+        detector = _local.detector = cv2.barcode.BarcodeDetector()
+    return detector
+
+
+def is_valid_ean13(code: str) -> bool:
+    """
+    Проверяет контрольную цифру EAN-13.
+
+    :param code: Строка из 13 цифр.
+    :return: True, если код состоит из 13 цифр и контрольная цифра верна.
+    """
+    if len(code) != 13 or not code.isdigit():
+        return False
+    total = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(code[:12]))
+    return (10 - total % 10) % 10 == int(code[12])
+
+
+def normalize_ean13(code: str) -> Optional[str]:
+    """
+    Приводит распознанный код к EAN-13.
+
+    :param code: Распознанный код.
+    :return: EAN-13 (UPC-A дополняется ведущим нулем) или None, если код не EAN-13 либо контрольная цифра неверна.
+    """
+    code = code.strip()
+    if len(code) == 12:
+        code = "0" + code
+    return code if is_valid_ean13(code) else None
+
+
+def _decode(gray: np.ndarray) -> Tuple[Optional[str], Optional[np.ndarray]]:
+    found, codes, _, points = get_detector().detectAndDecodeWithType(gray)
+    for code in codes or ():
+        ean = normalize_ean13(code)
+        if ean is not None:
+            return ean, None
+    return None, points if points is not None and len(points) else None
+
+
+@traced("barcode")
+def detect_barcode(image: np.ndarray, max_side: int = BARCODE_MAX_SIDE) -> Optional[str]:
+    """
+    Ищет на снимке штрихкод EAN-13.
+
+    :param image: Изображение в формате NumPy array (RGB или оттенки серого, uint8).
+    :param max_side: Размер большей стороны уменьшенной копии для поиска.
+    :return: EAN-13 или None.
+
+    Поиск выполняется на уменьшенной копии в оттенках серого. Если штрихкод найден, но не
+    прочитан (мелкие штрихи после уменьшения), он читается повторно по фрагменту исходного снимка.
+    """
+    pixels = np.asarray(image)
+    gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels[..., :3], cv2.COLOR_RGB2GRAY)
+    scale = min(1.0, max_side / max(gray.shape))
+    small = gray
+    # pyrDown вдвое быстрее INTER_AREA с дробным коэффициентом на снимках в десятки мегапикселей
+    while max(small.shape) >= 2 * max_side:
+        small = cv2.pyrDown(small)
+    if max(small.shape) > max_side:
+        small = cv2.resize(small, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    ean, points = _decode(small)
+    if ean is not None or points is None or scale == 1:
+        return ean
+
+    for corners in points:
+        corners = corners / scale
+        (left, top), (right, bottom) = corners.min(axis=0), corners.max(axis=0)
+        pad_x, pad_y = (right - left) * 0.25, (bottom - top) * 0.25
+        top, bottom = max(0, int(top - pad_y)), min(gray.shape[0], int(bottom + pad_y))
+        left, right = max(0, int(left - pad_x)), min(gray.shape[1], int(right + pad_x))
+        if bottom > top and right > left:
+            crop = np.full((bottom - top + 40, right - left + 40), 255, dtype=np.uint8)
+            crop[20:-20, 20:-20] = gray[top:bottom, left:right]
+            ean, _ = _decode(crop)
+            if ean is not None:
+                return ean
+    return None
+
+
+def find_barcode(images: List[np.ndarray], max_side: int = BARCODE_MAX_SIDE) -> Optional[str]:
+    """
+    Ищет штрихкод EAN-13 на снимках продукта.
+
+    :param images: Снимки продукта.
+    :param max_side: Размер большей стороны уменьшенной копии для поиска.
+    :return: Первый найденный EAN-13 или None.
+    """
+    for image in images:
+        ean = detect_barcode(image, max_side=max_side)
+        if ean is not None:
+            return ean
+    return None
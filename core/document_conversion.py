@@ -1,6 +1,65 @@
+from dataclasses import dataclass
 from PIL import Image
 import io
-from typing import List
+import numpy as np
+from typing import List, Optional, Tuple, Union
+
+
+@dataclass
+class ImageData:
+    """
+    Изображение в памяти, передаваемое между этапами обработки без сериализации.
+
+    :param array: Пиксели изображения в формате NumPy array (uint8).
+    :param dpi: Разрешение изображения в точках на дюйм по осям x и y.
+    :param source: Источник изображения (путь к файлу, имя загрузки и т.п.).
+    """
+    array: np.ndarray
+    dpi: Tuple[float, float] = (300, 300)
+    source: Optional[str] = None
+
+    @property
+    def info(self) -> dict:
+        """
+        Метаданные в формате PIL.Image.Image.info (используются get_dpi).
+        """
+        return {"dpi": self.dpi}
+
+    def __array__(self, dtype=None):
+        return self.array if dtype is None else self.array.astype(dtype, copy=False)
+
+    @classmethod
+    def from_pil(cls, image: Image.Image, source: Optional[str] = None) -> "ImageData":
+        """
+        Создает ImageData из изображения PIL.
+
+        :param image: Изображение в формате PIL.Image.Image.
+        :param source: Источник изображения.
+        :return: Изображение в памяти.
+        """
+        dpi = image.info.get("dpi", (300, 300))
+        return cls(array=np.asarray(image), dpi=dpi, source=source or getattr(image, "filename", None) or None)
+
+    def to_pil(self) -> Image.Image:
+        """
+        Преобразует изображение в формат PIL.Image.Image.
+
+        :return: Изображение PIL.
+        """
+        image = Image.fromarray(self.array)
+        image.info["dpi"] = self.dpi
+        return image
+
+    def to_png(self) -> bytes:
+        """
+        Кодирует изображение в PNG. Используется только там, где действительно нужен файл.
+
+        :return: Данные PNG-файла в виде байт.
+        """
+        with io.BytesIO() as output:
+            self.to_pil().save(output, format="PNG", dpi=self.dpi)
+            return output.getvalue()
+
 
 def png_to_images(data: bytes) -> List[Image.Image]:
     """
@@ -17,14 +76,21 @@ def png_to_images(data: bytes) -> List[Image.Image]:
         return []
 
 
-def extract_images(files: List[bytes]) -> List[Image.Image]:
+def extract_images(files: List[Union[bytes, Image.Image, ImageData]]) -> List[ImageData]:
     """
-    Извлекает изображения из словаря файлов.
+    Извлекает изображения из списка файлов.
 
-    :param files: Словарь с именем файла в качестве ключа и данными файла в качестве значения.
-    :return: Список изображений.
+    :param files: Список изображений: данные PNG-файлов в виде байт, изображения PIL или ImageData.
+    :return: Список изображений в памяти.
+
+    ImageData передаются дальше без копирования, байты декодируются только на границе системы.
     """
     images = []
     for data in files:
-        images.extend(png_to_images(data))
+        if isinstance(data, ImageData):
+            images.append(data)
+        elif isinstance(data, Image.Image):
+            images.append(ImageData.from_pil(data))
+        else:
+            images.extend(ImageData.from_pil(image) for image in png_to_images(data))
     return images
@@ -1,28 +1,134 @@
-from core.image_processing import process_image, filter_dataframe
+import contextvars
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+import numpy as np
+from core.image_processing import process_image, filter_dataframe, get_ocr_backend, get_text_regions_config, get_text_scale_config, TESSERACT_CONFIG
+from core.ocr_cache import ocr_cache
 
 
-def generate_output_text(images, lang="rus", detection_threshold=25) -> str:
+_executors: Dict[Tuple[str, int], Executor] = {}
+_executors_lock = threading.Lock()
+
+
+class ImageProcessingError(Exception):
+    """
+    Ошибка обработки одного из изображений продукта.
+
+    :param image_index: Порядковый номер изображения во входном списке.
+    :param source: Источник изображения, если он известен.
+    :param error: Исходное исключение.
+    """
+
+    def __init__(self, image_index: int, source: Optional[str], error: Exception):
+        super().__init__(f"Ошибка обработки изображения {image_index} ({source or 'без источника'}): {error}")
+        self.image_index = image_index
+        self.source = source
+        self.error = error
+
+
+def get_ocr_executor(workers: int, mode: str = "thread") -> Executor:
+    """
+    Возвращает пул исполнителей для OCR, общий для всех запросов процесса.
+
+    :param workers: Количество исполнителей.
+    :param mode: "thread" - пул потоков, "process" - пул процессов.
+    :return: Пул исполнителей.
+
+    Tesseract работает в отдельном процессе, а OpenCV освобождает GIL, поэтому пула потоков
+    обычно достаточно; пул процессов полезен, когда узким местом становится pandas.
+    """
+    key = (mode, workers)
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if mode == "thread":
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+            elif mode == "process":
+                executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                raise ValueError(f"Неизвестный режим исполнения OCR: {mode}")
+            _executors[key] = executor
+    return executor
+
+
+def shutdown_ocr_executors() -> None:
+    """
+    Останавливает все пулы исполнителей OCR.
+    """
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+def image_to_text(image, lang="rus", detection_threshold=25, use_cache=True) -> str:
+    """
+    Распознает текст одного изображения и собирает его по строкам.
+
+    :param image: Изображение в формате ImageData.
+    :param lang: Язык распознавания текста (по умолчанию "rus").
+    :param detection_threshold: Пороговое значение уверенности распознавания текста (по умолчанию 25).
+    :param use_cache: Использовать кеш результатов OCR (по умолчанию True).
+    :return: Текст изображения, по одной линии на строку.
+    """
+    cache_key = None
+    if use_cache and ocr_cache.enabled:
+        cache_key = ocr_cache.make_key(np.asarray(image), stage="text", lang=lang, config=TESSERACT_CONFIG, backend=get_ocr_backend().name, regions=get_text_regions_config(),
+                                       text_scale=get_text_scale_config(), detection_threshold=detection_threshold)
+        cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    df, _, dpi = process_image(image, horizontal_shift_threshold=50, lang=lang, use_cache=use_cache)
+    df_filtered = filter_dataframe(df, threshold=detection_threshold)
+    text = "".join(" ".join(words) + "\n" for words in df_filtered['text'])
+
+    if cache_key is not None:
+        ocr_cache.set(cache_key, text)
+    return text
+
+
+def generate_output_text(images, lang="rus", detection_threshold=25, workers=None, mode="thread", use_cache=True) -> str:
     """
     Генерирует текстовую строку на основе изображений с текстом.
 
-    :param images: Список изображений в формате PIL.Image.Image.
+    :param images: Список изображений в формате ImageData.
     :param lang: Язык распознавания текста (по умолчанию "rus").
     :param detection_threshold: Пороговое значение уверенности распознавания текста (по умолчанию 25).
+    :param workers: Размер пула параллельных исполнителей (по умолчанию - по числу ядер).
+    :param mode: Режим параллельного исполнения: "thread" или "process".
+    :param use_cache: Использовать кеш результатов OCR (по умолчанию True).
     :return: Текстовая строка.
+
+    Пул создается один раз для каждой пары (mode, workers) и переиспользуется между запросами.
+    Текст изображений склеивается в исходном порядке. Ошибка обработки изображения
+    выбрасывается как ImageProcessingError с его номером и источником.
     """
-    output_text = ""
+    if workers is None:
+        workers = os.cpu_count() or 1
 
+    if workers <= 1 or len(images) <= 1:
+        futures = None
+    else:
+        executor = get_ocr_executor(workers, mode)
+        if mode == "thread":
+            # Каждая задача получает копию контекста, чтобы этапы попадали в трассу запроса
+            futures = [executor.submit(contextvars.copy_context().run, image_to_text, image, lang, detection_threshold, use_cache)
+                       for image in images]
+        else:
+            futures = [executor.submit(image_to_text, image, lang, detection_threshold, use_cache) for image in images]
+
+    output_text = ""
     for image_index, image in enumerate(images):
-        df, _, dpi = process_image(image, horizontal_shift_threshold=50, lang=lang)
-        df_filtered = filter_dataframe(df, threshold=detection_threshold)
-        found_start = False
-        for _, row in df_filtered.iterrows():
-            if found_start:
-                text = " ".join(row['text'])
-                output_text += text + "\n"
+        try:
+            if futures is None:
+                output_text += image_to_text(image, lang, detection_threshold, use_cache)
             else:
-                text = " ".join(row['text'])
-                output_text += text + "\n"
-                found_start = True
+                output_text += futures[image_index].result()
+        except Exception as e:
+            raise ImageProcessingError(image_index, getattr(image, "source", None), e) from e
 
     return output_text
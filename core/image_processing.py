@@ -1,22 +1,187 @@
+import csv
+import io
+import shlex
+import threading
 import cv2
 import numpy as np
 import pytesseract
 import pandas as pd
+from constant import (LABEL_TEXT_POINTS, OCR_BACKEND, OCR_REGIONS_ENABLED, OCR_REGIONS_MAX_COVERAGE, OCR_SCALE_LIMITS,
+                      OCR_SCALE_NORMALIZATION, OCR_SCALE_TOLERANCE, OCR_TARGET_X_HEIGHT)
 from core.utilities import get_dpi
+from core.ocr_cache import ocr_cache
+from core.tracing import span, traced
 
 
-def recognize_text(image: np.ndarray, lang: str = "rus"):
+LINE_KEYS = ['block_num', 'par_num', 'line_num']
+TESSERACT_CONFIG = "--oem 1 --psm 3 -c tessedit_char_blacklist=_"
+TSV_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text']
+
+
+class PytesseractBackend:
+    """
+    Распознавание через pytesseract: отдельный процесс tesseract на каждый вызов.
+    """
+    name = "pytesseract"
+
+    def image_to_data(self, image: np.ndarray, lang: str, config: str) -> pd.DataFrame:
+        """
+        Распознает текст на изображении.
+
+        :param image: Изображение в формате NumPy array.
+        :param lang: Язык распознавания текста.
+        :param config: Параметры командной строки tesseract.
+        :return: DataFrame с колонками TSV-вывода tesseract.
+        """
+        return pytesseract.image_to_data(image, lang=lang, output_type=pytesseract.Output.DATAFRAME, config=config)
+
+
+class TesserocrBackend:
+    """
+    Распознавание через tesserocr: инициализированный API Tesseract переиспользуется между вызовами.
+
+    Для каждого потока и языка создается свой экземпляр PyTessBaseAPI (он не потокобезопасен),
+    поэтому traineddata загружается один раз на исполнителя, а изображение передается
+    буфером в памяти без временных файлов.
+    """
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self._local = threading.local()
+
+    def _get_api(self, lang: str, config: str):
+        apis = self._local.__dict__.setdefault("apis", {})
+        api = apis.get((lang, config))
+        if api is None:
+            oem, psm, variables = _parse_config(config)
+            api = self._tesserocr.PyTessBaseAPI(lang=lang, oem=oem, psm=psm)
+            for name, value in variables.items():
+                api.SetVariable(name, value)
+            apis[(lang, config)] = api
+        return api
+
+    def image_to_data(self, image: np.ndarray, lang: str, config: str) -> pd.DataFrame:
+        """
+        Распознает текст на изображении.
+
+        :param image: Изображение в формате NumPy array (оттенки серого, RGB или RGBA, uint8).
+        :param lang: Язык распознавания текста.
+        :param config: Параметры командной строки tesseract (поддерживаются --oem, --psm и -c).
+        :return: DataFrame с теми же колонками и типами, что и у pytesseract.
+        """
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        api = self._get_api(lang, config)
+        api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+        tsv = "\t".join(TSV_COLUMNS) + "\n" + api.GetTSVText(0)
+        return pd.read_csv(io.StringIO(tsv), quoting=csv.QUOTE_NONE, sep="\t")
+
+
+OCR_BACKENDS = {backend.name: backend for backend in (PytesseractBackend, TesserocrBackend)}
+_backend_instances = {}
+_backend_lock = threading.Lock()
+
+
+def _parse_config(config: str):
+    """
+    Разбирает параметры командной строки tesseract.
+
+    :param config: Строка вида "--oem 1 --psm 3 -c name=value".
+    :return: Кортеж (oem, psm, словарь переменных).
+    """
+    oem, psm, variables = 3, 3, {}
+    args = shlex.split(config)
+    for option, value in zip(args, args[1:]):
+        if option == "--oem":
+            oem = int(value)
+        elif option == "--psm":
+            psm = int(value)
+        elif option == "-c":
+            name, _, variable = value.partition("=")
+            variables[name] = variable
+    return oem, psm, variables
+
+
+def set_ocr_backend(name: str) -> None:
+    """
+    Меняет бэкенд OCR по умолчанию для текущего процесса.
+
+    :param name: Имя бэкенда из OCR_BACKENDS (например, заглушка, зарегистрированная в бенчмарке).
+    """
+    global OCR_BACKEND
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд OCR: {name}")
+    OCR_BACKEND = name
+
+
+def get_ocr_backend(name: str = None):
+    """
+    Возвращает общий экземпляр бэкенда OCR.
+
+    :param name: Имя бэкенда из OCR_BACKENDS (по умолчанию OCR_BACKEND из constant.py или set_ocr_backend()).
+    :return: Экземпляр бэкенда.
     """
-    Распознает текст на изображении с использованием pytesseract.
+    name = name or OCR_BACKEND
+    backend = _backend_instances.get(name)
+    if backend is None:
+        if name not in OCR_BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд OCR: {name}")
+        with _backend_lock:
+            backend = _backend_instances.get(name)
+            if backend is None:
+                backend = _backend_instances[name] = OCR_BACKENDS[name]()
+    return backend
+
+
+@traced()
+def recognize_text(image: np.ndarray, lang: str = "rus", backend: str = None):
+    """
+    Распознает текст на изображении с использованием выбранного бэкенда OCR.
 
     :param image: Изображение в формате NumPy array.
     :param lang: Язык распознавания текста (по умолчанию "rus").
+    :param backend: Имя бэкенда OCR (по умолчанию OCR_BACKEND из constant.py).
     :return: DataFrame с результатами распознавания.
     """
-    df = pytesseract.image_to_data(image, lang=lang, output_type=pytesseract.Output.DATAFRAME, config="--oem 1 --psm 3 -c tessedit_char_blacklist=_")
+    df = get_ocr_backend(backend).image_to_data(image, lang, TESSERACT_CONFIG)
     return df
 
 
+def recognize_regions(image: np.ndarray, regions, lang: str = "rus", backend: str = None):
+    """
+    Распознает текст только в заданных областях изображения.
+
+    :param image: Изображение в формате NumPy array.
+    :param regions: Список областей (left, top, width, height) в координатах изображения.
+    :param lang: Язык распознавания текста (по умолчанию "rus").
+    :param backend: Имя бэкенда OCR (по умолчанию OCR_BACKEND из constant.py).
+    :return: DataFrame в том же формате, что и recognize_text() для всего изображения.
+
+    Координаты слов переводятся в систему координат исходного изображения, номера блоков
+    сдвигаются, чтобы блоки разных областей не совпадали, а строки уровня страницы
+    заменяются одной строкой на все изображение.
+    """
+    height, width = image.shape[:2]
+    frames = [pd.DataFrame([{'level': 1, 'page_num': 1, 'block_num': 0, 'par_num': 0, 'line_num': 0, 'word_num': 0,
+                             'left': 0, 'top': 0, 'width': width, 'height': height, 'conf': -1, 'text': np.nan}])]
+    block_offset = 0
+    for left, top, region_width, region_height in regions:
+        df = recognize_text(image[top:top + region_height, left:left + region_width], lang, backend)
+        df = df[df['level'] > 1].copy()
+        df['left'] += left
+        df['top'] += top
+        df['block_num'] += block_offset
+        if not df.empty:
+            block_offset = int(df['block_num'].max())
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+@traced()
 def filter_dataframe(df: pd.DataFrame, threshold=25):
     """
     Преобразует DataFrame с результатами распознавания текста в удобный для создания docx файла формат.
@@ -24,53 +189,110 @@ def filter_dataframe(df: pd.DataFrame, threshold=25):
     :param df: DataFrame с результатами распознавания текста.
     :param threshold: Пороговое значение уверенности распознавания (по умолчанию 25).
     :return: Отфильтрованный DataFrame.
+
+    Строки сортируются одним lexsort по (block_num, par_num, line_num, left), после чего
+    каждая текстовая линия собирается из непрерывного сегмента отсортированных массивов.
     """
     df = df[(0 >= df['conf']) | (df['conf'] >= threshold)]
-    df.reset_index(drop=True, inplace=True)
-
-    df_concatenated = df.groupby(['block_num', 'par_num', 'line_num']).apply(lambda group: group.sort_values(by='left')).reset_index(drop=True)
-    df_concatenated = df_concatenated.groupby(['block_num', 'par_num', 'line_num']).agg({
-        'text': lambda x: [str(e).strip() for e in x if not pd.isna(e) and str(e).strip()],
-        'left': 'first',
-        'top': 'first',
-        'width': 'first',
-        'height': 'first',
-        'field_id': lambda x: [e for e in x if not pd.isna(e)] if [e for e in x if not pd.isna(e)] else None
-    }).reset_index()
-    df_filtered = df_concatenated[df_concatenated['text'].apply(lambda x: any(x))]
+    keys = df[LINE_KEYS].to_numpy(dtype=float)
+    valid = ~np.isnan(keys).any(axis=1)
+    keys = keys[valid]
+
+    order = np.lexsort((df['left'].to_numpy()[valid], keys[:, 2], keys[:, 1], keys[:, 0]))
+    keys = keys[order]
+    segment_start = np.ones(len(keys), dtype=bool)
+    segment_start[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    segment_ids = np.cumsum(segment_start) - 1
+    segment_count = int(segment_start.sum())
+
+    words = np.array([
+        "" if pd.isna(e) else str(e).strip() for e in df['text'].to_numpy()[valid][order]
+    ], dtype=object)
+    has_word = words != ""
+    word_lists = _split_segments(words[has_word], segment_ids[has_word], segment_count)
+
+    field_ids = df['field_id'].to_numpy()[valid][order]
+    has_field = ~pd.isna(field_ids)
+    field_lists = _split_segments(field_ids[has_field], segment_ids[has_field], segment_count)
+
+    starts = np.flatnonzero(segment_start)
+    df_concatenated = pd.DataFrame({
+        'text': word_lists,
+        'left': df['left'].to_numpy()[valid][order][starts],
+        'top': df['top'].to_numpy()[valid][order][starts],
+        'width': df['width'].to_numpy()[valid][order][starts],
+        'height': df['height'].to_numpy()[valid][order][starts],
+        'field_id': [ids if ids else None for ids in field_lists],
+    })
+    df_filtered = df_concatenated[np.bincount(segment_ids[has_word], minlength=segment_count) > 0]
     df_filtered = df_filtered.sort_values(by='top')
     df_filtered.reset_index(drop=True, inplace=True)
-    df_filtered = df_filtered.drop(['block_num', 'par_num', 'line_num'], axis=1)
 
     return df_filtered
 
 
-def process_image(image, horizontal_shift_threshold=50, lang="rus"):
+def _split_segments(values: np.ndarray, segment_ids: np.ndarray, segment_count: int):
+    """
+    Разбивает отсортированные по сегментам значения на списки, по одному на сегмент.
+
+    :param values: Значения, упорядоченные по номеру сегмента.
+    :param segment_ids: Номер сегмента для каждого значения.
+    :param segment_count: Общее количество сегментов.
+    :return: Список списков значений (пустой список для сегмента без значений).
+    """
+    bounds = np.searchsorted(segment_ids, np.arange(1, segment_count))
+    return [part.tolist() for part in np.split(values, bounds)] if segment_count else []
+
+
+def process_image(image, horizontal_shift_threshold=50, lang="rus", use_cache=True):
     """
     Обрабатывает изображение, распознает текст и привязывает графику к текстовым блокам.
 
-    :param image: Изображение в формате NumPy array.
+    :param image: Изображение в формате ImageData или PIL.Image.Image.
     :param horizontal_shift_threshold: Пороговое значение горизонтального смещения (по умолчанию 50).
     :param lang: Язык распознавания текста (по умолчанию "rus").
+    :param use_cache: Использовать кеш результатов OCR (по умолчанию True).
     :return: DataFrame с результатами распознавания, информацией о полях и разрешение изображения.
+
+    При попадании в кеш Tesseract и поиск граф не запускаются. Если включен OCR_REGIONS_ENABLED,
+    Tesseract запускается только на областях текста из detect_text_regions(). Если включен
+    OCR_SCALE_NORMALIZATION, распознавание и поиск граф выполняются на копии с x-высотой текста
+    около OCR_TARGET_X_HEIGHT (normalize_text_scale()), а координаты возвращаются в масштабе исходного изображения.
     """
     dpi = get_dpi(image)
+    pixels = np.asarray(image)
+
+    cache_key = None
+    if use_cache and ocr_cache.enabled:
+        cache_key = ocr_cache.make_key(pixels, stage="process_image", lang=lang, config=TESSERACT_CONFIG, backend=get_ocr_backend().name,
+                                       regions=get_text_regions_config(), horizontal_shift_threshold=horizontal_shift_threshold,
+                                       text_scale=get_text_scale_config())
+        cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            df, fields = cached
+            return df, fields, dpi
 
-    df = recognize_text(image, lang)
-    fields = pd.DataFrame(crop_fields(image))
-    for _, text_line in df[df["level"] == 4].iterrows():
-        for index, graph in fields.iterrows():
-            if assign_graph_to_line(graph, text_line, horizontal_shift_threshold):
-                fields.at[index, 'block_num'] = text_line['block_num']
-                fields.at[index, 'par_num'] = text_line['par_num']
-                fields.at[index, 'line_num'] = text_line['line_num']
+    scaled, scale = normalize_text_scale(pixels, dpi) if OCR_SCALE_NORMALIZATION else (pixels, 1.0)
+    regions = detect_text_regions(scaled) if OCR_REGIONS_ENABLED else []
+    df = recognize_regions(scaled, regions, lang) if regions else recognize_text(scaled, lang)
+    df = rescale_boxes(df, scale)
+    fields = rescale_boxes(pd.DataFrame(crop_fields(scaled)), scale)
+    lines = df[df["level"] == 4]
+    if not fields.empty and not lines.empty:
+        matched = assign_fields_to_lines(lines, fields, horizontal_shift_threshold)
+        has_line = matched >= 0
+        fields.loc[has_line, LINE_KEYS] = lines[LINE_KEYS].to_numpy()[matched[has_line]]
     df["field_id"] = None
     df = pd.concat([df, fields], ignore_index=True)
     df = df.drop(['level', 'page_num'], axis=1).reset_index(drop=True)
 
+    if cache_key is not None:
+        ocr_cache.set(cache_key, (df, fields))
+
     return df, fields, dpi
 
 
+@traced()
 def crop_fields(image):
     """
     Выделяет графы на изображении.
@@ -78,7 +300,7 @@ def crop_fields(image):
     :param image: Изображение в формате NumPy array.
     :return: Список словарей с информацией о выделенных областях.
     """
-    gray = cv2.cvtColor(np.array(image),cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(np.asarray(image),cv2.COLOR_BGR2GRAY)
     thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
 
     horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (20,1))
@@ -104,6 +326,218 @@ def crop_fields(image):
     return fields_info
 
 
+TEXT_REGIONS_DEFAULTS = {"max_side": 1024, "padding": 0.02, "min_area": 0.001}
+
+
+@traced()
+def detect_text_regions(image, max_side=TEXT_REGIONS_DEFAULTS["max_side"], padding=TEXT_REGIONS_DEFAULTS["padding"],
+                        min_area=TEXT_REGIONS_DEFAULTS["min_area"], max_coverage=OCR_REGIONS_MAX_COVERAGE):
+    """
+    Находит области с текстом (состав, таблица пищевой ценности), чтобы не распознавать фон и рисунки.
+
+    :param image: Изображение в формате NumPy array.
+    :param max_side: Размер большей стороны уменьшенной копии для поиска (по умолчанию 1024).
+    :param padding: Отступ вокруг найденной области в долях размера изображения (по умолчанию 0.02).
+    :param min_area: Минимальная площадь области в долях площади изображения (по умолчанию 0.001).
+    :param max_coverage: Если области занимают большую долю изображения, возвращается пустой список.
+    :return: Список областей (left, top, width, height) в координатах исходного изображения или
+             пустой список, если распознавать нужно все изображение.
+
+    На уменьшенной копии морфологический градиент бинаризуется по Оцу, горизонтальное замыкание
+    склеивает буквы в строки, а размыкание убирает тонкие контуры рисунков. Прямоугольники строк
+    с отступом объединяются, пока пересекаются, поэтому соседние строки и колонки таблицы
+    попадают в одну область.
+    """
+    pixels = np.asarray(image)
+    height, width = pixels.shape[:2]
+    gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY)
+    scale = min(1.0, max_side / max(height, width))
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_height, small_width = gray.shape
+
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    kernel_width = max(3, small_width // 60)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_width, 1)))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, kernel_width // 2), 1)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    pad_x, pad_y = padding * small_width, padding * small_height
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h >= min_area * small_width * small_height:
+            boxes.append([max(0, x - pad_x), max(0, y - pad_y), min(small_width, x + w + pad_x), min(small_height, y + h + pad_y)])
+    boxes = _merge_boxes(boxes)
+
+    regions = []
+    for x0, y0, x1, y1 in sorted(boxes, key=lambda box: (box[1], box[0])):
+        left, top = int(x0 / scale), int(y0 / scale)
+        right, bottom = min(width, int(np.ceil(x1 / scale))), min(height, int(np.ceil(y1 / scale)))
+        regions.append((left, top, right - left, bottom - top))
+    if not regions or sum(w * h for _, _, w, h in regions) > max_coverage * width * height:
+        return []
+    return regions
+
+
+def _merge_boxes(boxes):
+    """
+    Объединяет пересекающиеся прямоугольники, пока остаются пересечения.
+
+    :param boxes: Список прямоугольников [x0, y0, x1, y1].
+    :return: Список непересекающихся прямоугольников.
+    """
+    changed = True
+    while changed:
+        changed = False
+        merged = []
+        for box in boxes:
+            for other in merged:
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    other[:] = [min(other[0], box[0]), min(other[1], box[1]), max(other[2], box[2]), max(other[3], box[3])]
+                    changed = True
+                    break
+            else:
+                merged.append(box)
+        boxes = merged
+    return boxes
+
+
+@traced()
+def estimate_x_height(image, dpi=None, max_side=1600, min_components=20, max_components=500):
+    """
+    Оценивает x-высоту (высоту строчных букв) текста на изображении в пикселях.
+
+    :param image: Изображение в формате NumPy array.
+    :param dpi: Разрешение из метаданных; используется, если на снимке мало компонент, похожих на буквы.
+    :param max_side: Размер большей стороны уменьшенной копии для поиска (по умолчанию 1600).
+    :param min_components: Минимальное количество компонент-букв для оценки по снимку (по умолчанию 20).
+    :param max_components: Для скольких компонент-букв ищутся соседи по строке (по умолчанию 500).
+    :return: Пара (x-высота или None, источник оценки: "components", "dpi" или None).
+
+    Темные на локальном фоне пиксели бинаризуются адаптивным порогом с небольшим окном, чтобы буквы
+    мелкого текста не сливались, и среди связных компонент отбираются похожие на буквы по пропорциям
+    и заполнению. Буквой считается компонента, у которой в той же строке (общая нижняя линия, близкая
+    высота) рядом есть еще хотя бы две такие же: так отсекаются текстура бумаги и пятна. Большинство
+    строчных кириллических букв не имеют выносных элементов, поэтому x-высота основного текста - самый
+    частый размер: берется пик гистограммы логарифмов высот, на который не влияют заголовки.
+    """
+    pixels = np.asarray(image)
+    gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels[..., :3], cv2.COLOR_RGB2GRAY)
+    scale = min(1.0, max_side / max(gray.shape))
+    if scale < 1:
+        gray = downscale(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)))
+
+    mask = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    left, top, width, height, area = (stats[1:, column].astype(float) for column in range(5))
+    letters = ((height >= 4) & (height <= 0.1 * gray.shape[0]) & (width >= 0.15 * height) & (width <= 3 * height)
+               & (area >= 0.15 * width * height) & (area <= 0.95 * width * height))
+    left, top, width, height = left[letters], top[letters], width[letters], height[letters]
+    bottom, center = top + height, left + width / 2
+    # Соседи ищутся для равномерной выборки компонент: сравнение со всеми квадратично по их числу
+    sample = slice(None, None, -(-len(height) // max_components) or 1)
+    tolerance = 0.2 * height[sample, None]
+    neighbours = ((np.abs(bottom[sample, None] - bottom[None, :]) <= tolerance)
+                  & (np.abs(height[sample, None] - height[None, :]) <= tolerance)
+                  & (np.abs(center[sample, None] - center[None, :]) <= 2 * height[sample, None])).sum(axis=1) - 1
+    height = height[sample][neighbours >= 2]
+    if len(height) >= min_components:
+        edges = np.exp(np.arange(np.log(4), np.log(height.max()) + 0.2, 0.1))
+        peak = int(np.argmax(np.histogram(height, edges)[0]))
+        near_peak = (height >= edges[max(0, peak - 1)]) & (height < edges[min(len(edges) - 1, peak + 2)])
+        return float(np.median(height[near_peak])) / scale, "components"
+    if dpi:
+        # x-высота типичного шрифта - около половины кегля
+        return LABEL_TEXT_POINTS / 72 * dpi * 0.5, "dpi"
+    return None, None
+
+
+def get_text_scale_config():
+    """
+    Возвращает параметры нормализации масштаба для ключей кеша OCR.
+
+    :return: Кортеж (OCR_TARGET_X_HEIGHT, OCR_SCALE_LIMITS, OCR_SCALE_TOLERANCE, LABEL_TEXT_POINTS)
+             или None, если нормализация выключена.
+    """
+    if not OCR_SCALE_NORMALIZATION:
+        return None
+    return OCR_TARGET_X_HEIGHT, tuple(OCR_SCALE_LIMITS), OCR_SCALE_TOLERANCE, LABEL_TEXT_POINTS
+
+
+def get_text_regions_config():
+    """
+    Возвращает параметры поиска областей текста для ключей кеша OCR.
+
+    :return: Кортеж (max_side, padding, min_area, OCR_REGIONS_MAX_COVERAGE) для detect_text_regions()
+             или None, если поиск областей выключен.
+    """
+    if not OCR_REGIONS_ENABLED:
+        return None
+    return (TEXT_REGIONS_DEFAULTS["max_side"], TEXT_REGIONS_DEFAULTS["padding"], TEXT_REGIONS_DEFAULTS["min_area"],
+            OCR_REGIONS_MAX_COVERAGE)
+
+
+def normalize_text_scale(image, dpi=None, target=OCR_TARGET_X_HEIGHT, limits=OCR_SCALE_LIMITS, tolerance=OCR_SCALE_TOLERANCE):
+    """
+    Масштабирует изображение так, чтобы x-высота текста была около target пикселей.
+
+    :param image: Изображение в формате NumPy array.
+    :param dpi: Разрешение из метаданных (см. estimate_x_height()).
+    :param target: Целевая x-высота в пикселях (по умолчанию OCR_TARGET_X_HEIGHT).
+    :param limits: Минимальный и максимальный коэффициент масштаба.
+    :param tolerance: Допустимое относительное отклонение масштаба от 1, при котором изображение не меняется.
+    :return: Пара (изображение, коэффициент масштаба); координаты на нем делятся на коэффициент,
+             чтобы получить координаты исходного изображения.
+    """
+    pixels = np.asarray(image)
+    with span("text_scale") as scaling:
+        x_height, source = estimate_x_height(pixels, dpi)
+        scale = 1.0 if x_height is None else float(np.clip(target / x_height, *limits))
+        if abs(scale - 1.0) <= tolerance:
+            scale = 1.0
+        scaling.set(x_height=x_height, source=source, scale=scale)
+        if scale == 1.0:
+            return pixels, scale
+        height, width = pixels.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return downscale(pixels, size) if scale < 1 else cv2.resize(pixels, size, interpolation=cv2.INTER_CUBIC), scale
+
+
+def downscale(image: np.ndarray, size) -> np.ndarray:
+    """
+    Уменьшает изображение до заданного размера.
+
+    :param image: Изображение в формате NumPy array.
+    :param size: Размер результата (ширина, высота), не больше исходного.
+    :return: Уменьшенное изображение.
+
+    Пока размер больше удвоенного целевого, изображение уменьшается вдвое через pyrDown (сглаживание
+    и прореживание), а оставшийся коэффициент больше 0.5 применяется билинейной интерполяцией без
+    заметного наложения частот. На снимках 12 Мп это в несколько раз быстрее INTER_AREA с дробным коэффициентом.
+    """
+    while image.shape[1] >= 2 * size[0] and image.shape[0] >= 2 * size[1]:
+        image = cv2.pyrDown(image)
+    if (image.shape[1], image.shape[0]) == tuple(size):
+        return image
+    return cv2.resize(image, tuple(size), interpolation=cv2.INTER_LINEAR)
+
+
+def rescale_boxes(df: pd.DataFrame, scale: float) -> pd.DataFrame:
+    """
+    Переводит координаты прямоугольников из масштабированного изображения в исходное.
+
+    :param df: DataFrame с колонками left, top, width, height.
+    :param scale: Коэффициент масштаба из normalize_text_scale().
+    :return: Тот же DataFrame с пересчитанными координатами.
+    """
+    if scale != 1.0 and not df.empty:
+        for column in ('left', 'top', 'width', 'height'):
+            df[column] = np.rint(df[column].to_numpy(dtype=float) / scale).astype(np.int64)
+    return df
+
+
 def assign_graph_to_line(graph, text_line, horizontal_shift_threshold=50):
     """
     Определяет относится ли объект (граф) к данной текстовой линии.
@@ -123,4 +557,51 @@ def assign_graph_to_line(graph, text_line, horizontal_shift_threshold=50):
         if (text_line['left'] - horizontal_shift_threshold) <= corner[0] <= (text_line['left'] + text_line['width'] + horizontal_shift_threshold) and \
            text_line['top'] <= corner[1] <= text_line['top'] + text_line['height']:
             return True
-    return False
\ No newline at end of file
+    return False
+
+
+def assign_fields_to_lines(lines: pd.DataFrame, fields: pd.DataFrame, horizontal_shift_threshold=50) -> np.ndarray:
+    """
+    Векторно сопоставляет графы текстовым линиям по тому же условию, что и assign_graph_to_line.
+
+    :param lines: DataFrame текстовых линий с колонками left, top, width, height.
+    :param fields: DataFrame граф с колонками left, top, width, height.
+    :param horizontal_shift_threshold: Пороговое значение горизонтального смещения (по умолчанию 50).
+    :return: Для каждой графы позиция последней подходящей линии в lines или -1.
+
+    Линии сортируются по верхней границе; для каждого угла графы бинарным поиском выбираются
+    только линии, чья верхняя граница лежит в [y - max_height, y], и условие проверяется
+    векторно по этим парам. Как и в исходном цикле, при нескольких подходящих линиях
+    побеждает последняя в порядке lines.
+    """
+    line_left = lines['left'].to_numpy(dtype=float)
+    line_top = lines['top'].to_numpy(dtype=float)
+    line_bottom = line_top + lines['height'].to_numpy(dtype=float)
+    x_min = line_left - horizontal_shift_threshold
+    x_max = line_left + lines['width'].to_numpy(dtype=float) + horizontal_shift_threshold
+
+    field_left = fields['left'].to_numpy(dtype=float)
+    field_top = fields['top'].to_numpy(dtype=float)
+    field_right = field_left + fields['width'].to_numpy(dtype=float)
+    field_bottom = field_top + fields['height'].to_numpy(dtype=float)
+    corner_x = np.stack([field_left, field_right, field_left, field_right], axis=1).ravel()
+    corner_y = np.stack([field_top, field_top, field_bottom, field_bottom], axis=1).ravel()
+
+    by_top = np.argsort(line_top, kind='stable')
+    sorted_top = line_top[by_top]
+    max_height = float(np.max(line_bottom - line_top))
+    lo = np.searchsorted(sorted_top, corner_y - max_height, side='left')
+    hi = np.searchsorted(sorted_top, corner_y, side='right')
+
+    counts = hi - lo
+    corner_index = np.repeat(np.arange(len(corner_y)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    line_index = by_top[np.repeat(lo, counts) + offsets]
+
+    x = corner_x[corner_index]
+    y = corner_y[corner_index]
+    hit = (y <= line_bottom[line_index]) & (x_min[line_index] <= x) & (x <= x_max[line_index])
+
+    matched = np.full(len(fields), -1, dtype=np.int64)
+    np.maximum.at(matched, corner_index[hit] // 4, line_index[hit])
+    return matched
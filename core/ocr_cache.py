@@ -0,0 +1,117 @@
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Any, Optional
+import diskcache
+import numpy as np
+import pytesseract
+from constant import OCR_CACHE_DIR, OCR_CACHE_ENABLED, OCR_CACHE_SIZE_LIMIT
+
+
+@lru_cache(maxsize=None)
+def get_tesseract_version() -> str:
+    """
+    Возвращает версию установленного Tesseract (один раз на процесс).
+
+    :return: Строка версии или "unknown", если Tesseract недоступен.
+    """
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return "unknown"
+
+
+class OCRCache:
+    """
+    Постоянный кеш результатов OCR с адресацией по содержимому изображения.
+
+    Ключ строится из хеша пикселей (вместе с формой и типом массива), параметров
+    распознавания и версии Tesseract. Кеш ограничен по размеру и вытесняет давно
+    не использованные записи.
+
+    :param directory: Каталог кеша.
+    :param size_limit: Максимальный размер кеша в байтах.
+    :param enabled: Включен ли кеш.
+    """
+
+    def __init__(self, directory: str, size_limit: int, enabled: bool = True):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._cache: Optional[diskcache.Cache] = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> diskcache.Cache:
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = diskcache.Cache(
+                        self.directory,
+                        size_limit=self.size_limit,
+                        eviction_policy="least-recently-used",
+                    )
+        return self._cache
+
+    def make_key(self, pixels: np.ndarray, **params: Any) -> str:
+        """
+        Строит ключ записи по пикселям и параметрам распознавания.
+
+        :param pixels: Изображение в формате NumPy array.
+        :param params: Параметры, влияющие на результат (язык, порог, конфигурация Tesseract и т.п.).
+        :return: Шестнадцатеричный ключ.
+        """
+        pixels = np.ascontiguousarray(pixels)
+        digest = hashlib.blake2b(digest_size=32)
+        digest.update(f"{pixels.shape}|{pixels.dtype}|{get_tesseract_version()}".encode("utf-8"))
+        digest.update(repr(sorted(params.items())).encode("utf-8"))
+        digest.update(memoryview(pixels).cast("B"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Any:
+        """
+        Возвращает сохраненный результат или None.
+
+        :param key: Ключ записи.
+        :return: Результат или None при промахе.
+        """
+        value = self.cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Сохраняет результат.
+
+        :param key: Ключ записи.
+        :param value: Результат распознавания.
+        """
+        self.cache.set(key, value)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики попаданий и промахов текущего процесса и размер кеша.
+
+        :return: Словарь с ключами hits, misses, entries, volume.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.cache),
+            "volume": self.cache.volume(),
+        }
+
+    def clear(self) -> None:
+        """
+        Удаляет все записи кеша.
+        """
+        self.cache.clear()
+
+
+ocr_cache = OCRCache(OCR_CACHE_DIR, OCR_CACHE_SIZE_LIMIT, enabled=OCR_CACHE_ENABLED)
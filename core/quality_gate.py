@@ -0,0 +1,153 @@
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+import cv2
+import numpy as np
+from constant import QUALITY_GATE_ENABLED
+from core.tracing import traced
+
+
+@dataclass(frozen=True)
+class QualityThresholds:
+    """
+    Пороги быстрой проверки качества снимка перед OCR.
+
+    :param max_side: Размер большей стороны уменьшенной копии, на которой считаются метрики.
+    :param min_side: Минимальный размер меньшей стороны исходного снимка в пикселях.
+    :param min_brightness: Минимальная средняя яркость (0-255), ниже - снимок слишком темный.
+    :param max_brightness: Максимальная средняя яркость (0-255), выше - снимок пересвечен.
+    :param min_contrast: Минимальное стандартное отклонение яркости.
+    :param min_sharpness: Минимальная дисперсия лапласиана, ниже - снимок размыт.
+    :param min_edge_density: Минимальная доля пикселей границ Canny, ниже - на снимке нет текста.
+    """
+    max_side: int = 1024
+    min_side: int = 300
+    min_brightness: float = 40.0
+    max_brightness: float = 248.0
+    min_contrast: float = 12.0
+    min_sharpness: float = 10.0
+    min_edge_density: float = 0.005
+
+
+@dataclass
+class QualityReport:
+    """
+    Результат проверки качества снимка.
+
+    :param passed: Прошел ли снимок проверку.
+    :param reason: Код сработавшего правила (too_small, dark, overexposed, low_contrast, blurry, no_text) или None.
+    :param message: Сообщение для пользователя.
+    :param metrics: Значения метрик, по которым принималось решение.
+    """
+    passed: bool
+    reason: Optional[str] = None
+    message: str = ""
+    metrics: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+REJECTION_MESSAGES = {
+    "too_small": "Слишком маленькое изображение",
+    "dark": "Снимок слишком темный",
+    "overexposed": "Снимок пересвечен",
+    "low_contrast": "Недостаточный контраст снимка",
+    "blurry": "Снимок размыт",
+    "no_text": "На снимке не найден текст",
+}
+
+
+class QualityGate:
+    """
+    Отбраковывает размытые, темные, пересвеченные снимки и снимки без текста до предобработки и OCR.
+
+    Метрики считаются по уменьшенной копии в оттенках серого: средняя яркость и ее отклонение,
+    дисперсия лапласиана (резкость) и доля границ Canny (оценка наличия текста). Правила
+    проверяются по порядку, срабатывает первое. Для каждого правила ведется счетчик срабатываний.
+
+    :param thresholds: Пороги проверки.
+    :param enabled: Включена ли проверка (если нет, все снимки проходят).
+    """
+
+    def __init__(self, thresholds: QualityThresholds = QualityThresholds(), enabled: bool = True):
+        self.thresholds = thresholds
+        self.enabled = enabled
+        self.checked = 0
+        self.rejections = {reason: 0 for reason in REJECTION_MESSAGES}
+        self._lock = threading.Lock()
+
+    def measure(self, image: np.ndarray) -> Dict[str, float]:
+        """
+        Вычисляет метрики качества снимка.
+
+        :param image: Изображение в формате NumPy array (RGB или оттенки серого, uint8).
+        :return: Словарь с метриками min_side, brightness, contrast, sharpness, edge_density.
+        """
+        pixels = np.asarray(image)
+        gray = pixels if pixels.ndim == 2 else cv2.cvtColor(pixels[..., :3], cv2.COLOR_RGB2GRAY)
+        scale = min(1.0, self.thresholds.max_side / max(gray.shape))
+        if scale < 1:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        mean, std = cv2.meanStdDev(gray)
+        return {
+            "min_side": float(min(pixels.shape[:2])),
+            "brightness": float(mean[0][0]),
+            "contrast": float(std[0][0]),
+            "sharpness": float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+            "edge_density": float(np.count_nonzero(cv2.Canny(gray, 50, 150)) / gray.size),
+        }
+
+    @traced("quality_gate")
+    def check(self, image: np.ndarray) -> QualityReport:
+        """
+        Проверяет качество снимка.
+
+        :param image: Изображение в формате NumPy array.
+        :return: QualityReport с кодом первого сработавшего правила или passed=True.
+        """
+        if not self.enabled:
+            return QualityReport(passed=True)
+
+        metrics = self.measure(image)
+        t = self.thresholds
+        rules = (
+            ("too_small", metrics["min_side"] < t.min_side),
+            ("dark", metrics["brightness"] < t.min_brightness),
+            ("overexposed", metrics["brightness"] > t.max_brightness),
+            ("low_contrast", metrics["contrast"] < t.min_contrast),
+            ("blurry", metrics["sharpness"] < t.min_sharpness),
+            ("no_text", metrics["edge_density"] < t.min_edge_density),
+        )
+        reason = next((name for name, fired in rules if fired), None)
+
+        with self._lock:
+            self.checked += 1
+            if reason is not None:
+                self.rejections[reason] += 1
+        if reason is None:
+            return QualityReport(passed=True, metrics=metrics)
+        return QualityReport(passed=False, reason=reason, message=REJECTION_MESSAGES[reason], metrics=metrics)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики проверок текущего процесса.
+
+        :return: Словарь с количеством проверенных снимков и срабатываний каждого правила.
+        """
+        with self._lock:
+            return {"checked": self.checked, "rejections": dict(self.rejections)}
+
+
+def summarize_rejections(reports: List[QualityReport]) -> str:
+    """
+    Формирует сообщение об отказе по отчетам всех снимков продукта.
+
+    :param reports: Отчеты проверки снимков.
+    :return: Сообщение вида "Не удалось распознать текст: Снимок размыт; ...".
+    """
+    messages = list(dict.fromkeys(report.message for report in reports if not report.passed))
+    return "Не удалось распознать текст: " + "; ".join(messages)
+
+
+quality_gate = QualityGate(enabled=QUALITY_GATE_ENABLED)
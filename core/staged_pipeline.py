@@ -0,0 +1,195 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from constant import TRACE_LOG_PATH, TRACING_ENABLED
+from core.tracing import Trace, finish_trace, span, use_trace
+
+
+@dataclass
+class Stage:
+    """
+    Этап конвейера.
+
+    :param name: Имя этапа (в статистике и трассе - "stage.<name>").
+    :param func: Функция этапа: принимает значение элемента и возвращает значение для следующего этапа.
+    :param workers: Количество потоков этапа.
+    :param queue_size: Емкость входной очереди этапа.
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = 2
+
+
+@dataclass
+class StageItem:
+    """
+    Элемент, прошедший конвейер.
+
+    :param index: Порядковый номер элемента во входной последовательности.
+    :param value: Результат последнего выполненного этапа.
+    :param error: Исключение, прервавшее обработку элемента, или None.
+    :param failed_stage: Имя этапа, на котором произошла ошибка.
+    :param timings: Время выполнения каждого этапа в секундах.
+    :param trace: Трасса элемента, если трассировка включена.
+    """
+    index: int
+    value: Any
+    error: Optional[BaseException] = None
+    failed_stage: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    trace: Optional[Trace] = None
+
+
+_DONE = object()
+
+
+class StagedPipeline:
+    """
+    Конвейер производитель-потребитель: этапы работают одновременно в своих потоках
+    и соединены ограниченными очередями.
+
+    Пока модель обрабатывает один продукт, OCR и предобработка следующих продуктов идут параллельно,
+    поэтому пропускная способность ограничена самым медленным этапом, а не суммой этапов.
+
+    :param stages: Этапы в порядке выполнения.
+    :param trace_name: Имя трассы каждого элемента (None - без трассировки).
+    :param tracing: Включена ли трассировка (по умолчанию TRACING_ENABLED из constant.py).
+    :param log_path: Файл JSONL для трасс (по умолчанию TRACE_LOG_PATH).
+
+    Подробности:
+    - Результаты выдаются в порядке входной последовательности.
+    - Исключение в этапе прерывает обработку только этого элемента: следующие этапы его пропускают,
+      а ошибка возвращается в StageItem.error.
+    - Количество элементов в работе ограничено суммой емкостей очередей и потоков, поэтому
+      память не зависит от длины входа, а медленный потребитель останавливает чтение входа.
+    - Потоки отпускают GIL в Tesseract, OpenCV и llama.cpp, поэтому этапы действительно перекрываются.
+    """
+
+    def __init__(self, stages: List[Stage], trace_name: Optional[str] = None,
+                 tracing: bool = TRACING_ENABLED, log_path: Optional[str] = TRACE_LOG_PATH):
+        self.stages = stages
+        self.trace_name = trace_name if tracing else None
+        self.log_path = log_path
+        self.capacity = sum(stage.queue_size + stage.workers for stage in stages) + 1
+        self._lock = threading.Lock()
+        self._stats = {stage.name: {"items": 0, "errors": 0, "busy_seconds": 0.0} for stage in stages}
+        self.wall_seconds = 0.0
+
+    def _work(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue, consumers: int,
+              finished: List[int], stop: threading.Event) -> None:
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # Последний завершившийся поток этапа передает признак конца каждому потоку следующего
+                with self._lock:
+                    finished[0] += 1
+                    last = finished[0] == stage.workers
+                if last:
+                    for _ in range(consumers):
+                        outbox.put(_DONE)
+                return
+            if item.error is None and not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    with use_trace(item.trace), span(f"stage.{stage.name}"):
+                        item.value = stage.func(item.value)
+                except Exception as e:
+                    item.error = e
+                    item.failed_stage = stage.name
+                item.timings[stage.name] = time.perf_counter() - started
+                with self._lock:
+                    stats = self._stats[stage.name]
+                    stats["items"] += 1
+                    stats["errors"] += item.error is not None
+                    stats["busy_seconds"] += item.timings[stage.name]
+            outbox.put(item)
+
+    def _feed(self, items: Iterable[Any], inbox: queue.Queue, workers: int, slots: threading.Semaphore,
+              stop: threading.Event, errors: List[BaseException]) -> None:
+        try:
+            for index, value in enumerate(items):
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                trace = Trace(self.trace_name) if self.trace_name else None
+                inbox.put(StageItem(index=index, value=value, trace=trace))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(workers):
+                inbox.put(_DONE)
+
+    def run(self, items: Iterable[Any]) -> Iterator[StageItem]:
+        """
+        Пропускает элементы через конвейер.
+
+        :param items: Входные значения (читаются лениво по мере освобождения места в конвейере).
+        :return: Итератор StageItem в порядке входа.
+        :raises Exception: Ошибка чтения входной последовательности (после выдачи уже прочитанных элементов).
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages] + [queue.Queue()]
+        slots = threading.Semaphore(self.capacity)
+        stop = threading.Event()
+        feed_errors: List[BaseException] = []
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], self.stages[0].workers, slots, stop, feed_errors),
+                                    name="stage-feed", daemon=True)]
+        consumers = [stage.workers for stage in self.stages[1:]] + [1]
+        for position, stage in enumerate(self.stages):
+            finished = [0]
+            for number in range(stage.workers):
+                args = (stage, queues[position], queues[position + 1], consumers[position], finished, stop)
+                threads.append(threading.Thread(target=self._work, args=args, name=f"stage-{stage.name}-{number}", daemon=True))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        pending: Dict[int, StageItem] = {}
+        next_index = 0
+        outbox = queues[-1]
+        drained = False
+        try:
+            while True:
+                item = outbox.get()
+                if item is _DONE:
+                    drained = True
+                    break
+                pending[item.index] = item
+                while next_index in pending:
+                    ready = pending.pop(next_index)
+                    next_index += 1
+                    if ready.trace is not None:
+                        finish_trace(ready.trace, self.log_path)
+                    slots.release()
+                    yield ready
+        finally:
+            # Остановка при досрочном выходе: оставшиеся элементы проходят этапы без обработки
+            stop.set()
+            while not drained:
+                drained = outbox.get() is _DONE
+                slots.release()
+            for thread in threads:
+                thread.join()
+            self.wall_seconds += time.perf_counter() - started
+        if feed_errors:
+            raise feed_errors[0]
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Возвращает статистику этапов по всем запускам.
+
+        :return: Для каждого этапа: обработано элементов, ошибок, суммарное время работы,
+                 количество потоков и загрузка (доля времени, когда потоки этапа были заняты).
+        """
+        with self._lock:
+            result = {}
+            for stage in self.stages:
+                stats = dict(self._stats[stage.name], workers=stage.workers)
+                capacity = stage.workers * self.wall_seconds
+                stats["utilization"] = stats["busy_seconds"] / capacity if capacity else 0.0
+                result[stage.name] = stats
+            return result
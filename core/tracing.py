@@ -0,0 +1,346 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from constant import TRACE_LOG_PATH, TRACING_ENABLED
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def get_peak_rss() -> int:
+    """
+    Возвращает максимальный размер резидентной памяти процесса за все время работы (ru_maxrss) в байтах.
+
+    :return: Пиковый RSS или 0, если платформа его не сообщает.
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS - байты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_current_rss() -> Optional[int]:
+    """
+    Возвращает текущий размер резидентной памяти процесса в байтах.
+
+    :return: RSS из /proc/self/statm или None, если платформа его не сообщает.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            return int(file.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Span:
+    """
+    Замер одного этапа обработки.
+
+    :param name: Имя этапа.
+    :param start: Начало относительно начала трассы в секундах.
+    :param duration: Длительность в секундах.
+    :param attrs: Атрибуты этапа (prompt_tokens, generated_tokens и т.п.).
+    :param rss_delta: Изменение текущего RSS процесса за время этапа в байтах (None - не замерялось).
+                      RSS общий для процесса, поэтому при параллельных этапах в него входят и их выделения.
+    """
+    __slots__ = ("name", "start", "duration", "attrs", "rss_delta")
+
+    def __init__(self, name: str, start: float, duration: float, attrs: Dict[str, Any], rss_delta: Optional[int] = None):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.attrs = attrs
+        self.rss_delta = rss_delta
+
+    def to_dict(self) -> dict:
+        data = {"name": self.name, "start": self.start, "duration": self.duration, **self.attrs}
+        if self.rss_delta is not None:
+            data["rss_delta"] = self.rss_delta
+        generated = self.attrs.get("generated_tokens")
+        if generated and self.duration > 0:
+            data["tokens_per_second"] = generated / self.duration
+        return data
+
+
+class Trace:
+    """
+    Трасса одного запроса: список замеров этапов и общие атрибуты.
+
+    :param name: Имя запроса (например, "result_pipeline").
+    :param attrs: Атрибуты запроса.
+
+    peak_rss трассы - максимум RSS процесса за все время его работы (ru_maxrss) на момент завершения,
+    а не пик этого запроса; изменение памяти отдельных этапов - rss_delta замеров.
+    """
+
+    def __init__(self, name: str, **attrs: Any):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.peak_rss = 0
+        self.spans: List[Span] = []
+        self._origin = time.perf_counter()
+
+    def add_span(self, name: str, started: float, finished: float, rss_delta: Optional[int] = None, **attrs: Any) -> Span:
+        """
+        Добавляет замер этапа.
+
+        :param name: Имя этапа.
+        :param started: Начало по time.perf_counter().
+        :param finished: Окончание по time.perf_counter().
+        :param rss_delta: Изменение RSS процесса за время этапа в байтах.
+        :param attrs: Атрибуты этапа.
+        :return: Добавленный Span.
+        """
+        span = Span(name, started - self._origin, finished - started, attrs, rss_delta)
+        # list.append атомарен, поэтому этапы из потоков OCR добавляются без блокировки
+        self.spans.append(span)
+        return span
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "peak_rss": self.peak_rss,
+            **self.attrs,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+
+
+class _NullSpan:
+    """
+    Замер-заглушка, который возвращается, когда трасса не активна.
+    """
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+    def set(self, **attrs: Any) -> None:
+        return None
+
+
+class _ActiveSpan:
+    """
+    Контекстный менеджер замера этапа активной трассы.
+    """
+    __slots__ = ("trace", "name", "attrs", "started", "rss")
+
+    def __init__(self, trace: Trace, name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> "_ActiveSpan":
+        self.rss = get_current_rss()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        finished = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        rss = get_current_rss()
+        rss_delta = rss - self.rss if rss is not None and self.rss is not None else None
+        self.trace.add_span(self.name, self.started, finished, rss_delta=rss_delta, **self.attrs)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+_NULL_SPAN = _NullSpan()
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """
+    Возвращает активную трассу текущего контекста или None.
+    """
+    return _current_trace.get()
+
+
+def span(name: str, **attrs: Any):
+    """
+    Замеряет этап внутри активной трассы.
+
+    :param name: Имя этапа.
+    :param attrs: Начальные атрибуты этапа; дополнить их можно через .set().
+    :return: Контекстный менеджер. Если трасса не активна, возвращается общая заглушка,
+             поэтому выключенная трассировка стоит одного обращения к ContextVar.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _ActiveSpan(trace, name, attrs)
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """
+    Декоратор, замеряющий вызов функции как этап активной трассы.
+
+    :param name: Имя этапа (по умолчанию имя функции).
+    :return: Декоратор.
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with _ActiveSpan(trace, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceMetrics:
+    """
+    Агрегирует завершенные трассы для экспорта в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self.traces = 0
+        self.peak_rss = 0
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, trace: Trace) -> None:
+        """
+        Учитывает завершенную трассу.
+
+        :param trace: Трасса.
+        """
+        with self._lock:
+            self.traces += 1
+            self.peak_rss = max(self.peak_rss, trace.peak_rss)
+            for item in [Span(trace.name, 0.0, trace.duration, {})] + trace.spans:
+                stage = self.stages.setdefault(item.name, {"count": 0, "seconds": 0.0, "prompt_tokens": 0, "generated_tokens": 0})
+                stage["count"] += 1
+                stage["seconds"] += item.duration
+                stage["prompt_tokens"] += item.attrs.get("prompt_tokens", 0)
+                stage["generated_tokens"] += item.attrs.get("generated_tokens", 0)
+
+    def render_prometheus(self, prefix: str = "foodscan") -> str:
+        """
+        Возвращает метрики в текстовом формате Prometheus.
+
+        :param prefix: Префикс имен метрик.
+        :return: Текст метрик.
+        """
+        with self._lock:
+            lines = [
+                f"# TYPE {prefix}_traces_total counter",
+                f"{prefix}_traces_total {self.traces}",
+                f"# TYPE {prefix}_peak_rss_bytes gauge",
+                f"{prefix}_peak_rss_bytes {self.peak_rss}",
+                f"# TYPE {prefix}_stage_seconds summary",
+            ]
+            for name, stage in sorted(self.stages.items()):
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]:.6f}')
+            lines.append(f"# TYPE {prefix}_stage_tokens_total counter")
+            for name, stage in sorted(self.stages.items()):
+                for kind in ("prompt_tokens", "generated_tokens"):
+                    if stage[kind]:
+                        lines.append(f'{prefix}_stage_tokens_total{{stage="{name}",kind="{kind[:-7]}"}} {stage[kind]}')
+        return "\n".join(lines) + "\n"
+
+
+trace_metrics = TraceMetrics()
+_log_lock = threading.Lock()
+
+
+def export_jsonl(trace: Trace, path: str) -> None:
+    """
+    Дописывает трассу строкой JSON в файл.
+
+    :param trace: Трасса.
+    :param path: Путь к файлу JSONL.
+    """
+    line = trace.to_json() + "\n"
+    with _log_lock, open(path, "a", encoding="utf-8") as file:
+        file.write(line)
+
+
+def finish_trace(trace: Trace, log_path: Optional[str] = TRACE_LOG_PATH) -> None:
+    """
+    Завершает трассу: фиксирует длительность и пиковую память процесса, учитывает ее в trace_metrics.
+
+    :param trace: Трасса.
+    :param log_path: Файл JSONL для завершенной трассы (None - не писать).
+    """
+    trace.duration = time.perf_counter() - trace._origin
+    trace.peak_rss = get_peak_rss()
+    trace_metrics.observe(trace)
+    if log_path:
+        export_jsonl(trace, log_path)
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """
+    Делает трассу активной в текущем контексте, не завершая ее при выходе.
+
+    :param trace: Трасса (или None - трассировка выключена).
+    :return: Та же трасса.
+
+    Нужна, когда этапы одного запроса выполняются в разных потоках по очереди,
+    а трасса завершается отдельно через finish_trace().
+    """
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, enabled: bool = TRACING_ENABLED, log_path: Optional[str] = TRACE_LOG_PATH, **attrs: Any) -> Iterator[Optional[Trace]]:
+    """
+    Открывает трассу запроса в текущем контексте.
+
+    :param name: Имя запроса.
+    :param enabled: Включена ли трассировка (по умолчанию TRACING_ENABLED из constant.py).
+    :param log_path: Файл JSONL для завершенных трасс (по умолчанию TRACE_LOG_PATH, None - не писать).
+    :param attrs: Атрибуты запроса.
+    :return: Трасса или None, если трассировка выключена.
+
+    Завершенная трасса учитывается в trace_metrics. Вложенный вызов внутри активной трассы
+    не создает новую трассу и возвращает текущую.
+    """
+    active = _current_trace.get()
+    if not enabled or active is not None:
+        yield active
+        return
+
+    trace = Trace(name, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        finish_trace(trace, log_path)
@@ -1,17 +1,31 @@
-from skimage import exposure
+from skimage import exposure, img_as_ubyte
+from constant import PREPROCESS_METHOD
+from core.tracing import traced
+import cv2
 import numpy as np
 
+# Параметры CLAHE, эквивалентные equalize_adapthist() по умолчанию: сетка 8x8 тайлов и
+# clip_limit=0.01 доли пикселей тайла (в OpenCV порог задается относительно среднего по 256 корзинам)
+CLAHE_TILE_GRID = (8, 8)
+CLAHE_CLIP_LIMIT = 0.01 * 256
 
-def preprocess_image(image_np):
+
+@traced()
+def preprocess_image(image_np, method=PREPROCESS_METHOD):
     """
     Предварительно обрабатывает изображение для улучшения контраста.
 
     Параметры:
     - image_np: Массив NumPy, представляющий изображение.
+    - method: "opencv" - CLAHE в uint8 (см. preprocess_image_uint8),
+      "skimage" - прежняя обработка через equalize_adapthist в float64.
 
     Возвращает:
-    np.array: Предварительно обработанное изображение с улучшенным контрастом.
+    np.array: Предварительно обработанное изображение с улучшенным контрастом
+    (uint8 для "opencv", float в диапазоне [0, 1] для "skimage").
     """
+    if method == "opencv":
+        return preprocess_image_uint8(image_np)
     try:
         # Улучшение контраста изображения
         image_eq = exposure.equalize_adapthist(image_np)
@@ -28,6 +42,67 @@ def preprocess_image(image_np):
         print("Ошибка обработки изображения:", e)
 
 
+def preprocess_image_uint8(image_np):
+    """
+    Улучшает контраст изображения без перехода к float: CLAHE по яркости и растяжение по процентилям.
+
+    Параметры:
+    - image_np: Массив NumPy, представляющий изображение (RGB, RGBA или оттенки серого).
+
+    Возвращает:
+    np.array: Изображение uint8 той же формы (без альфа-канала) с улучшенным контрастом.
+
+    Подробности:
+    - Как и equalize_adapthist, выравнивается только канал V пространства HSV.
+    - Процентили 0.2 и 99.8 считаются по гистограмме, а масштабирование выполняется
+      таблицей подстановки на месте, поэтому дополнительная память - несколько копий uint8.
+    """
+    try:
+        if image_np.dtype != np.uint8:
+            image_np = img_as_ubyte(image_np)
+        if image_np.ndim == 3 and image_np.shape[2] == 4:
+            image_np = image_np[..., :3]
+        image_np = np.ascontiguousarray(image_np)
+
+        clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+        if image_np.ndim == 2:
+            image_eq = clahe.apply(image_np)
+        else:
+            image_eq = cv2.cvtColor(image_np, cv2.COLOR_RGB2HSV)
+            hue, saturation, value = cv2.split(image_eq)
+            clahe.apply(value, dst=value)
+            cv2.merge((hue, saturation, value), dst=image_eq)
+            cv2.cvtColor(image_eq, cv2.COLOR_HSV2RGB, dst=image_eq)
+
+        # Процентили по гистограмме всех каналов вместо сортировки всех значений
+        histogram = cv2.calcHist([image_eq.reshape(-1, 1)], [0], None, [256], [0, 256]).ravel().cumsum()
+        total = histogram[-1]
+        v_min = int(np.searchsorted(histogram, total * 0.002, side="right"))
+        v_max = int(np.searchsorted(histogram, total * 0.998, side="left"))
+        if v_max <= v_min:
+            return image_eq
+
+        # Аналог exposure.rescale_intensity(in_range=(v_min, v_max)) для uint8
+        lut = np.clip((np.arange(256, dtype=np.float32) - v_min) * (255.0 / (v_max - v_min)), 0, 255)
+        cv2.LUT(image_eq, np.rint(lut).astype(np.uint8), dst=image_eq)
+        return image_eq
+
+    except Exception as e:
+        print("Ошибка обработки изображения:", e)
+
+
+def to_uint8(image_np):
+    """
+    Приводит результат preprocess_image к uint8.
+
+    :param image_np: Изображение uint8 или float в диапазоне [0, 1].
+    :return: Изображение uint8.
+    """
+    if image_np.dtype == np.uint8:
+        return image_np
+    return (image_np * 255).astype(np.uint8)
+
+
 def get_dpi(image):
     """
     Получает разрешение (dpi) изображения.
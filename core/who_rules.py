@@ -0,0 +1,344 @@
+import hashlib
+import operator
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+
+CEREALS = "Сухие каши и крахмалистые продукты"
+DAIRY = "Молочные продукты"
+PUREES = "Фруктовые и овощные пюре/коктейли и фруктовые десерты"
+SNACKS = "Сухие закуски и перекусы"
+CONFECTIONERY = "Кондитерские изделия"
+DRINKS = "Напитки"
+
+BABY_FOOD_CATEGORIES = (CEREALS, DAIRY, PUREES, SNACKS)
+FORBIDDEN_CATEGORIES = (CONFECTIONERY, DRINKS)
+# Категории, для которых в таблице есть решение. "Ингредиенты" из промпта извлечения в нее не входят:
+# требований ВОЗ к ним нет, поэтому такой продукт, как и продукт неизвестной категории,
+# получает вердикт "недостаточно данных", а не проходит проверку без правил.
+KNOWN_CATEGORIES = BABY_FOOD_CATEGORIES + FORBIDDEN_CATEGORIES
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    Строка таблицы требований ВОЗ.
+
+    :param name: Идентификатор правила.
+    :param metric: Имя показателя, вычисляемого в compute_metrics().
+    :param op: Условие соответствия: "<=", ">=" или "==".
+    :param thresholds: Пороговое значение для каждой категории; ключ None - для всех категорий.
+    :param message: Текст причины несоответствия (может содержать {value} и {threshold}).
+    """
+    name: str
+    metric: str
+    op: str
+    thresholds: Tuple[Tuple[Optional[str], float], ...]
+    message: str
+
+
+# Таблица требований из FROM_JSON_2_RULE_PROMPT.
+# Содержание фруктов и общий сахар не проверяются: этих полей нет в JSON, извлекаемом моделью.
+# Верхний возрастной предел 12 месяцев для продуктов из смеси или пюре применяется к категории пюре.
+RULES: Tuple[Rule, ...] = (
+    Rule("energy_min", "kcal_per_100g", ">=",
+         ((CEREALS, 80), (DAIRY, 60), (PUREES, 60)),
+         "Энергетическая ценность {value:.0f} ккал/100 г ниже минимума {threshold:.0f}"),
+    Rule("energy_max", "kcal_per_100g", "<=",
+         ((SNACKS, 50),),
+         "Энергетическая ценность {value:.0f} ккал/100 г выше максимума {threshold:.0f}"),
+    Rule("sodium", "sodium_mg_per_100kcal", "<=",
+         tuple((category, 50) for category in BABY_FOOD_CATEGORIES),
+         "Натрий {value:.1f} мг/100 ккал выше максимума {threshold:.0f}"),
+    Rule("added_sugar", "has_added_sugar", "==",
+         tuple((category, 0) for category in BABY_FOOD_CATEGORIES),
+         "Содержит добавленные сахара или подсластители"),
+    Rule("milk_protein", "milk_protein_per_100kcal", "<=",
+         ((CEREALS, 5.5), (PUREES, 5.5), (SNACKS, 5.5)),
+         "Белок {value:.1f} г/100 ккал выше максимума {threshold} для продукта с молоком"),
+    Rule("fat", "fat_per_100kcal", "<=",
+         tuple((category, 4.5) for category in BABY_FOOD_CATEGORIES),
+         "Жиры {value:.1f} г/100 ккал выше максимума {threshold}"),
+    Rule("age_min", "age_min_months", ">=",
+         tuple((category, 6) for category in BABY_FOOD_CATEGORIES),
+         "Возрастная маркировка с {value:.0f} мес. раньше {threshold:.0f} мес."),
+    Rule("age_max", "age_max_months", "<=",
+         tuple((category, 12 if category == PUREES else 36) for category in BABY_FOOD_CATEGORIES),
+         "Возрастная маркировка до {value:.0f} мес. выходит за {threshold:.0f} мес."),
+    Rule("forbidden_category", "is_forbidden_category", "==",
+         ((None, 0),),
+         "Категория продукта не допускается для детей до 3 лет"),
+    Rule("trans_fat", "has_trans_fat", "==",
+         ((None, 0),),
+         "Содержит транс-жиры"),
+    Rule("marketing", "has_marketing_labels", "==",
+         ((None, 0),),
+         "Содержит рекламные заявления на упаковке"),
+)
+
+# Показатели, без которых продукт нельзя признать соответствующим требованиям.
+# Показатель обязателен, если для категории продукта есть правило с ним (при неизвестной
+# категории - всегда); категория из KNOWN_CATEGORIES нужна всегда.
+REQUIRED_METRICS: Dict[str, str] = {
+    "category": "категория продукта из таблицы требований",
+    "kcal_per_100g": "энергетическая ценность в ккал",
+    "age_min_months": "возрастная маркировка",
+}
+
+RULES_VERSION = hashlib.sha256(repr((RULES, REQUIRED_METRICS, KNOWN_CATEGORIES)).encode("utf-8")).hexdigest()[:12]
+
+_OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    "<=": operator.le,
+    ">=": operator.ge,
+    "==": operator.eq,
+}
+
+_TRUE_VALUES = {"true", "да", "yes", "1"}
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_AGE_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:(мес|лет|год)\w*\.?)?(?:\s*(?:-|–|до)\s*(\d+(?:[.,]\d+)?)\s*(?:(мес|лет|год)\w*)?)?",
+                     re.IGNORECASE)
+_KJ_RE = re.compile(r"кдж|kj", re.IGNORECASE)
+_KCAL_RE = re.compile(r"ккал|kcal", re.IGNORECASE)
+KJ_PER_KCAL = 4.184
+_MILK_RE = re.compile(r"молок|молоч|сливк", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    """
+    Правило, подготовленное к векторной проверке.
+
+    :param rule: Исходное правило.
+    :param check: Функция сравнения показателя с порогом.
+    :param default: Порог для всех категорий (NaN, если правило зависит от категории).
+    :param by_category: Пороги по категориям.
+    """
+    rule: Rule
+    check: Callable[[Any, Any], Any]
+    default: float
+    by_category: Dict[str, float]
+
+
+@dataclass
+class Verdict:
+    """
+    Результат проверки продукта.
+
+    :param passed: True, если продукт соответствует всем применимым требованиям.
+    :param reasons: Причины несоответствия.
+    :param missing: Обязательные показатели (REQUIRED_METRICS), которые не удалось извлечь;
+                    если нарушений нет, а список не пуст, данных для решения недостаточно.
+    """
+    passed: bool
+    reasons: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+
+    @property
+    def insufficient(self) -> bool:
+        return not self.reasons and bool(self.missing)
+
+
+def compile_rules(rules: Tuple[Rule, ...] = RULES) -> List[CompiledRule]:
+    """
+    Подготавливает таблицу правил к проверке.
+
+    :param rules: Таблица правил.
+    :return: Список скомпилированных правил.
+    """
+    compiled = []
+    for rule in rules:
+        thresholds = dict(rule.thresholds)
+        default = thresholds.pop(None, np.nan)
+        compiled.append(CompiledRule(rule, _OPERATORS[rule.op], float(default), {k: float(v) for k, v in thresholds.items()}))
+    return compiled
+
+
+COMPILED_RULES = compile_rules()
+
+
+def _to_float(value: Any) -> float:
+    """
+    Извлекает число из значения JSON ("2,7", "77 ккал", 77).
+    """
+    if isinstance(value, bool) or value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value))
+    return float(match.group().replace(",", ".")) if match else np.nan
+
+
+def _to_flag(value: Any) -> float:
+    """
+    Приводит значение JSON к флагу 1.0/0.0 (NaN, если значение неизвестно).
+    """
+    if isinstance(value, bool):
+        return float(value)
+    if value is None:
+        return np.nan
+    text = str(value).strip().lower()
+    if text in ("", "none", "null"):
+        return np.nan
+    return float(text in _TRUE_VALUES)
+
+
+def _to_kcal(value: Any) -> float:
+    """
+    Извлекает энергетическую ценность в ккал из значения с явной единицей ("304 кДж", "72 ккал").
+
+    Число без единицы не используется: на этикетках энергия указывается и в кДж, и в ккал.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return np.nan
+    text = str(value)
+    kj, kcal = _KJ_RE.search(text), _KCAL_RE.search(text)
+    if kcal and (not kj or kcal.start() < kj.start()):
+        # "72 ккал / 304 кДж": число перед ккал
+        return _to_float(text[:kcal.start()].rsplit("/", 1)[-1])
+    if kj:
+        return _to_float(text[:kj.start()].rsplit("/", 1)[-1]) / KJ_PER_KCAL
+    return np.nan
+
+
+def _normalize_category(value: Any) -> str:
+    """
+    Приводит категорию к названию из KNOWN_CATEGORIES ("молочные продукты ", "Фруктовые и овощные пюре").
+
+    Совпадение ищется без учета регистра и пробелов по краям; допускается начало названия не короче
+    одного слова. Возвращает пустую строку, если категория не найдена или подходит к нескольким.
+    """
+    if value is None:
+        return ""
+    text = " ".join(str(value).split()).casefold()
+    if not text or text in ("none", "null"):
+        return ""
+    exact = [category for category in KNOWN_CATEGORIES if category.casefold() == text]
+    if exact:
+        return exact[0]
+    matches = [category for category in KNOWN_CATEGORIES
+               if len(text) >= 5 and (category.casefold().startswith(text) or text.startswith(category.casefold()))]
+    return matches[0] if len(matches) == 1 else ""
+
+
+def _parse_age(value: Any) -> Tuple[float, float]:
+    """
+    Извлекает возрастной диапазон в месяцах из строки вида "с 8 месяцев", "6-36 мес", "от 1 года до 3 лет".
+    """
+    if value is None:
+        return np.nan, np.nan
+    match = _AGE_RE.search(str(value))
+    if not match:
+        return np.nan, np.nan
+    low_unit, high_unit = match.group(2) or match.group(4), match.group(4) or match.group(2)
+    low = float(match.group(1).replace(",", "."))
+    high = float(match.group(3).replace(",", ".")) if match.group(3) else np.nan
+    if low_unit and low_unit.lower() in ("лет", "год"):
+        low *= 12
+    if high_unit and high_unit.lower() in ("лет", "год"):
+        high *= 12
+    return low, high
+
+
+def compute_metrics(products: pd.DataFrame) -> pd.DataFrame:
+    """
+    Вычисляет показатели для проверки правил по JSON продуктов.
+
+    :param products: DataFrame, строки которого - словари из parse_json_string().
+    :return: DataFrame показателей с тем же индексом.
+    """
+    def column(name):
+        if name in products:
+            return products[name]
+        return pd.Series([None] * len(products), index=products.index, dtype=object)
+
+    kcal = column("kcal").map(_to_float)
+    kcal = kcal.fillna(column("energy").map(_to_kcal))
+    kcal_safe = kcal.where(kcal > 0)
+    proteins = column("proteins").map(_to_float)
+    fats = column("fats").map(_to_float)
+    sodium = column("sodium").map(_to_float)
+    category = column("category").map(_normalize_category)
+    contains_milk = column("composition").fillna("").astype(str).str.contains(_MILK_RE)
+    ages = column("old").map(_parse_age)
+
+    metrics = pd.DataFrame(index=products.index)
+    metrics["category"] = category
+    metrics["kcal_per_100g"] = kcal
+    metrics["sodium_mg_per_100kcal"] = sodium * 100 / kcal_safe
+    metrics["fat_per_100kcal"] = fats * 100 / kcal_safe
+    metrics["milk_protein_per_100kcal"] = (proteins * 100 / kcal_safe).where(contains_milk)
+    metrics["has_added_sugar"] = np.fmax(column("HasSugar").map(_to_flag), column("HasSubSugar").map(_to_flag))
+    metrics["has_trans_fat"] = column("HasTransFat").map(_to_flag)
+    metrics["has_marketing_labels"] = column("HasMarketingLabels").map(_to_flag)
+    metrics["is_forbidden_category"] = category.isin(FORBIDDEN_CATEGORIES).astype(float)
+    metrics["age_min_months"] = ages.map(lambda age: age[0])
+    metrics["age_max_months"] = ages.map(lambda age: age[1])
+    return metrics
+
+
+def evaluate_frame(products: pd.DataFrame, rules: Optional[List[CompiledRule]] = None) -> pd.DataFrame:
+    """
+    Проверяет каталог продуктов на соответствие требованиям ВОЗ.
+
+    :param products: DataFrame, строки которого - словари из parse_json_string().
+    :param rules: Скомпилированные правила (по умолчанию COMPILED_RULES).
+    :return: DataFrame с колонками "passed", "reasons" и "missing" и тем же индексом.
+
+    Необязательный показатель, который не удалось извлечь из JSON, не считается нарушением.
+    Без обязательного показателя (REQUIRED_METRICS) продукт не проходит проверку, а показатель
+    попадает в "missing".
+    """
+    rules = COMPILED_RULES if rules is None else rules
+    metrics = compute_metrics(products)
+    reasons = [[] for _ in range(len(products))]
+    missing = [[] for _ in range(len(products))]
+    no_category = (metrics["category"] == "").to_numpy()
+    for row in np.flatnonzero(no_category):
+        missing[row].append(REQUIRED_METRICS["category"])
+
+    for compiled in rules:
+        values = metrics[compiled.rule.metric].to_numpy(dtype=float)
+        thresholds = metrics["category"].map(compiled.by_category).fillna(compiled.default).to_numpy(dtype=float)
+        applicable = ~np.isnan(values) & ~np.isnan(thresholds)
+        with np.errstate(invalid="ignore"):
+            violated = applicable & ~compiled.check(values, thresholds)
+        for row in np.flatnonzero(violated):
+            reasons[row].append(compiled.rule.message.format(value=values[row], threshold=thresholds[row]))
+        label = REQUIRED_METRICS.get(compiled.rule.metric)
+        if label is not None:
+            for row in np.flatnonzero(np.isnan(values) & (~np.isnan(thresholds) | no_category)):
+                if label not in missing[row]:
+                    missing[row].append(label)
+
+    passed = np.array([not row_reasons and not row_missing for row_reasons, row_missing in zip(reasons, missing)], dtype=bool)
+    return pd.DataFrame({"passed": passed, "reasons": reasons, "missing": missing}, index=products.index)
+
+
+def evaluate_product(product: Dict[str, Any]) -> Verdict:
+    """
+    Проверяет один продукт на соответствие требованиям ВОЗ.
+
+    :param product: Словарь из parse_json_string().
+    :return: Вердикт с причинами несоответствия и недостающими обязательными показателями.
+    """
+    result = evaluate_frame(pd.DataFrame([product])).iloc[0]
+    return Verdict(passed=bool(result["passed"]), reasons=list(result["reasons"]), missing=list(result["missing"]))
+
+
+def format_verdict(verdict: Verdict) -> str:
+    """
+    Формирует текстовое описание вердикта.
+
+    :param verdict: Вердикт проверки.
+    :return: Текст с решением и причинами.
+    """
+    if verdict.passed:
+        return "Продукт соответствует требованиям ВОЗ к детскому питанию."
+    if verdict.insufficient:
+        return "Недостаточно данных для проверки требований ВОЗ, не удалось извлечь: " + ", ".join(verdict.missing) + "."
+    lines = ["Продукт не соответствует требованиям ВОЗ к детскому питанию:"]
+    lines.extend(f"- {reason}" for reason in verdict.reasons)
+    return "\n".join(lines)
@@ -0,0 +1,208 @@
+import re
+import threading
+from dataclasses import dataclass, asdict
+from typing import Callable, List, Optional, Tuple
+from constant import OCR_COMPACTION_ENABLED, OCR_TOKEN_BUDGET
+from llm.response_cache import normalize_text
+
+
+# Строки с этими словами нужны для заполнения полей JSON и сохраняются в первую очередь
+PRIORITY_PATTERNS = [
+    (re.compile(r"состав|ингредиент", re.IGNORECASE), 5.0),
+    (re.compile(r"пищев\w* ценност|энергетич\w* ценност|калорийн", re.IGNORECASE), 5.0),
+    (re.compile(r"белк|жир|углевод|сахар|сахароз|натри|сол[ьи]|клетчатк|ккал|кдж", re.IGNORECASE), 4.0),
+    (re.compile(r"месяц|лет\b|года?\b|возраст|для детей|детск", re.IGNORECASE), 3.0),
+    (re.compile(r"пюре|каша|йогурт|творог|молок|сок|печень|напиток|коктейл|десерт", re.IGNORECASE), 2.0),
+    (re.compile(r"изготовител|производител|\bооо\b|\bао\b|\bзао\b", re.IGNORECASE), 2.0),
+    (re.compile(r"\d+[.,]?\d*\s*(г|мг|мкг|%|ккал|кдж)\b", re.IGNORECASE), 2.0),
+    (re.compile(r"гмо|подсласт|транс", re.IGNORECASE), 2.0),
+]
+
+# Строки, которые не влияют на поля JSON и отбрасываются первыми
+LOW_VALUE_PATTERNS = [
+    re.compile(r"хранить|хранени|срок годност|дата изготовлен|годен до", re.IGNORECASE),
+    re.compile(r"\bту\b|\bгост\b|\bсто\b|\bеаэс\b", re.IGNORECASE),
+    re.compile(r"адрес|тел\.|телефон|www\.|http|e-?mail|горячая линия|\bг\.\s", re.IGNORECASE),
+    re.compile(r"рекомендации по|откройте|перед употреблением|подогре|разогре", re.IGNORECASE),
+]
+
+_WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё]{3,}|\d")
+_MEANINGFUL_RE = re.compile(r"[\wЁё]")
+
+
+@dataclass
+class CompactionReport:
+    """
+    Результат сжатия текста OCR.
+
+    Параметры:
+    - original_tokens (int): Токенов в исходном тексте.
+    - compacted_tokens (int): Токенов после сжатия.
+    - budget (Optional[int]): Бюджет токенов (None - без ограничения).
+    - noise_lines (int): Отброшено строк-мусора.
+    - duplicate_lines (int): Отброшено повторов.
+    - dropped_lines (int): Отброшено строк с низким приоритетом, чтобы уложиться в бюджет.
+    """
+    original_tokens: int
+    compacted_tokens: int
+    budget: Optional[int]
+    noise_lines: int = 0
+    duplicate_lines: int = 0
+    dropped_lines: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.compacted_tokens
+
+    def to_dict(self) -> dict:
+        return dict(asdict(self), saved_tokens=self.saved_tokens)
+
+
+def is_noise_line(line: str) -> bool:
+    """
+    Определяет строку-мусор OCR: одиночные символы, обрывки рамок и таблиц.
+
+    Параметры:
+    - line (str): Строка текста.
+
+    Возвращает:
+    bool: True, если в строке нет ни одного слова из трех букв и ни одной цифры,
+    или если буквы и цифры составляют меньше половины непробельных символов.
+    """
+    stripped = "".join(line.split())
+    if not stripped or not _WORD_RE.search(line):
+        return True
+    return len(_MEANINGFUL_RE.findall(stripped)) < len(stripped) / 2
+
+
+def line_priority(line: str) -> float:
+    """
+    Оценивает полезность строки для извлечения JSON.
+
+    Параметры:
+    - line (str): Строка текста.
+
+    Возвращает:
+    float: Сумма весов найденных приоритетных шаблонов за вычетом штрафа за служебную информацию.
+    """
+    score = sum(weight for pattern, weight in PRIORITY_PATTERNS if pattern.search(line))
+    if any(pattern.search(line) for pattern in LOW_VALUE_PATTERNS):
+        score -= 3.0
+    return score
+
+
+def compact_ocr_text(text: str, count_tokens: Callable[[str], int], budget: Optional[int] = None) -> Tuple[str, CompactionReport]:
+    """
+    Сжимает текст OCR перед передачей модели.
+
+    Параметры:
+    - text (str): Распознанный текст, по одной линии на строку.
+    - count_tokens (Callable[[str], int]): Подсчет токенов токенизатором модели.
+    - budget (Optional[int]): Максимальное количество токенов результата (None - без ограничения).
+
+    Возвращает:
+    Tuple[str, CompactionReport]: Сжатый текст и отчет о сжатии.
+
+    Подробности:
+    - Отбрасываются строки-мусор и повторы (сравнение по нормализованному тексту строки).
+    - Если текст не укладывается в бюджет, строки выбираются по убыванию приоритета
+      (состав и пищевая ценность - первыми, хранение, адреса и ГОСТ - последними),
+      а при равном приоритете - по порядку в тексте. Строка-продолжение перечисления получает
+      приоритет не ниже предыдущей. Выбранные строки сохраняют исходный порядок.
+    """
+    original_tokens = count_tokens(text)
+    report = CompactionReport(original_tokens=original_tokens, compacted_tokens=original_tokens, budget=budget)
+
+    lines: List[str] = []
+    seen = set()
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if is_noise_line(line):
+            report.noise_lines += bool(line)
+            continue
+        key = normalize_text(line)
+        if key in seen:
+            report.duplicate_lines += 1
+            continue
+        seen.add(key)
+        lines.append(line)
+
+    line_tokens = [count_tokens(line + "\n") for line in lines]
+    if budget is not None and sum(line_tokens) > budget:
+        priorities = []
+        for index, line in enumerate(lines):
+            priority = line_priority(line)
+            # Продолжение перечисления (состав, пищевая ценность) наследует приоритет начала
+            if index and (lines[index - 1].endswith(",") or line[0].islower() or line[0] == "("):
+                priority = max(priority, priorities[-1])
+            priorities.append(priority)
+        order = sorted(range(len(lines)), key=lambda index: (-priorities[index], index))
+        selected, used = set(), 0
+        for index in order:
+            if used + line_tokens[index] <= budget:
+                selected.add(index)
+                used += line_tokens[index]
+        report.dropped_lines = len(lines) - len(selected)
+        lines = [line for index, line in enumerate(lines) if index in selected]
+
+    compacted = "".join(line + "\n" for line in lines)
+    report.compacted_tokens = count_tokens(compacted)
+    return compacted, report
+
+
+class OCRTextCompactor:
+    """
+    Сжатие текста OCR под бюджет токенов с накоплением статистики по процессу.
+
+    Параметры:
+    - budget (Optional[int]): Бюджет токенов текста OCR (None - только удаление мусора и повторов).
+    - enabled (bool): Включено ли сжатие.
+    """
+
+    def __init__(self, budget: Optional[int] = None, enabled: bool = True):
+        self.budget = budget
+        self.enabled = enabled
+        self.requests = 0
+        self.original_tokens = 0
+        self.compacted_tokens = 0
+        self._lock = threading.Lock()
+
+    def compact(self, text: str, count_tokens: Callable[[str], int], budget: Optional[int] = None) -> Tuple[str, CompactionReport]:
+        """
+        Сжимает текст OCR.
+
+        Параметры:
+        - text (str): Распознанный текст.
+        - count_tokens (Callable[[str], int]): Подсчет токенов токенизатором модели.
+        - budget (Optional[int]): Бюджет для этого запроса; берется меньший из него и self.budget.
+
+        Возвращает:
+        Tuple[str, CompactionReport]: Сжатый текст и отчет о сжатии.
+        """
+        budgets = [value for value in (budget, self.budget) if value is not None]
+        budget = min(budgets) if budgets else None
+        if not self.enabled:
+            tokens = count_tokens(text)
+            return text, CompactionReport(original_tokens=tokens, compacted_tokens=tokens, budget=budget)
+
+        compacted, report = compact_ocr_text(text, count_tokens, budget)
+        with self._lock:
+            self.requests += 1
+            self.original_tokens += report.original_tokens
+            self.compacted_tokens += report.compacted_tokens
+        return compacted, report
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики текущего процесса.
+
+        Возвращает:
+        dict: Словарь с ключами requests, original_tokens, compacted_tokens, saved_tokens.
+        """
+        with self._lock:
+            return {"requests": self.requests, "original_tokens": self.original_tokens,
+                    "compacted_tokens": self.compacted_tokens,
+                    "saved_tokens": self.original_tokens - self.compacted_tokens}
+
+
+ocr_compactor = OCRTextCompactor(budget=OCR_TOKEN_BUDGET, enabled=OCR_COMPACTION_ENABLED)
@@ -0,0 +1,107 @@
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from constant import FROM_TEXT_2_JSON_PROMPT
+
+
+# Соответствие типов из описания полей в промпте типам JSON Schema
+PROMPT_TYPES = {
+    "String": {"type": "string"},
+    "Boolean": {"type": "boolean"},
+    "Integer": {"type": "integer"},
+    "Float": {"type": "number"},
+}
+
+FIELD_RE = re.compile(r'^\s*"(?P<name>\w+)"\s*:\s*(?P<description>.*?)\s(?P<type>String|Boolean|Integer|Float|Category)\.\s*$', re.MULTILINE)
+CATEGORIES_RE = re.compile(r"\(([^()]*)\)\.\s*Category\.")
+
+
+def build_product_schema(prompt: str = FROM_TEXT_2_JSON_PROMPT) -> Dict[str, Any]:
+    """
+    Строит JSON Schema продукта по списку полей из промпта извлечения.
+
+    Параметры:
+    - prompt (str): Промпт с описанием полей в формате '"Поле" : Описание. Тип.'.
+
+    Возвращает:
+    dict: JSON Schema объекта со всеми полями из промпта в исходном порядке.
+
+    Подробности:
+    - Тип Category превращается в перечисление категорий из скобок в описании поля.
+    - Каждое поле допускает null, так как системный промпт просит писать None при отсутствии данных.
+    """
+    properties = {}
+    for match in FIELD_RE.finditer(prompt):
+        field_type = match.group("type")
+        if field_type == "Category":
+            categories = CATEGORIES_RE.search(match.group(0)).group(1)
+            field_schema = {"enum": [category.strip() for category in categories.split(",") if category.strip()]}
+        else:
+            field_schema = dict(PROMPT_TYPES[field_type])
+        properties[match.group("name")] = {"anyOf": [field_schema, {"type": "null"}]}
+
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+@lru_cache(maxsize=None)
+def get_product_grammar() -> Optional[Any]:
+    """
+    Возвращает грамматику llama.cpp для JSON продукта (строится один раз на процесс).
+
+    Возвращает:
+    Optional[LlamaGrammar]: Грамматика, ограничивающая генерацию объектом по build_product_schema(),
+    или None, если llama_cpp не установлен (например, при работе с llm.stub.StubLlama).
+    """
+    try:
+        from llama_cpp import LlamaGrammar
+    except ImportError:
+        return None
+    return LlamaGrammar.from_json_schema(json.dumps(build_product_schema(), ensure_ascii=False), verbose=False)
+
+
+class JsonObjectTracker:
+    """
+    Отслеживает вложенность фигурных скобок в потоке текста, чтобы остановить
+    генерацию сразу после закрытия JSON-объекта верхнего уровня.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> int:
+        """
+        Обрабатывает очередной фрагмент текста.
+
+        Параметры:
+        - chunk (str): Фрагмент сгенерированного текста.
+
+        Возвращает:
+        int: Длина части фрагмента до закрытия объекта включительно или -1, если объект еще не закрыт.
+        """
+        for index, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.started:
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+                self.started = True
+            elif char == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return index + 1
+        return -1
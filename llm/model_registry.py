@@ -0,0 +1,138 @@
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from constant import SPECULATIVE_DECODING
+
+
+ModelKey = Tuple[str, int, int, int]
+
+_models: Dict[ModelKey, Any] = {}
+_lock = threading.Lock()
+_model_factory: Optional[Callable[..., Any]] = None
+_model_params: Dict[str, Any] = {}
+
+
+def set_model_factory(factory: Optional[Callable[..., Any]]) -> None:
+    """
+    Подменяет конструктор модели (например, на llm.stub.StubLlama для локальных проверок).
+
+    Параметры:
+    - factory (Optional[Callable]): Конструктор с параметрами Llama или None для llama_cpp.Llama.
+
+    Подробности:
+    - Уже загруженные модели выгружаются, чтобы реестр не смешивал экземпляры разных типов.
+    """
+    global _model_factory
+    shutdown()
+    _model_factory = factory
+
+
+def set_model_params(**params: Any) -> None:
+    """
+    Задает дополнительные параметры конструктора для всех моделей процесса.
+
+    Параметры:
+    - params: Параметры Llama, не входящие в ключ реестра (например, n_threads, use_mmap).
+
+    Подробности:
+    - Используется процессами llm.worker_pool: каждый процесс задает свое количество потоков.
+    - Уже загруженные модели выгружаются, чтобы новые параметры применились при следующем get_model().
+    """
+    shutdown()
+    _model_params.clear()
+    _model_params.update(params)
+
+
+def _create_model(**params: Any) -> Any:
+    params.update(_model_params)
+    if _model_factory is not None:
+        return _model_factory(**params)
+    from llama_cpp import Llama
+    return Llama(**params)
+
+
+def get_model(
+    model_path: str,
+    n_ctx: int = 4096,
+    n_batch: int = 512,
+    n_gpu_layers: int = -1,
+    reset: bool = True,
+) -> Any:
+    """
+    Возвращает загруженную модель LLAMA из общего для процесса реестра.
+
+    Параметры:
+    - model_path (str): Путь к файлу модели в формате GGUF.
+    - n_ctx (int): Максимальная длина контекста.
+    - n_batch (int): Размер батча при вычислении промпта.
+    - n_gpu_layers (int): Количество слоев, выгружаемых на GPU.
+    - reset (bool): Сбросить состояние контекста перед выдачей модели.
+
+    Возвращает:
+    Llama: Экземпляр модели, общий для всех вызовов с теми же параметрами.
+
+    Подробности:
+    - Модель загружается лениво при первом обращении и кешируется по ключу
+      (model_path, n_ctx, n_batch, n_gpu_layers).
+    - При повторных обращениях возвращается тот же экземпляр, поэтому запросы
+      не платят за загрузку весов.
+    - При SPECULATIVE_DECODING модель создается с logits_all=True для проверки черновиков.
+    - Экземпляр Llama не потокобезопасен: одновременно с моделью должен
+      работать только один запрос.
+    """
+    key = (model_path, n_ctx, n_batch, n_gpu_layers)
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            model = _create_model(
+                model_path=model_path,
+                n_gpu_layers=n_gpu_layers,
+                n_batch=n_batch,
+                n_ctx=n_ctx,
+                n_parts=1,
+                logits_all=SPECULATIVE_DECODING,
+            )
+            _models[key] = model
+    if reset:
+        model.reset()
+    return model
+
+
+def warmup(
+    model_path: str,
+    n_ctx: int = 4096,
+    n_batch: int = 512,
+    n_gpu_layers: int = -1,
+) -> Any:
+    """
+    Заранее загружает модель и прогоняет через нее один токен.
+
+    Параметры:
+    - model_path (str): Путь к файлу модели в формате GGUF.
+    - n_ctx (int): Максимальная длина контекста.
+    - n_batch (int): Размер батча при вычислении промпта.
+    - n_gpu_layers (int): Количество слоев, выгружаемых на GPU.
+
+    Возвращает:
+    Llama: Загруженная и прогретая модель.
+
+    Подробности:
+    - Вызывается при старте процесса, чтобы первый запрос не ждал загрузки
+      весов и инициализации контекста.
+    """
+    model = get_model(model_path, n_ctx=n_ctx, n_batch=n_batch, n_gpu_layers=n_gpu_layers)
+    model.eval([model.token_bos()])
+    model.reset()
+    return model
+
+
+def shutdown() -> None:
+    """
+    Выгружает все модели из реестра и освобождает их ресурсы.
+    """
+    with _lock:
+        models = list(_models.values())
+        _models.clear()
+    for model in models:
+        close = getattr(model, "close", None)
+        if close is not None:
+            close()
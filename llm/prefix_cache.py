@@ -0,0 +1,115 @@
+import hashlib
+import os
+import pickle
+import threading
+from typing import Any, Dict, List, Optional
+from constant import PREFIX_CACHE_DIR
+
+
+class PrefixCache:
+    """
+    Кеш снимков состояния модели (KV-кеш) после постоянного префикса промпта.
+
+    Подробности:
+    - Снимок хранится в памяти и, если указан каталог, на диске.
+    - Ключ снимка строится из пути к модели, размера контекста и хеша токенов префикса,
+      поэтому изменение системного промпта или инструкции автоматически дает новый ключ.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self._states: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_path: str, n_ctx: int, prefix_tokens: List[int]) -> str:
+        """
+        Строит ключ снимка по модели и токенам префикса.
+
+        Параметры:
+        - model_path (str): Путь к файлу модели.
+        - n_ctx (int): Размер контекста модели.
+        - prefix_tokens (List[int]): Токены постоянного префикса.
+
+        Возвращает:
+        str: Шестнадцатеричный SHA-256 ключ.
+        """
+        digest = hashlib.sha256()
+        digest.update(os.path.abspath(model_path).encode("utf-8"))
+        digest.update(str(n_ctx).encode("utf-8"))
+        digest.update(",".join(map(str, prefix_tokens)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _state_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.state")
+
+    def _load(self, key: str) -> Any:
+        state = self._states.get(key)
+        if state is not None or not self.cache_dir:
+            return state
+        path = self._state_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as file:
+                state = pickle.load(file)
+        except Exception as e:
+            print("Ошибка чтения снимка префикса:", e)
+            return None
+        self._states[key] = state
+        return state
+
+    def _store(self, key: str, state: Any) -> None:
+        self._states[key] = state
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._state_path(key) + ".tmp"
+            with open(tmp_path, "wb") as file:
+                pickle.dump(state, file)
+            os.replace(tmp_path, self._state_path(key))
+        except Exception as e:
+            print("Ошибка сохранения снимка префикса:", e)
+
+    def restore(self, model: Any, model_path: str, prefix_tokens: List[int]) -> bool:
+        """
+        Приводит модель в состояние после вычисления префикса.
+
+        Параметры:
+        - model (Any): Модель LLAMA.
+        - model_path (str): Путь к файлу модели.
+        - prefix_tokens (List[int]): Токены постоянного префикса.
+
+        Возвращает:
+        bool: True, если состояние восстановлено из снимка, False, если префикс был вычислен заново.
+
+        Подробности:
+        - При промахе префикс вычисляется моделью, после чего снимок сохраняется.
+        - После восстановления model.generate() находит совпадающий префикс
+          и вычисляет только оставшиеся токены запроса.
+        """
+        key = self.make_key(model_path, model.n_ctx(), prefix_tokens)
+        with self._lock:
+            state = self._load(key)
+            if state is not None:
+                model.load_state(state)
+                self.hits += 1
+                return True
+            model.reset()
+            model.eval(prefix_tokens)
+            self._store(key, model.save_state())
+            self.misses += 1
+            return False
+
+    def clear(self) -> None:
+        """
+        Очищает снимки в памяти (файлы на диске не удаляются).
+        """
+        with self._lock:
+            self._states.clear()
+
+
+prefix_cache = PrefixCache(cache_dir=PREFIX_CACHE_DIR)
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional
+import diskcache
+import numpy as np
+from constant import (
+    SYSTEM_PROMPT,
+    FROM_TEXT_2_JSON_PROMPT,
+    FROM_JSON_2_RULE_PROMPT,
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_NEAR_DUPLICATES,
+    RESPONSE_CACHE_SIMILARITY,
+    RESPONSE_CACHE_SIZE_LIMIT,
+    RESPONSE_CACHE_TTL,
+)
+from core.who_rules import RULES_VERSION
+
+
+# Версия промптов и правил: меняется при любом изменении текста промптов или таблицы правил
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join([SYSTEM_PROMPT, FROM_TEXT_2_JSON_PROMPT, FROM_JSON_2_RULE_PROMPT, RULES_VERSION]).encode("utf-8")
+).hexdigest()[:12]
+
+_NOISE_RE = re.compile(r"[^\w\s]+")
+_SPACES_RE = re.compile(r"\s+")
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_BUCKET_SIZE = 32
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализует текст OCR для сравнения: регистр, буква ё, пунктуация, пробелы и порядок строк.
+
+    Параметры:
+    - text (str): Распознанный текст.
+
+    Возвращает:
+    str: Нормализованный текст, строки которого отсортированы.
+    """
+    lines = []
+    for line in text.lower().replace("ё", "е").splitlines():
+        line = _SPACES_RE.sub(" ", _NOISE_RE.sub(" ", line)).strip()
+        if len(line) > 1:
+            lines.append(line)
+    return "\n".join(sorted(lines))
+
+
+def fingerprint(text: str) -> str:
+    """
+    Возвращает отпечаток нормализованного текста.
+
+    Параметры:
+    - text (str): Распознанный текст.
+
+    Возвращает:
+    str: SHA-256 нормализованного текста.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class MinHasher:
+    """
+    MinHash-сигнатуры по словесным шинглам для поиска почти совпадающих текстов.
+
+    Параметры:
+    - num_perm (int): Длина сигнатуры.
+    - shingle_size (int): Количество слов в шингле.
+    - seed (int): Зерно для коэффициентов хеш-функций.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, normalized_text: str) -> np.ndarray:
+        """
+        Вычисляет сигнатуру нормализованного текста.
+
+        Параметры:
+        - normalized_text (str): Результат normalize_text().
+
+        Возвращает:
+        np.ndarray: Сигнатура длины num_perm.
+        """
+        words = normalized_text.split()
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+            dtype=np.uint64,
+        )
+        values = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return values.min(axis=0)
+
+
+class ResponseCache:
+    """
+    Постоянный кеш ответов модели по отпечатку текста OCR.
+
+    Параметры:
+    - directory (str): Каталог кеша.
+    - size_limit (int): Максимальный размер кеша в байтах (вытесняются давно не использованные записи).
+    - ttl (Optional[float]): Время жизни записи в секундах.
+    - enabled (bool): Включен ли кеш.
+    - near_duplicates (bool): Искать почти совпадающие тексты по MinHash.
+    - similarity (float): Минимальная оценка сходства Жаккара для почти совпадающего текста.
+    - bands (int): Количество полос LSH (должно делить длину сигнатуры).
+
+    Подробности:
+    - Ключ записи включает область (модель, параметры генерации, версию промптов) и
+      отпечаток нормализованного текста.
+    - В режиме near_duplicates дополнительно хранятся сигнатуры и корзины LSH, по которым
+      находятся кандидаты для сравнения.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        size_limit: int,
+        ttl: Optional[float] = None,
+        enabled: bool = True,
+        near_duplicates: bool = False,
+        similarity: float = 0.9,
+        bands: int = 16,
+    ):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.ttl = ttl
+        self.enabled = enabled
+        self.near_duplicates = near_duplicates
+        self.similarity = similarity
+        self.bands = bands
+        self.hasher = MinHasher()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._cache: Optional[diskcache.Cache] = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> diskcache.Cache:
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = diskcache.Cache(
+                        self.directory,
+                        size_limit=self.size_limit,
+                        eviction_policy="least-recently-used",
+                    )
+        return self._cache
+
+    @staticmethod
+    def scope_key(scope: Dict[str, Any]) -> str:
+        """
+        Строит ключ области кеширования.
+
+        Параметры:
+        - scope (Dict[str, Any]): Модель, параметры генерации и прочие параметры запроса.
+
+        Возвращает:
+        str: Ключ области.
+        """
+        payload = json.dumps(dict(scope, prompt_version=PROMPT_VERSION), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+    def _band_keys(self, scope: str, signature: np.ndarray) -> List[str]:
+        rows = len(signature) // self.bands
+        return [
+            f"lsh:{scope}:{band}:{hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).hexdigest()}"
+            for band in range(self.bands)
+        ]
+
+    def lookup(self, scope: Dict[str, Any], text: str) -> Any:
+        """
+        Ищет сохраненный ответ для текста.
+
+        Параметры:
+        - scope (Dict[str, Any]): Модель, параметры генерации и прочие параметры запроса.
+        - text (str): Текст запроса (текст OCR).
+
+        Возвращает:
+        Any: Сохраненный ответ или None.
+        """
+        scope = self.scope_key(scope)
+        normalized = normalize_text(text)
+        text_key = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        value = self.cache.get(f"response:{scope}:{text_key}")
+        if value is not None:
+            self._count("hits")
+            return value
+
+        if self.near_duplicates:
+            signature = self.hasher.signature(normalized)
+            seen = set()
+            for band_key in self._band_keys(scope, signature):
+                for candidate in self.cache.get(band_key) or []:
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    candidate_signature = self.cache.get(f"signature:{scope}:{candidate}")
+                    if candidate_signature is None or np.mean(candidate_signature == signature) < self.similarity:
+                        continue
+                    value = self.cache.get(f"response:{scope}:{candidate}")
+                    if value is not None:
+                        self._count("near_hits")
+                        return value
+
+        self._count("misses")
+        return None
+
+    def store(self, scope: Dict[str, Any], text: str, value: Any) -> None:
+        """
+        Сохраняет ответ для текста.
+
+        Параметры:
+        - scope (Dict[str, Any]): Модель, параметры генерации и прочие параметры запроса.
+        - text (str): Текст запроса (текст OCR).
+        - value (Any): Ответ модели.
+        """
+        scope = self.scope_key(scope)
+        normalized = normalize_text(text)
+        text_key = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        self.cache.set(f"response:{scope}:{text_key}", value, expire=self.ttl)
+        if not self.near_duplicates:
+            return
+
+        signature = self.hasher.signature(normalized)
+        with self.cache.transact():
+            self.cache.set(f"signature:{scope}:{text_key}", signature, expire=self.ttl)
+            for band_key in self._band_keys(scope, signature):
+                bucket = [key for key in self.cache.get(band_key) or [] if key != text_key]
+                bucket.append(text_key)
+                self.cache.set(band_key, bucket[-_MAX_BUCKET_SIZE:], expire=self.ttl)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики текущего процесса и размер кеша.
+
+        Возвращает:
+        dict: Словарь с ключами hits, near_hits, misses, volume.
+        """
+        return {"hits": self.hits, "near_hits": self.near_hits, "misses": self.misses, "volume": self.cache.volume()}
+
+    def clear(self) -> None:
+        """
+        Удаляет все записи кеша.
+        """
+        self.cache.clear()
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_SIZE_LIMIT,
+    ttl=RESPONSE_CACHE_TTL,
+    enabled=RESPONSE_CACHE_ENABLED,
+    near_duplicates=RESPONSE_CACHE_NEAR_DUPLICATES,
+    similarity=RESPONSE_CACHE_SIMILARITY,
+)
@@ -0,0 +1,240 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Iterator, List, Optional
+import numpy as np
+from constant import SPECULATIVE_MAX_DRAFT, SPECULATIVE_NGRAM
+
+
+# Окно штрафа за повторы, как last_n_tokens_size по умолчанию в llama_cpp.Llama
+REPEAT_LAST_N = 64
+
+
+@dataclass
+class SpeculativeStats:
+    """
+    Статистика спекулятивной генерации.
+
+    Параметры:
+    - steps (int): Количество проходов модели при декодировании.
+    - draft_tokens (int): Предложено токенов черновика.
+    - accepted_tokens (int): Принято токенов черновика.
+    - generated_tokens (int): Выдано токенов.
+    """
+    steps: int = 0
+    draft_tokens: int = 0
+    accepted_tokens: int = 0
+    generated_tokens: int = 0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted_tokens / self.draft_tokens if self.draft_tokens else 0.0
+
+    @property
+    def tokens_per_step(self) -> float:
+        return self.generated_tokens / self.steps if self.steps else 0.0
+
+    def to_dict(self) -> dict:
+        return dict(asdict(self), acceptance_rate=self.acceptance_rate, tokens_per_step=self.tokens_per_step)
+
+
+def supports_speculation(model: Any) -> bool:
+    """
+    Проверяет, сохраняет ли модель логиты всех позиций батча (Llama(logits_all=True)).
+
+    Параметры:
+    - model (Any): Модель LLAMA.
+
+    Возвращает:
+    bool: True, если после eval() в model.scores доступны логиты каждой позиции.
+    """
+    if getattr(model, "_logits_all", False) or getattr(model, "logits_all", False):
+        return True
+    return bool(getattr(getattr(model, "context_params", None), "logits_all", False))
+
+
+def greedy_token(logits: np.ndarray, history: List[int], repeat_penalty: float = 1.1) -> int:
+    """
+    Выбирает токен так же, как llama.cpp при temperature=0: штраф за повторы и argmax.
+
+    Параметры:
+    - logits (np.ndarray): Логиты позиции.
+    - history (List[int]): Токены контекста до выбираемого токена.
+    - repeat_penalty (float): Штраф за повторение токенов из последних REPEAT_LAST_N.
+
+    Возвращает:
+    int: Выбранный токен.
+    """
+    if repeat_penalty != 1.0 and history:
+        recent = np.unique(np.asarray(history[-REPEAT_LAST_N:]))
+        recent = recent[recent < len(logits)]
+        values = logits[recent]
+        logits = np.array(logits, copy=True)
+        logits[recent] = np.where(values > 0, values / repeat_penalty, values * repeat_penalty)
+    return int(np.argmax(logits))
+
+
+class GrammarConstraint:
+    """
+    Грамматика llama.cpp при проверке черновика: маска логитов и продвижение состояния.
+
+    Параметры:
+    - model (Any): Модель LLAMA (llama_cpp.Llama).
+    - grammar (LlamaGrammar): Грамматика; состояние сбрасывается, как в начале model.generate().
+
+    Подробности:
+    - Повторяет sample() из llama_cpp 0.2.x: запрещенные грамматикой токены получают логит -inf
+      (llama_sample_grammar), а выбранный токен продвигает грамматику (llama_grammar_accept_token).
+    """
+
+    def __init__(self, model: Any, grammar: Any):
+        from llama_cpp._internals import _LlamaTokenDataArray
+        self.context = model._ctx
+        self.grammar = grammar
+        self.candidates = _LlamaTokenDataArray(n_vocab=model.n_vocab())
+        grammar.reset()
+
+    @classmethod
+    def create(cls, model: Any, grammar: Any) -> Optional["GrammarConstraint"]:
+        """
+        Возвращает ограничение или None, если установленный llama_cpp не дает применить грамматику к логитам.
+        """
+        try:
+            return cls(model, grammar)
+        except (ImportError, AttributeError, TypeError):
+            return None
+
+    def apply(self, logits: np.ndarray) -> np.ndarray:
+        """
+        Возвращает копию логитов, в которой запрещенные грамматикой токены равны -inf.
+        """
+        self.candidates.copy_logits(np.asarray(logits, dtype=np.single))
+        self.context.sample_grammar(self.candidates, self.grammar)
+        data = self.candidates.candidates_data[:self.candidates.candidates.size]
+        masked = np.full(len(logits), -np.inf, dtype=np.single)
+        masked[data["id"]] = data["logit"]
+        return masked
+
+    def accept(self, token: int):
+        """
+        Продвигает состояние грамматики на выданный токен.
+        """
+        self.context.grammar_accept_token(self.grammar, token)
+
+
+def find_draft(history: List[int], max_draft: int = SPECULATIVE_MAX_DRAFT, ngram: int = SPECULATIVE_NGRAM) -> List[int]:
+    """
+    Предлагает продолжение поиском последних n-грамм в уже известных токенах (prompt lookup).
+
+    Параметры:
+    - history (List[int]): Токены промпта и уже сгенерированные токены.
+    - max_draft (int): Максимальная длина черновика.
+    - ngram (int): Максимальная длина n-граммы поиска; при отсутствии совпадений n уменьшается до 1.
+
+    Возвращает:
+    List[int]: Токены, следующие за последним вхождением n-граммы, или пустой список.
+
+    Подробности:
+    - При извлечении JSON модель в основном переписывает фрагменты текста OCR
+      (название, компанию, состав, числа), поэтому продолжение часто уже есть в промпте.
+    """
+    context = np.asarray(history)
+    for n in range(min(ngram, len(context) - 1), 0, -1):
+        windows = np.lib.stride_tricks.sliding_window_view(context[:-1], n)
+        matches = np.flatnonzero((windows == context[-n:]).all(axis=1))
+        if len(matches):
+            start = int(matches[-1]) + n
+            return context[start:start + max_draft].tolist()
+    return []
+
+
+def speculative_generate(
+    model: Any,
+    tokens: List[int],
+    repeat_penalty: float = 1.1,
+    max_draft: int = SPECULATIVE_MAX_DRAFT,
+    ngram: int = SPECULATIVE_NGRAM,
+    stats: Optional[SpeculativeStats] = None,
+    grammar: Optional[GrammarConstraint] = None,
+) -> Iterator[int]:
+    """
+    Жадная генерация с черновиками из промпта, проверяемыми одним батчем eval().
+
+    Параметры:
+    - model (Any): Модель LLAMA, созданная с logits_all=True.
+    - tokens (List[int]): Токены контекста.
+    - repeat_penalty (float): Штраф за повторение токенов.
+    - max_draft (int): Максимальная длина черновика.
+    - ngram (int): Максимальная длина n-граммы поиска черновика.
+    - stats (Optional[SpeculativeStats]): Объект для накопления статистики.
+    - grammar (Optional[GrammarConstraint]): Ограничение грамматикой (GrammarConstraint.create()).
+
+    Возвращает:
+    Iterator[int]: Токены, как у model.generate(); вызывающая сторона прекращает чтение сама.
+
+    Подробности:
+    - Общий с контекстом модели префикс не вычисляется повторно, как в model.generate().
+    - На каждом шаге выбранный токен и черновик вычисляются одним eval(). Токен черновика
+      принимается, если он совпадает с жадным выбором по логитам предыдущей позиции, поэтому
+      результат совпадает с обычной генерацией при temperature=0. Логиты позиции после
+      последнего принятого токена дают следующий токен без отдельного прохода.
+    - Отклоненные токены отбрасываются сдвигом model.n_tokens: следующий eval() перезаписывает их в кеше.
+    - С грамматикой логиты каждой позиции маскируются ее текущим состоянием, а состояние
+      продвигается только на выданные токены (принятые токены черновика и выбранный токен),
+      поэтому результат совпадает с model.generate(grammar=...) при temperature=0.
+    """
+    stats = stats if stats is not None else SpeculativeStats()
+    history = list(tokens)
+    # При logits_all в scores по строке на каждую позицию контекста
+    n_ctx = len(model.scores)
+
+    # Переиспользование общего префикса; хотя бы один токен вычисляется для получения логитов
+    prefix = 0
+    for evaluated, token in zip(model.input_ids[:model.n_tokens], history[:-1]):
+        if evaluated != token:
+            break
+        prefix += 1
+    model.n_tokens = prefix
+    model.eval(history[prefix:])
+
+    def choose(row: np.ndarray, context: List[int]) -> int:
+        if grammar is None:
+            return greedy_token(row, context, repeat_penalty)
+        token = greedy_token(grammar.apply(row), context, repeat_penalty)
+        grammar.accept(token)
+        return token
+
+    pending = choose(model.scores[model.n_tokens - 1], history)
+    eos_token = model.token_eos()
+
+    while True:
+        stats.generated_tokens += 1
+        yield pending
+        history.append(pending)
+        if model.n_tokens + 1 > n_ctx:
+            return
+
+        draft = find_draft(history, max_draft, ngram)[:n_ctx - model.n_tokens - 1]
+        base = model.n_tokens
+        model.eval([pending] + draft)
+        stats.steps += 1
+        stats.draft_tokens += len(draft)
+
+        accepted = []
+        rows = model.scores[base:base + len(draft) + 1]
+        for index, row in enumerate(rows):
+            predicted = choose(row, history + accepted)
+            if index == len(draft) or predicted != draft[index]:
+                break
+            accepted.append(predicted)
+            # После окончания сообщения черновик не проверяется: генерация на нем завершится
+            if predicted == eos_token:
+                break
+        model.n_tokens = base + 1 + len(accepted)
+        stats.accepted_tokens += len(accepted)
+
+        for token in accepted:
+            stats.generated_tokens += 1
+            yield token
+            history.append(token)
+            if token == eos_token:
+                return
+        pending = predicted
@@ -0,0 +1,188 @@
+import json
+import time
+from typing import Any, Callable, Iterator, List, Optional
+import numpy as np
+
+
+STUB_PRODUCT_JSON = {
+    "name": "Йогурт Агуша с персиком",
+    "CompanyName": "Агуша",
+    "category": "Молочные продукты",
+    "old": "с 8 месяцев",
+    "HasSugar": False,
+    "HasSodium": False,
+    "sodium": 35.0,
+    "HasSubSugar": False,
+    "HasTransFat": False,
+    "HasGMO": False,
+    "kcal": 77,
+    "composition": "молоко нормализованное, пюре персиковое, закваска",
+    "proteins": 2.8,
+    "fats": 2.7,
+    "carbohydrates": 10.4,
+    "energy": 77.0,
+    "HasMarketingLabels": False,
+}
+
+
+def default_response(context: str) -> str:
+    """
+    Выбирает ответ заглушки по последнему сообщению контекста.
+
+    Параметры:
+    - context (str): Декодированный контекст модели.
+
+    Возвращает:
+    str: JSON продукта, булев ответ или текст правил.
+    """
+    tail = context[-300:]
+    if "BOOLEAN" in tail:
+        return "true"
+    if "Теперь твоя задача" in context[-3000:]:
+        return "Продукт соответствует требованиям."
+    return json.dumps(STUB_PRODUCT_JSON, ensure_ascii=False)
+
+
+class StubLlama:
+    """
+    Детерминированная замена llama_cpp.Llama для локальных проверок без файла GGUF.
+
+    Параметры:
+    - model_path (str): Путь к модели (не используется).
+    - n_ctx (int): Размер контекста.
+    - respond (Callable[[str], str]): Функция, выбирающая ответ по декодированному контексту.
+    - prefill_seconds (float): Имитация стоимости вычисления одного токена контекста.
+    - decode_seconds (float): Имитация стоимости генерации одного токена.
+    - logits_all (bool): Хранить логиты всех позиций в scores, как Llama(logits_all=True).
+    - kwargs: Прочие параметры Llama (игнорируются).
+
+    Подробности:
+    - Токенизация побайтовая: токен байта b равен b + 3, токены 0-2 - служебные.
+      Многобайтовые символы кириллицы разбиваются на несколько токенов, как и в реальной модели.
+    - Поддерживаются методы, которые использует llm.utiils: tokenize, detokenize, eval,
+      generate (с переиспользованием общего префикса), reset, save_state и load_state.
+    - При logits_all eval() заполняет scores: логит ответа respond() равен 10, остальные - 0.
+      Ответ выбирается в конце вычисленного батча, если контекст не продолжает уже выбранный
+      ответ, поэтому жадная генерация по scores совпадает с generate().
+    - Стоимость вычислений имитируется через time.sleep, который, как и llama.cpp, отпускает GIL.
+    """
+
+    BOS = 1
+    EOS = 2
+    BYTE_OFFSET = 3
+    VOCAB_SIZE = 256 + BYTE_OFFSET
+
+    def __init__(
+        self,
+        model_path: str = "stub",
+        n_ctx: int = 4096,
+        respond: Optional[Callable[[str], str]] = None,
+        prefill_seconds: float = 0.0,
+        decode_seconds: float = 0.0,
+        logits_all: bool = False,
+        **kwargs: Any,
+    ):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.respond = respond or default_response
+        self.prefill_seconds = prefill_seconds
+        self.decode_seconds = decode_seconds
+        self.n_tokens = 0
+        # Побайтовые токены длиннее настоящих, поэтому буфер заглушки больше заявленного контекста
+        self.input_ids = np.zeros(max(n_ctx, 1 << 16), dtype=np.intc)
+        self.logits_all = logits_all
+        if logits_all:
+            self.scores = np.zeros((len(self.input_ids), self.VOCAB_SIZE), dtype=np.single)
+            # Для каждой позиции: номер ответа в self._answers и индекс предсказанного токена в нем
+            self._answer_ids = np.full(len(self.input_ids), -1, dtype=np.intc)
+            self._answer_pos = np.zeros(len(self.input_ids), dtype=np.intc)
+            self._answers: List[List[int]] = []
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def token_bos(self) -> int:
+        return self.BOS
+
+    def token_eos(self) -> int:
+        return self.EOS
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [byte + self.BYTE_OFFSET for byte in text]
+        return [self.BOS] + tokens if add_bos else tokens
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return bytes(token - self.BYTE_OFFSET for token in tokens if self.BYTE_OFFSET <= token < self.VOCAB_SIZE)
+
+    def reset(self) -> None:
+        self.n_tokens = 0
+
+    def eval(self, tokens: List[int]) -> None:
+        if self.prefill_seconds and tokens:
+            time.sleep(self.prefill_seconds * len(tokens))
+        start = self.n_tokens
+        self._append(tokens)
+        if self.logits_all:
+            for position in range(start, self.n_tokens):
+                self._predict(position)
+
+    def _predict(self, position: int) -> None:
+        answer_id, index = -1, 0
+        previous = self._answer_ids[position - 1] if position > 0 else -1
+        if previous >= 0:
+            answer, index = self._answers[previous], self._answer_pos[position - 1]
+            if index < len(answer) and self.input_ids[position] == answer[index]:
+                answer_id, index = previous, index + 1
+        if answer_id < 0 and position == self.n_tokens - 1:
+            context = self.detokenize(self.input_ids[:self.n_tokens].tolist()).decode("utf-8", errors="ignore")
+            self._answers.append(self.tokenize(self.respond(context).encode("utf-8"), add_bos=False) + [self.EOS])
+            answer_id, index = len(self._answers) - 1, 0
+        self._answer_ids[position] = answer_id
+        self._answer_pos[position] = index
+        answer = self._answers[answer_id] if answer_id >= 0 else []
+        self.scores[position] = 0.0
+        self.scores[position, answer[index] if index < len(answer) else self.EOS] = 10.0
+
+    def _append(self, tokens: List[int]) -> None:
+        if self.n_tokens + len(tokens) > len(self.input_ids):
+            raise ValueError("Превышен размер контекста заглушки")
+        self.input_ids[self.n_tokens:self.n_tokens + len(tokens)] = tokens
+        if self.logits_all:
+            self._answer_ids[self.n_tokens:self.n_tokens + len(tokens)] = -1
+        self.n_tokens += len(tokens)
+
+    def generate(self, tokens: List[int], reset: bool = True, **kwargs: Any) -> Iterator[int]:
+        tokens = list(tokens)
+        if reset and self.n_tokens > 0:
+            prefix = 0
+            for evaluated, token in zip(self.input_ids[:self.n_tokens], tokens[:-1]):
+                if evaluated != token:
+                    break
+                prefix += 1
+            self.n_tokens = prefix
+            tokens = tokens[prefix:]
+        elif reset:
+            self.reset()
+
+        self.eval(tokens)
+        context = self.detokenize(self.input_ids[:self.n_tokens].tolist()).decode("utf-8", errors="ignore")
+        answer = self.tokenize(self.respond(context).encode("utf-8"), add_bos=False)
+        for token in answer + [self.EOS]:
+            if self.decode_seconds:
+                time.sleep(self.decode_seconds)
+            yield token
+            self._append([token])
+        while True:
+            yield self.EOS
+
+    def save_state(self) -> Any:
+        return self.input_ids[:self.n_tokens].copy()
+
+    def load_state(self, state: Any) -> None:
+        self.n_tokens = len(state)
+        self.input_ids[:self.n_tokens] = state
+        if self.logits_all:
+            self._answer_ids[:self.n_tokens] = -1
+
+    def close(self) -> None:
+        pass
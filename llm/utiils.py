@@ -1,5 +1,9 @@
+import codecs
 import json
-from llama_cpp import Llama
+import os
+import threading
+import time
+import numpy as np
 from constant import (
     SYSTEM_PROMPT,
     BOT_TOKEN,
@@ -8,19 +12,35 @@ from constant import (
     FROM_TEXT_2_JSON_PROMPT,
     FROM_JSON_2_RULE_PROMPT,
     MODEL_PATH,
+    OCR_GENERATION_RESERVE,
+    SPECULATIVE_DECODING,
 )
-from typing import List, Tuple, Any, Dict
+from typing import List, Tuple, Any, Dict, Iterator, Optional
+from llm.model_registry import get_model
+from llm.prefix_cache import prefix_cache
+from llm.json_schema import JsonObjectTracker, get_product_grammar
+from llm.response_cache import response_cache
+from llm.compaction import CompactionReport, ocr_compactor
+from llm.speculative import GrammarConstraint, SpeculativeStats, speculative_generate, supports_speculation
+from core.tracing import current_trace, span
+from core.who_rules import evaluate_product, format_verdict
+
+
+class GenerationCancelled(Exception):
+    """
+    Генерация прервана по запросу вызывающей стороны.
+    """
 
 
-def parse_json_string(json_str: str) -> Dict[str, str]:
+def parse_json_string(json_str: str) -> Dict[str, Any]:
     """
-    Преобразует строку JSON в словарь, приводя ключи и значения к строковому типу.
+    Преобразует строку JSON в словарь, сохраняя типы значений.
 
     Параметры:
     - json_str (str): Строка JSON для разбора.
 
     Возвращает:
-    dict: Словарь, содержащий ключи и значения из строки JSON в строковом формате.
+    dict: Словарь с ключами-строками и значениями исходных типов (строки, числа, булевы значения, None).
     Если строка JSON не может быть разобрана, возвращается пустой словарь.
 
     Пример использования:
@@ -30,13 +50,17 @@ def parse_json_string(json_str: str) -> Dict[str, str]:
     ```
 
     Подробности:
-    - Функция разбирает строку JSON и приводит ключи и значения к строковому типу.
+    - Функция разбирает первый JSON-объект в строке, игнорируя текст до и после него.
     - В случае ошибки разбора JSON возвращается пустой словарь.
     """
     try:
-        parsed_json = json.loads(json_str)
-        parsed_json_str = {str(key): str(value) for key, value in parsed_json.items()}
-        return parsed_json_str
+        start = json_str.find("{")
+        if start < 0:
+            raise json.JSONDecodeError("Object not found", json_str, 0)
+        parsed_json, _ = json.JSONDecoder().raw_decode(json_str, start)
+        if not isinstance(parsed_json, dict):
+            raise json.JSONDecodeError("Object expected", json_str, start)
+        return {str(key): value for key, value in parsed_json.items()}
     except json.JSONDecodeError as e:
         print("Error JSON:", e)
         return {}
@@ -96,82 +120,398 @@ def get_system_tokens(model: Any) -> List[int]:
     return get_message_tokens(model, **system_message)
 
 
-def interact(
-    model_path: str,
-    user_prompt: str,
+def get_prompt_prefix_tokens(model: Any) -> List[int]:
+    """
+    Создает токены постоянного префикса запроса на извлечение JSON.
+
+    Параметры:
+    - model (Any): Модель токенизатора.
+
+    Возвращает:
+    List[int]: Токены системного сообщения и начала пользовательского сообщения с инструкцией.
+
+    Подробности:
+    - Префикс не зависит от текста OCR, поэтому состояние модели после него можно сохранить
+      и восстанавливать для каждого запроса.
+    - Текст OCR токенизируется отдельно функцией get_ocr_message_tokens().
+    """
+    prefix_tokens = model.tokenize(FROM_TEXT_2_JSON_PROMPT.encode("utf-8"))
+    prefix_tokens.insert(1, ROLE_TOKENS["user"])
+    prefix_tokens.insert(2, LINEBREAK_TOKEN)
+    return get_system_tokens(model) + prefix_tokens
+
+
+def get_ocr_message_tokens(model: Any, ocr_text: str) -> List[int]:
+    """
+    Создает токены окончания пользовательского сообщения с текстом OCR.
+
+    Параметры:
+    - model (Any): Модель токенизатора.
+    - ocr_text (str): Распознанный текст из OCR.
+
+    Возвращает:
+    List[int]: Токены текста OCR с токеном окончания сообщения.
+    """
+    message_tokens = model.tokenize(ocr_text.encode("utf-8"), add_bos=False)
+    message_tokens.append(model.token_eos())
+    return message_tokens
+
+
+def get_ocr_token_budget(model: Any, n_ctx: int, prefix_length: int, explain: bool = False) -> int:
+    """
+    Вычисляет, сколько токенов текста OCR помещается в контекст модели.
+
+    Параметры:
+    - model (Any): Модель токенизатора.
+    - n_ctx (int): Максимальная длина контекста.
+    - prefix_length (int): Длина постоянного префикса промпта в токенах.
+    - explain (bool): Будут ли после JSON генерироваться правила и ответ.
+
+    Возвращает:
+    int: Бюджет токенов текста OCR (не меньше нуля).
+
+    Подробности:
+    - Из n_ctx вычитаются префикс, токены окончания сообщения и роли бота и резерв
+      OCR_GENERATION_RESERVE на генерацию JSON.
+    - При explain=True дополнительно вычитаются инструкция с правилами и резерв на правила и ответ.
+    """
+    reserved = prefix_length + 4 + OCR_GENERATION_RESERVE
+    if explain:
+        rules_tokens = get_message_tokens(model=model, role="user", content=FROM_JSON_2_RULE_PROMPT)
+        reserved += len(rules_tokens) + 2 * OCR_GENERATION_RESERVE
+    return max(0, n_ctx - reserved)
+
+
+def count_text_tokens(model: Any, text: str) -> int:
+    """
+    Считает токены текста токенизатором модели.
+
+    Параметры:
+    - model (Any): Модель токенизатора.
+    - text (str): Текст.
+
+    Возвращает:
+    int: Количество токенов без BOS.
+    """
+    return len(model.tokenize(text.encode("utf-8"), add_bos=False))
+
+
+def compact_ocr_text_for_model(
+    ocr_text: str,
+    model: Any,
+    n_ctx: int = 4096,
+    prefix_length: Optional[int] = None,
+    explain: bool = False,
+) -> Tuple[str, CompactionReport]:
+    """
+    Сжимает текст OCR под бюджет контекста модели (llm.compaction).
+
+    Параметры:
+    - ocr_text (str): Распознанный текст из OCR.
+    - model (Any): Модель токенизатора.
+    - n_ctx (int): Максимальная длина контекста.
+    - prefix_length (Optional[int]): Длина постоянного префикса промпта (None - вычислить).
+    - explain (bool): Будут ли после JSON генерироваться правила и ответ.
+
+    Возвращает:
+    Tuple[str, CompactionReport]: Сжатый текст и отчет о сжатии.
+
+    Подробности:
+    - Использует только токенизатор, поэтому может выполняться в отдельном потоке,
+      пока модель генерирует ответ для другого продукта.
+    """
+    if prefix_length is None:
+        prefix_length = len(get_prompt_prefix_tokens(model))
+    with span("llm.compaction") as compaction:
+        budget = get_ocr_token_budget(model, n_ctx, prefix_length, explain=explain)
+        ocr_text, report = ocr_compactor.compact(ocr_text, lambda text: count_text_tokens(model, text), budget)
+        compaction.set(**report.to_dict())
+    return ocr_text, report
+
+
+def get_cache_scope(kind: str, model_path: str, **params: Any) -> Dict[str, Any]:
+    """
+    Формирует область кеширования ответов: вид запроса, модель и параметры генерации.
+
+    Параметры:
+    - kind (str): Вид запроса ("interact" или "pipeline").
+    - model_path (str): Путь к модели.
+    - params: Параметры генерации.
+
+    Возвращает:
+    dict: Область для ResponseCache.
+    """
+    return dict(params, kind=kind, model=os.path.abspath(model_path))
+
+
+def get_pipeline_scope(
+    model_path: str = MODEL_PATH,
     n_ctx: int = 4096,
     top_k: int = 30,
     top_p: float = 0.9,
     temperature: float = 0.2,
     repeat_penalty: float = 1.1,
-) -> str:
+    explain: bool = False,
+    **kwargs: Any,
+) -> Dict[str, Any]:
     """
-    Взаимодействие с моделью на основе LLAMA для генерации ответов на пользовательские запросы.
+    Формирует область кеширования результатов pipeline() по его параметрам.
 
     Параметры:
-    - model_path (str): Путь к предварительно обученной модели LLAMA.
-    - user_prompt (str): Пользовательский запрос для генерации ответа.
-    - n_ctx (int): Максимальная длина контекста.
+    - model_path, n_ctx, top_k, top_p, temperature, repeat_penalty, explain: Параметры pipeline().
+    - kwargs: Прочие параметры pipeline(), не влияющие на результат (игнорируются).
+
+    Возвращает:
+    dict: Область для ResponseCache и VerdictIndex.
+    """
+    return get_cache_scope("pipeline", model_path, n_ctx=n_ctx, top_k=top_k, top_p=top_p,
+                           temperature=temperature, repeat_penalty=repeat_penalty, explain=explain,
+                           compaction=[ocr_compactor.enabled, ocr_compactor.budget, OCR_GENERATION_RESERVE])
+
+
+def get_reused_prefix_length(model: Any, tokens: List[int]) -> int:
+    """
+    Определяет, сколько первых токенов контекста уже вычислено моделью.
+
+    Параметры:
+    - model (Any): Модель LLAMA.
+    - tokens (List[int]): Токены контекста.
+
+    Возвращает:
+    int: Длина общего префикса tokens и контекста модели (как при переиспользовании в generate()).
+    """
+    n_tokens = min(getattr(model, "n_tokens", 0), len(tokens) - 1)
+    if n_tokens <= 0:
+        return 0
+    mismatch = np.flatnonzero(model.input_ids[:n_tokens] != np.asarray(tokens[:n_tokens]))
+    return int(mismatch[0]) if len(mismatch) else n_tokens
+
+
+def stream_generate(
+    model: Any,
+    tokens: List[int],
+    top_k: int = 30,
+    top_p: float = 0.9,
+    temperature: float = 0.2,
+    repeat_penalty: float = 1.1,
+    grammar: Optional[Any] = None,
+    stop_on_json_end: bool = False,
+    stage: str = "generate",
+    speculative: bool = False,
+) -> Iterator[str]:
+    """
+    Генерирует ответ модели и отдает его по частям по мере готовности.
+
+    Параметры:
+    - model (Any): Модель LLAMA.
+    - tokens (List[int]): Токены контекста. Сгенерированные токены дописываются в этот список.
     - top_k (int): Количество наиболее вероятных токенов для рассмотрения в генерации.
     - top_p (float): Порог отсечения для выбора токенов в генерации на основе вероятностей.
     - temperature (float): Параметр температуры для разнообразия в генерации.
     - repeat_penalty (float): Штраф за повторение токенов в генерации.
+    - grammar (Optional[LlamaGrammar]): Грамматика, ограничивающая генерацию.
+    - stop_on_json_end (bool): Остановить генерацию после закрытия JSON-объекта верхнего уровня.
+    - stage (str): Имя этапа для трассировки (замеры llm.<stage>.prefill и llm.<stage>.decode).
+    - speculative (bool): Спекулятивная генерация с черновиками из промпта (llm.speculative).
 
     Возвращает:
-    str: Сгенерированный ответ на основе пользовательского запроса.
+    Iterator[str]: Фрагменты сгенерированного текста.
 
     Пример использования:
     ```python
-    model_path = "path/to/model"
-    user_prompt = "Привет, как дела?"
-    response = interact(model_path, user_prompt)
+    for chunk in stream_generate(model, tokens):
+        print(chunk, end="", flush=True)
     ```
 
     Подробности:
-    - Функция использует модель LLAMA для генерации ответов на пользовательские запросы.
-    - Задает параметры генерации, такие как ограничения токенов, температура и штраф за повторения.
-    - Генерирует ответ на основе пользовательского запроса и возвращает его в виде строки.
+    - Байты токенов декодируются инкрементальным UTF-8 декодером: неполные многобайтовые
+      последовательности (например, кириллица, разбитая между токенами) буферизуются
+      до прихода оставшихся байт, а не отбрасываются.
+    - Генерация останавливается на токене окончания сообщения.
+    - При stop_on_json_end текст после закрывающей скобки отбрасывается, а в контекст
+      добавляется токен окончания сообщения, как если бы его сгенерировала модель.
+    - При активной трассе предзаполнение замеряется до первого токена (с количеством новых
+      токенов контекста), а декодирование - от первого токена до конца генерации.
+    - Спекулятивная генерация применяется только при temperature <= 0 и модели с logits_all=True
+      и дает тот же результат, что и жадная генерация с той же грамматикой. Если грамматику
+      нельзя применить к логитам черновика (llm.speculative.GrammarConstraint), используется
+      обычная генерация. Доля принятых токенов черновика и количество токенов на проход
+      записываются в замер декодирования.
     """
-    # Инициализация модели
-    model = Llama(
-        model_path=model_path,
-        n_gpu_layers=-1,
-        n_batch=512,
-        n_ctx=n_ctx,
-        n_parts=1,
-    )
+    trace = current_trace()
+    if trace is not None:
+        started = time.perf_counter()
+        context_tokens = len(tokens)
+        prompt_tokens = context_tokens - get_reused_prefix_length(model, tokens)
+        first_token_at = None
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    tracker = JsonObjectTracker() if stop_on_json_end else None
+    eos_token = model.token_eos()
+    stats = None
+    speculative = speculative and temperature <= 0 and supports_speculation(model)
+    constraint = GrammarConstraint.create(model, grammar) if speculative and grammar is not None else None
+    if speculative and (grammar is None or constraint is not None):
+        stats = SpeculativeStats()
+        generator = speculative_generate(model, tokens, repeat_penalty=repeat_penalty, stats=stats, grammar=constraint)
+    else:
+        generator = model.generate(
+            tokens,
+            top_k=top_k,
+            top_p=top_p,
+            temp=temperature,
+            repeat_penalty=repeat_penalty,
+            grammar=grammar,
+        )
+    try:
+        for token in generator:
+            if trace is not None and first_token_at is None:
+                first_token_at = time.perf_counter()
+            tokens.append(token)
+            if token == eos_token:
+                break
+            chunk = decoder.decode(model.detokenize([token]))
+            if tracker is not None:
+                end = tracker.feed(chunk)
+                if end >= 0:
+                    tokens.append(eos_token)
+                    if chunk[:end]:
+                        yield chunk[:end]
+                    return
+            if chunk:
+                yield chunk
+        chunk = decoder.decode(b"", final=True)
+        if chunk:
+            yield chunk
+    finally:
+        if trace is not None:
+            finished = time.perf_counter()
+            first_token_at = first_token_at or finished
+            trace.add_span(f"llm.{stage}.prefill", started, first_token_at,
+                           prompt_tokens=prompt_tokens, context_tokens=context_tokens)
+            speculation = {"speculative": stats.to_dict()} if stats is not None else {}
+            trace.add_span(f"llm.{stage}.decode", first_token_at, finished,
+                           generated_tokens=len(tokens) - context_tokens, **speculation)
+
+
+def stream_interact(
+    model_path: str,
+    user_prompt: str,
+    n_ctx: int = 4096,
+    top_k: int = 30,
+    top_p: float = 0.9,
+    temperature: float = 0.2,
+    repeat_penalty: float = 1.1,
+) -> Iterator[str]:
+    """
+    Потоковый вариант interact(): отдает ответ модели по частям.
 
-    # Получение токенов системного сообщения
+    Параметры:
+    - model_path (str): Путь к предварительно обученной модели LLAMA.
+    - user_prompt (str): Пользовательский запрос для генерации ответа.
+    - n_ctx (int): Максимальная длина контекста.
+    - top_k (int): Количество наиболее вероятных токенов для рассмотрения в генерации.
+    - top_p (float): Порог отсечения для выбора токенов в генерации на основе вероятностей.
+    - temperature (float): Параметр температуры для разнообразия в генерации.
+    - repeat_penalty (float): Штраф за повторение токенов в генерации.
+
+    Возвращает:
+    Iterator[str]: Фрагменты сгенерированного ответа.
+    """
+    # Получение модели из общего реестра
+    model = get_model(model_path, n_ctx=n_ctx)
+
+    # Восстановление состояния после системного сообщения
     system_tokens = get_system_tokens(model)
+    with span("llm.prefix_restore", prompt_tokens=len(system_tokens)) as restore:
+        restore.set(hit=prefix_cache.restore(model, model_path, system_tokens))
     tokens = system_tokens
-    model.eval(tokens)
 
     # Получение токенов пользовательского сообщения
     message_tokens = get_message_tokens(model=model, role="user", content=user_prompt)
-    token_str = ""
     role_tokens = [model.token_bos(), BOT_TOKEN, LINEBREAK_TOKEN]
     tokens += message_tokens + role_tokens
 
     # Генерация ответа на основе токенов
-    generator = model.generate(
+    yield from stream_generate(
+        model,
         tokens,
         top_k=top_k,
         top_p=top_p,
-        temp=temperature,
+        temperature=temperature,
         repeat_penalty=repeat_penalty,
+        stage="interact",
     )
 
-    # Преобразование токенов в строку
-    for token in generator:
-        token_str += model.detokenize([token]).decode("utf-8", errors="ignore")
-        tokens.append(token)
-        if token == model.token_eos():
-            break
 
-    return token_str
+def interact(
+    model_path: str,
+    user_prompt: str,
+    n_ctx: int = 4096,
+    top_k: int = 30,
+    top_p: float = 0.9,
+    temperature: float = 0.2,
+    repeat_penalty: float = 1.1,
+    use_cache: bool = True,
+) -> str:
+    """
+    Взаимодействие с моделью на основе LLAMA для генерации ответов на пользовательские запросы.
 
+    Параметры:
+    - model_path (str): Путь к предварительно обученной модели LLAMA.
+    - user_prompt (str): Пользовательский запрос для генерации ответа.
+    - n_ctx (int): Максимальная длина контекста.
+    - top_k (int): Количество наиболее вероятных токенов для рассмотрения в генерации.
+    - top_p (float): Порог отсечения для выбора токенов в генерации на основе вероятностей.
+    - temperature (float): Параметр температуры для разнообразия в генерации.
+    - repeat_penalty (float): Штраф за повторение токенов в генерации.
+    - use_cache (bool): Использовать кеш ответов модели.
 
-def pipeline(
+    Возвращает:
+    str: Сгенерированный ответ на основе пользовательского запроса.
+
+    Пример использования:
+    ```python
+    model_path = "path/to/model"
+    user_prompt = "Привет, как дела?"
+    response = interact(model_path, user_prompt)
+    ```
+
+    Подробности:
+    - Функция использует модель LLAMA для генерации ответов на пользовательские запросы.
+    - Модель берется из общего реестра и загружается один раз на процесс.
+    - Задает параметры генерации, такие как ограничения токенов, температура и штраф за повторения.
+    - Собирает фрагменты из stream_interact() в одну строку.
+    - Ответ запоминается в кеше по модели, параметрам генерации, версии промптов
+      и нормализованному тексту запроса.
+    """
+    scope = get_cache_scope("interact", model_path, n_ctx=n_ctx, top_k=top_k, top_p=top_p,
+                            temperature=temperature, repeat_penalty=repeat_penalty)
+    use_cache = use_cache and response_cache.enabled
+    if use_cache:
+        with span("llm.response_cache", kind="interact") as lookup:
+            cached = response_cache.lookup(scope, user_prompt)
+            lookup.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+
+    answer = "".join(
+        stream_interact(
+            model_path,
+            user_prompt,
+            n_ctx=n_ctx,
+            top_k=top_k,
+            top_p=top_p,
+            temperature=temperature,
+            repeat_penalty=repeat_penalty,
+        )
+    )
+
+    if use_cache:
+        response_cache.store(scope, user_prompt, answer)
+    return answer
+
+
+def stream_pipeline(
     ocr_text: str,
     model_path: str = MODEL_PATH,
     n_ctx: int = 4096,
@@ -179,9 +519,12 @@ def pipeline(
     top_p: float = 0.9,
     temperature: float = 0.2,
     repeat_penalty: float = 1.1,
-) -> Tuple[str, str, str]:
+    explain: bool = False,
+    speculative: bool = SPECULATIVE_DECODING,
+    compact: bool = True,
+) -> Iterator[Tuple[str, str]]:
     """
-    Обработка текста с помощью модели LLAMA для генерации правил и JSON на основе распознанного текста OCR.
+    Потоковый вариант pipeline(): отдает фрагменты ответа каждого этапа по мере генерации.
 
     Параметры:
     - ocr_text (str): Распознанный текст из OCR.
@@ -191,73 +534,63 @@ def pipeline(
     - top_p (float): Порог отсечения для выбора токенов в генерации на основе вероятностей.
     - temperature (float): Параметр температуры для разнообразия в генерации.
     - repeat_penalty (float): Штраф за повторение токенов в генерации.
+    - explain (bool): Генерировать правила и ответ моделью вместо детерминированной проверки.
+    - speculative (bool): Спекулятивная генерация JSON при temperature <= 0.
+    - compact (bool): Сжать текст OCR (False - текст уже сжат, например этапом конвейера).
 
     Возвращает:
-    Tuple[str, str, str]: Кортеж, содержащий сгенерированные правила, JSON и ответ.
+    Iterator[Tuple[str, str]]: Пары (этап, фрагмент), где этап - "json", "rules" или "answer".
 
     Пример использования:
     ```python
-    ocr_text = "Some OCR text"
-    rules, json_data, answer = pipeline(ocr_text)
+    for stage, chunk in stream_pipeline(ocr_text):
+        print(stage, chunk)
     ```
-
-    Подробности:
-    - Функция использует модель LLAMA для генерации правил, JSON и ответа на основе распознанного текста OCR.
-    - Задает параметры генерации, такие как ограничения токенов, температура и штраф за повторения.
-    - Генерирует правила, JSON и ответ на основе текста OCR и возвращает их в виде кортежа.
     """
-    # Инициализация модели
-    model = Llama(
-        model_path=model_path,
-        n_gpu_layers=-1,
-        n_batch=512,
-        n_ctx=n_ctx,
-        n_parts=1,
-    )
+    sampling = dict(top_k=top_k, top_p=top_p, temperature=temperature, repeat_penalty=repeat_penalty)
 
-    # Получение токенов системного сообщения
-    system_tokens = get_system_tokens(model)
-    tokens = system_tokens
-    model.eval(tokens)
+    # Получение модели из общего реестра
+    model = get_model(model_path, n_ctx=n_ctx)
+
+    # Восстановление состояния после постоянного префикса (системное сообщение и инструкция)
+    tokens = get_prompt_prefix_tokens(model)
+    with span("llm.prefix_restore", prompt_tokens=len(tokens)) as restore:
+        restore.set(hit=prefix_cache.restore(model, model_path, tokens))
+
+    # Сжатие текста OCR под оставшийся бюджет контекста
+    if compact:
+        ocr_text, _ = compact_ocr_text_for_model(ocr_text, model, n_ctx, len(tokens), explain=explain)
 
     # Генерация JSON на основе распознанного текста OCR
-    message_tokens = get_message_tokens(
-        model=model, role="user", content=FROM_TEXT_2_JSON_PROMPT + ocr_text
-    )
-    json_str = ""
+    message_tokens = get_ocr_message_tokens(model=model, ocr_text=ocr_text)
     role_tokens = [model.token_bos(), BOT_TOKEN, LINEBREAK_TOKEN]
-    tokens += message_tokens + role_tokens
-    generator = model.generate(
-        tokens,
-        top_k=top_k,
-        top_p=top_p,
-        temp=temperature,
-        repeat_penalty=repeat_penalty,
-    )
-    for token in generator:
-        json_str += model.detokenize([token]).decode("utf-8", errors="ignore")
-        tokens.append(token)
-        if token == model.token_eos():
-            break
+    tokens = tokens + message_tokens + role_tokens
+    json_chunks = []
+    for chunk in stream_generate(model, tokens, grammar=get_product_grammar(), stop_on_json_end=True, stage="json",
+                                 speculative=speculative, **sampling):
+        json_chunks.append(chunk)
+        yield "json", chunk
+
+    # Детерминированная проверка требований ВОЗ вместо генерации правил и ответа моделью
+    if not explain:
+        product = parse_json_string("".join(json_chunks))
+        if not product:
+            yield "rules", "Не удалось извлечь данные о продукте из текста."
+            yield "answer", "None"
+            return
+        with span("who_rules"):
+            verdict = evaluate_product(product)
+        yield "rules", format_verdict(verdict)
+        yield "answer", "None" if verdict.insufficient else "true" if verdict.passed else "false"
+        return
 
     # Генерация правил на основе JSON
     tokens.extend(
         get_message_tokens(model=model, role="user", content=FROM_JSON_2_RULE_PROMPT)
     )
     tokens += role_tokens
-    rules = ""
-    generator = model.generate(
-        tokens,
-        top_k=top_k,
-        top_p=top_p,
-        temp=temperature,
-        repeat_penalty=repeat_penalty,
-    )
-    for token in generator:
-        rules += model.detokenize([token]).decode("utf-8", errors="ignore")
-        tokens.append(token)
-        if token == model.token_eos():
-            break
+    for chunk in stream_generate(model, tokens, stage="rules", **sampling):
+        yield "rules", chunk
 
     # Генерация ответа на основе правил
     tokens.extend(
@@ -268,18 +601,96 @@ def pipeline(
         )
     )
     tokens += role_tokens
-    answer = ""
-    generator = model.generate(
-        tokens,
+    for chunk in stream_generate(model, tokens, stage="answer", **sampling):
+        yield "answer", chunk
+
+
+def pipeline(
+    ocr_text: str,
+    model_path: str = MODEL_PATH,
+    n_ctx: int = 4096,
+    top_k: int = 30,
+    top_p: float = 0.9,
+    temperature: float = 0.2,
+    repeat_penalty: float = 1.1,
+    explain: bool = False,
+    use_cache: bool = True,
+    cancel_event: Optional[threading.Event] = None,
+    speculative: bool = SPECULATIVE_DECODING,
+    compact: bool = True,
+) -> Tuple[str, str, str]:
+    """
+    Обработка текста с помощью модели LLAMA для генерации правил и JSON на основе распознанного текста OCR.
+
+    Параметры:
+    - ocr_text (str): Распознанный текст из OCR.
+    - model_path (str): Путь к предварительно обученной модели LLAMA.
+    - n_ctx (int): Максимальная длина контекста.
+    - top_k (int): Количество наиболее вероятных токенов для рассмотрения в генерации.
+    - top_p (float): Порог отсечения для выбора токенов в генерации на основе вероятностей.
+    - temperature (float): Параметр температуры для разнообразия в генерации.
+    - repeat_penalty (float): Штраф за повторение токенов в генерации.
+    - explain (bool): Генерировать правила и ответ моделью вместо детерминированной проверки.
+    - use_cache (bool): Использовать кеш ответов модели.
+    - cancel_event (Optional[threading.Event]): Событие отмены; генерация прерывается
+      исключением GenerationCancelled после ближайшего фрагмента.
+    - speculative (bool): Спекулятивная генерация JSON при temperature <= 0 (результат тот же).
+    - compact (bool): Сжать текст OCR перед генерацией (False - текст уже сжат).
+
+    Возвращает:
+    Tuple[str, str, str]: Кортеж, содержащий сгенерированные правила, JSON и ответ.
+
+    Пример использования:
+    ```python
+    ocr_text = "Some OCR text"
+    rules, json_data, answer = pipeline(ocr_text)
+    ```
+
+    Подробности:
+    - Функция использует модель LLAMA для генерации правил, JSON и ответа на основе распознанного текста OCR.
+    - Модель берется из общего реестра и загружается один раз на процесс.
+    - Состояние после системного сообщения и инструкции восстанавливается из снимка,
+      поэтому вычисляются только токены текста OCR и последующих сообщений.
+    - Текст OCR сжимается (llm.compaction): удаляются мусор и повторы, а если текст не помещается
+      в контекст, сохраняются строки с составом и пищевой ценностью.
+    - JSON генерируется под грамматикой из схемы полей промпта, а генерация останавливается
+      сразу после закрытия объекта.
+    - Задает параметры генерации, такие как ограничения токенов, температура и штраф за повторения.
+    - По умолчанию правила и ответ формируются детерминированной проверкой JSON
+      по таблице требований ВОЗ (core.who_rules); explain=True возвращает генерацию моделью.
+    - Собирает фрагменты из stream_pipeline() и возвращает правила, JSON и ответ в виде кортежа.
+    - Результат запоминается в кеше по модели, параметрам генерации, версии промптов
+      и нормализованному тексту OCR; повторный продукт возвращается без генерации.
+    """
+    scope = get_pipeline_scope(model_path, n_ctx=n_ctx, top_k=top_k, top_p=top_p,
+                               temperature=temperature, repeat_penalty=repeat_penalty, explain=explain)
+    use_cache = use_cache and response_cache.enabled
+    if use_cache:
+        with span("llm.response_cache", kind="pipeline") as lookup:
+            cached = response_cache.lookup(scope, ocr_text)
+            lookup.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+
+    parts = {"json": [], "rules": [], "answer": []}
+    for stage, chunk in stream_pipeline(
+        ocr_text,
+        model_path=model_path,
+        n_ctx=n_ctx,
         top_k=top_k,
         top_p=top_p,
-        temp=temperature,
+        temperature=temperature,
         repeat_penalty=repeat_penalty,
-    )
-    for token in generator:
-        answer += model.detokenize([token]).decode("utf-8", errors="ignore")
-        tokens.append(token)
-        if token == model.token_eos():
-            break
-
-    return rules, json_str, answer
+        explain=explain,
+        speculative=speculative,
+        compact=compact,
+    ):
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled()
+        parts[stage].append(chunk)
+
+    result = "".join(parts["rules"]), "".join(parts["json"]), "".join(parts["answer"])
+
+    if use_cache:
+        response_cache.store(scope, ocr_text, result)
+    return result
@@ -0,0 +1,150 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import diskcache
+import numpy as np
+from constant import BARCODE_ENABLED, VERDICT_INDEX_DIR, VERDICT_INDEX_SIZE_LIMIT
+from core.barcode import find_barcode
+from core.tracing import span
+from core.who_rules import evaluate_product
+from llm.response_cache import PROMPT_VERSION, ResponseCache
+from llm.utiils import get_pipeline_scope, parse_json_string
+
+
+class VerdictIndex:
+    """
+    Постоянный индекс результатов проверки продуктов по штрихкоду EAN-13.
+
+    Параметры:
+    - directory (str): Каталог индекса.
+    - size_limit (int): Максимальный размер индекса в байтах.
+    - enabled (bool): Включен ли индекс.
+
+    Подробности:
+    - Индекс заполняется автоматически после полного прохода пайплайна по снимкам со штрихкодом.
+    - Ключ записи включает область (модель и параметры запроса) и версию промптов и правил
+      (PROMPT_VERSION), поэтому при их изменении старые записи перестают находиться
+      и вытесняются по размеру.
+    - Найденный продукт возвращается без OCR и генерации моделью.
+    """
+
+    def __init__(self, directory: str, size_limit: int, enabled: bool = True):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._cache: Optional[diskcache.Cache] = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> diskcache.Cache:
+        if self._cache is None:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = diskcache.Cache(
+                        self.directory,
+                        size_limit=self.size_limit,
+                        eviction_policy="least-recently-used",
+                    )
+        return self._cache
+
+    def lookup(self, scope: Dict[str, Any], ean: str) -> Optional[Tuple[str, str, str]]:
+        """
+        Ищет сохраненный результат для штрихкода.
+
+        Параметры:
+        - scope (Dict[str, Any]): Модель и параметры запроса.
+        - ean (str): Штрихкод EAN-13.
+
+        Возвращает:
+        Optional[Tuple[str, str, str]]: Правила, JSON и ответ, как у pipeline(), или None.
+        """
+        entry = self.cache.get(f"verdict:{ResponseCache.scope_key(scope)}:{ean}")
+        self._count("hits" if entry is not None else "misses")
+        if entry is None:
+            return None
+        return entry["rules"], entry["json"], entry["answer"]
+
+    def store(self, scope: Dict[str, Any], ean: str, result: Tuple[str, str, str]) -> None:
+        """
+        Сохраняет результат полного прохода для штрихкода.
+
+        Параметры:
+        - scope (Dict[str, Any]): Модель и параметры запроса.
+        - ean (str): Штрихкод EAN-13.
+        - result (Tuple[str, str, str]): Правила, JSON и ответ из pipeline().
+        """
+        rules, json_data, answer = result
+        entry = {"rules": rules, "json": json_data, "answer": answer,
+                 "prompt_version": PROMPT_VERSION, "stored_at": time.time()}
+        self.cache.set(f"verdict:{ResponseCache.scope_key(scope)}:{ean}", entry)
+        self._count("stores")
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики текущего процесса и размер индекса.
+
+        Возвращает:
+        dict: Словарь с ключами hits, misses, stores, volume.
+        """
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "volume": self.cache.volume()}
+
+    def clear(self) -> None:
+        """
+        Удаляет все записи индекса.
+        """
+        self.cache.clear()
+
+
+verdict_index = VerdictIndex(VERDICT_INDEX_DIR, VERDICT_INDEX_SIZE_LIMIT, enabled=BARCODE_ENABLED)
+
+
+def lookup_product(images: List[np.ndarray], **pipeline_kwargs: Any) -> Tuple[Optional[str], Optional[Tuple[str, str, str]]]:
+    """
+    Ищет штрихкод на снимках продукта и сохраненный для него результат.
+
+    Параметры:
+    - images (List[np.ndarray]): Снимки продукта (до предобработки).
+    - pipeline_kwargs: Параметры pipeline(), от которых зависит результат.
+
+    Возвращает:
+    Tuple[Optional[str], Optional[Tuple[str, str, str]]]: Штрихкод EAN-13 (или None)
+    и сохраненные правила, JSON и ответ (или None).
+    """
+    if not verdict_index.enabled:
+        return None, None
+    ean = find_barcode(images)
+    if ean is None:
+        return None, None
+    with span("verdict_index", ean=ean) as lookup:
+        result = verdict_index.lookup(get_pipeline_scope(**pipeline_kwargs), ean)
+        lookup.set(hit=result is not None)
+    return ean, result
+
+
+def remember_product(ean: Optional[str], result: Tuple[str, str, str], **pipeline_kwargs: Any) -> None:
+    """
+    Сохраняет результат полного прохода в индекс, если на снимках найден штрихкод.
+
+    Параметры:
+    - ean (Optional[str]): Штрихкод EAN-13 или None.
+    - result (Tuple[str, str, str]): Правила, JSON и ответ из pipeline().
+    - pipeline_kwargs: Параметры pipeline(), от которых зависит результат.
+
+    Подробности:
+    - Результат без извлеченного JSON или с вердиктом "недостаточно данных" (у правил ВОЗ
+      не хватает обязательных показателей) не сохраняется, чтобы неудачное распознавание
+      не закрепилось за штрихкодом и следующий снимок того же продукта прошел полный путь.
+    """
+    if ean is None or not verdict_index.enabled:
+        return
+    product = parse_json_string(result[1])
+    if not product or evaluate_product(product).insufficient:
+        return
+    verdict_index.store(get_pipeline_scope(**pipeline_kwargs), ean, result)
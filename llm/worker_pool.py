@@ -0,0 +1,395 @@
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from constant import LLM_POOL_PIN_CPUS, LLM_POOL_THREADS, LLM_POOL_WORKERS, MODEL_PATH
+from core.tracing import Trace, current_trace, span, use_trace
+from llm.model_registry import set_model_factory, set_model_params, warmup
+from llm.utiils import GenerationCancelled, pipeline
+
+SpanRecord = Tuple[str, float, float, Optional[int], Dict[str, Any]]
+
+
+def get_available_cpus() -> List[int]:
+    """
+    Возвращает номера ядер, доступных текущему процессу.
+
+    Возвращает:
+    List[int]: Номера ядер по возрастанию.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cpus(workers: int, threads: Optional[int] = None, cpus: Optional[List[int]] = None) -> Tuple[int, List[List[int]]]:
+    """
+    Распределяет ядра между процессами пула.
+
+    Параметры:
+    - workers (int): Количество процессов.
+    - threads (Optional[int]): Потоков на процесс (None - доступные ядра поровну, не меньше одного).
+    - cpus (Optional[List[int]]): Номера ядер (по умолчанию доступные процессу).
+
+    Возвращает:
+    Tuple[int, List[List[int]]]: Потоков на процесс и ядра каждого процесса.
+
+    Подробности:
+    - Каждый процесс получает непрерывный блок из threads ядер. Если ядер меньше workers * threads,
+      блоки идут по кругу и процессы делят ядра.
+    """
+    cpus = cpus or get_available_cpus()
+    threads = threads or max(1, len(cpus) // workers)
+    blocks = [sorted({cpus[(index * threads + offset) % len(cpus)] for offset in range(threads)}) for index in range(workers)]
+    return threads, blocks
+
+
+def get_process_memory(pid: int) -> Dict[str, int]:
+    """
+    Возвращает резидентную память процесса по /proc/<pid>/status (Linux).
+
+    Параметры:
+    - pid (int): Идентификатор процесса.
+
+    Возвращает:
+    Dict[str, int]: Байты rss (всего), rss_file (страницы файлов, в том числе отображенные веса GGUF,
+    общие для процессов через page cache) и rss_anon (собственная память: контекст и KV-кеш).
+    Пустой словарь, если платформа не сообщает эти данные.
+    """
+    fields = {"VmRSS": "rss", "RssFile": "rss_file", "RssAnon": "rss_anon"}
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as file:
+            for line in file:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[fields[name]] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return memory
+
+
+class _JobCancel:
+    """
+    Событие отмены задания внутри процесса модели: срабатывает, когда диспетчер
+    записал в общую ячейку номер этого задания.
+    """
+
+    def __init__(self, cancelled: Any, job_id: int):
+        self.cancelled = cancelled
+        self.job_id = job_id
+
+    def is_set(self) -> bool:
+        return self.cancelled.value == self.job_id
+
+
+def _picklable(error: BaseException) -> BaseException:
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _serve_worker(index: int, model_path: str, cpus: List[int], n_threads: int, factory: Optional[Callable[..., Any]],
+                  tasks: Any, results: Any, cancelled: Any) -> None:
+    try:
+        if cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        if factory is not None:
+            set_model_factory(factory)
+        set_model_params(n_threads=n_threads, n_threads_batch=n_threads, use_mmap=True)
+        warmup(model_path)
+    except Exception as e:
+        results.put(("failed", index, None, _picklable(e), []))
+        return
+    results.put(("ready", index, None, os.getpid(), []))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        job_id, ocr_text, pipeline_kwargs = task
+        trace = Trace("llm_worker")
+        try:
+            with use_trace(trace):
+                payload = pipeline(ocr_text, model_path=model_path, cancel_event=_JobCancel(cancelled, job_id), **pipeline_kwargs)
+            status = "done"
+        except Exception as e:
+            payload, status = _picklable(e), "error"
+        spans = [(item.name, item.start, item.duration, item.rss_delta, item.attrs) for item in trace.spans]
+        results.put((status, index, job_id, payload, spans))
+
+
+class ModelWorkerPool:
+    """
+    Пул процессов, каждый из которых владеет своим экземпляром модели.
+
+    Один экземпляр Llama обрабатывает только один запрос одновременно; пул позволяет
+    обрабатывать несколько запросов параллельно на многоядерном CPU.
+
+    Параметры:
+    - model_path (str): Путь к модели в формате GGUF.
+    - workers (int): Количество процессов.
+    - threads (Optional[int]): Потоков llama.cpp на процесс (None - доступные ядра поровну).
+    - pin_cpus (bool): Закрепить каждый процесс за своим блоком ядер.
+    - factory (Optional[Callable]): Конструктор модели в процессах (например, llm.stub.StubLlama);
+      должен сериализоваться pickle. None - llama_cpp.Llama.
+
+    Подробности:
+    - Процессы запускаются методом spawn и открывают один и тот же файл через mmap, поэтому веса
+      не копируются, а делятся через page cache; каждому процессу нужна только память контекста.
+    - Диспетчер отправляет задание свободному процессу; если свободных нет, submit() ждет.
+    - Кеши ответов и индекс штрихкодов на диске общие для процессов, снимки префикса - свои у каждого.
+    - stats() сообщает для каждого процесса RSS (с разделением на общие страницы файла и собственную память),
+      количество запросов и скорость генерации, чтобы подобрать соотношение процессов и потоков.
+    """
+
+    def __init__(self, model_path: str = MODEL_PATH, workers: int = LLM_POOL_WORKERS, threads: Optional[int] = LLM_POOL_THREADS,
+                 pin_cpus: bool = LLM_POOL_PIN_CPUS, factory: Optional[Callable[..., Any]] = None):
+        self.model_path = model_path
+        self.workers = workers
+        self.threads, self.cpus = split_cpus(workers, threads)
+        self.pin_cpus = pin_cpus
+        self.factory = factory
+        self.started_at: Optional[float] = None
+        self.closed = False
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[Any] = []
+        self._tasks: List[Any] = []
+        self._cancelled: List[Any] = []
+        self._results: Any = None
+        self._pids: List[Optional[int]] = [None] * workers
+        self._idle: "queue.Queue[int]" = queue.Queue()
+        self._jobs: Dict[int, Tuple[Future, int, float]] = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector: Optional[threading.Thread] = None
+        self._stats = [{"completed": 0, "failed": 0, "busy_seconds": 0.0, "generated_tokens": 0} for _ in range(workers)]
+
+    def start(self, timeout: Optional[float] = None) -> "ModelWorkerPool":
+        """
+        Запускает процессы и ждет, пока каждый загрузит и прогреет модель.
+
+        Параметры:
+        - timeout (Optional[float]): Максимальное время запуска в секундах (None - без ограничения).
+
+        Возвращает:
+        ModelWorkerPool: Этот же пул.
+
+        Исключения:
+        - RuntimeError: если процесс не смог загрузить модель или завершился при запуске.
+        """
+        self._results = self._context.Queue()
+        for index in range(self.workers):
+            tasks = self._context.Queue()
+            cancelled = self._context.Value("q", -1, lock=False)
+            args = (index, self.model_path, self.cpus[index] if self.pin_cpus else [], self.threads,
+                    self.factory, tasks, self._results, cancelled)
+            process = self._context.Process(target=_serve_worker, args=args, name=f"llm-worker-{index}", daemon=True)
+            process.start()
+            self._processes.append(process)
+            self._tasks.append(tasks)
+            self._cancelled.append(cancelled)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ready = 0
+        try:
+            while ready < self.workers:
+                try:
+                    status, index, _, payload, _ = self._results.get(timeout=1.0)
+                except queue.Empty:
+                    if any(not process.is_alive() for process in self._processes):
+                        raise RuntimeError("Процесс модели завершился при запуске")
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise RuntimeError("Истекло время запуска процессов модели")
+                    continue
+                if status != "ready":
+                    raise RuntimeError(f"Процесс модели {index} не смог загрузить модель: {payload}")
+                self._pids[index] = payload
+                self._idle.put(index)
+                ready += 1
+        except BaseException:
+            self.close()
+            raise
+
+        self.started_at = time.perf_counter()
+        self._collector = threading.Thread(target=self._collect, name="llm-pool-collector", daemon=True)
+        self._collector.start()
+        return self
+
+    def submit(self, ocr_text: str, **pipeline_kwargs: Any) -> Future:
+        """
+        Отправляет задание свободному процессу, при необходимости дожидаясь его.
+
+        Параметры:
+        - ocr_text (str): Распознанный текст.
+        - pipeline_kwargs: Параметры pipeline() (кроме model_path и cancel_event).
+
+        Возвращает:
+        Future: Результат pipeline(); атрибут worker - номер процесса.
+
+        Исключения:
+        - RuntimeError: если пул закрыт или все процессы завершились.
+        """
+        index = self._idle.get()
+        if index < 0:
+            # Признак остановки передается следующему ожидающему
+            self._idle.put(index)
+            raise RuntimeError("Пул процессов модели остановлен")
+        job_id = next(self._job_ids)
+        future: Future = Future()
+        future.worker = index
+        future.spans = []
+        with self._lock:
+            self._jobs[job_id] = (future, index, time.perf_counter())
+        future.job_id = job_id
+        self._tasks[index].put((job_id, ocr_text, pipeline_kwargs))
+        return future
+
+    def run(self, ocr_text: str, model_path: Optional[str] = None, cancel_event: Optional[threading.Event] = None,
+            **pipeline_kwargs: Any) -> Tuple[str, str, str]:
+        """
+        Выполняет pipeline() в свободном процессе и ждет результата (совместим по вызову с pipeline()).
+
+        Параметры:
+        - ocr_text (str): Распознанный текст.
+        - model_path (Optional[str]): Путь к модели; должен совпадать с моделью пула.
+        - cancel_event (Optional[threading.Event]): Событие отмены; генерация в процессе прерывается
+          после ближайшего фрагмента исключением GenerationCancelled.
+        - pipeline_kwargs: Прочие параметры pipeline().
+
+        Возвращает:
+        Tuple[str, str, str]: Правила, JSON и ответ.
+
+        Подробности:
+        - Замеры этапов из процесса модели добавляются в активную трассу вызывающего контекста.
+        """
+        if model_path is not None and model_path != self.model_path:
+            raise ValueError(f"Пул обслуживает модель {self.model_path}, а не {model_path}")
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled()
+        with span("llm.pool") as dispatch:
+            dispatched = time.perf_counter()
+            future = self.submit(ocr_text, **pipeline_kwargs)
+            dispatch.set(worker=future.worker, wait=time.perf_counter() - dispatched)
+            try:
+                while True:
+                    try:
+                        return future.result(timeout=None if cancel_event is None else 0.05)
+                    except FutureTimeoutError:
+                        if cancel_event.is_set():
+                            self._cancelled[future.worker].value = future.job_id
+            finally:
+                self._merge_spans(future, dispatched)
+
+    @staticmethod
+    def _merge_spans(future: Future, dispatched: float) -> None:
+        trace = current_trace()
+        if trace is None:
+            return
+        for name, start, duration, rss_delta, attrs in future.spans:
+            started = dispatched + start
+            trace.add_span(name, started, started + duration, rss_delta=rss_delta, **dict(attrs, worker=future.worker))
+
+    def _collect(self) -> None:
+        while True:
+            try:
+                message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if self.closed:
+                    return
+                self._check_workers()
+                continue
+            if message is None:
+                return
+            status, index, job_id, payload, spans = message
+            with self._lock:
+                future, _, sent = self._jobs.pop(job_id)
+                stats = self._stats[index]
+                stats["completed" if status == "done" else "failed"] += 1
+                stats["busy_seconds"] += time.perf_counter() - sent
+                stats["generated_tokens"] += sum(attrs.get("generated_tokens", 0) for _, _, _, _, attrs in spans)
+            self._idle.put(index)
+            future.spans = spans
+            if status == "done":
+                future.set_result(payload)
+            else:
+                future.set_exception(payload)
+
+    def _check_workers(self) -> None:
+        # Задания завершившегося процесса завершаются ошибкой, а сам процесс больше не получает заданий
+        with self._lock:
+            dead = {index for index, process in enumerate(self._processes) if not process.is_alive()}
+            lost = [(job_id, future) for job_id, (future, index, _) in self._jobs.items() if index in dead]
+            for job_id, future in lost:
+                del self._jobs[job_id]
+        for _, future in lost:
+            future.set_exception(RuntimeError(f"Процесс модели {future.worker} завершился"))
+        if dead and len(dead) == self.workers:
+            self._idle.put(-1)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Возвращает статистику процессов пула.
+
+        Возвращает:
+        List[Dict[str, Any]]: Для каждого процесса: номер, pid, ядра, потоки, жив ли, занят ли,
+        выполнено и неудачных заданий, время работы, загрузка, запросов в секунду, сгенерированных
+        токенов в секунду работы и память (rss, rss_file, rss_anon в байтах).
+        """
+        wall = time.perf_counter() - self.started_at if self.started_at else 0.0
+        with self._lock:
+            busy = {index for _, index, _ in self._jobs.values()}
+            result = []
+            for index, stats in enumerate(self._stats):
+                process = self._processes[index] if index < len(self._processes) else None
+                item = dict(stats, worker=index, pid=self._pids[index], cpus=self.cpus[index] if self.pin_cpus else None,
+                            threads=self.threads, alive=process is not None and process.is_alive(), busy=index in busy)
+                item["utilization"] = stats["busy_seconds"] / wall if wall else 0.0
+                item["requests_per_second"] = stats["completed"] / wall if wall else 0.0
+                item["tokens_per_second"] = stats["generated_tokens"] / stats["busy_seconds"] if stats["busy_seconds"] else 0.0
+                result.append(item)
+        for item in result:
+            if item["pid"] is not None:
+                item.update(get_process_memory(item["pid"]))
+        return result
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Останавливает процессы пула; задания, ожидающие свободного процесса, получают RuntimeError.
+
+        Параметры:
+        - timeout (float): Время ожидания завершения каждого процесса, после которого он останавливается принудительно.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        if self._results is not None:
+            self._results.put(None)
+        if self._collector is not None:
+            self._collector.join()
+        with self._lock:
+            pending = list(self._jobs.values())
+            self._jobs.clear()
+        for future, _, _ in pending:
+            future.set_exception(RuntimeError("Пул процессов модели остановлен"))
+        self._idle.put(-1)
+
+    def __enter__(self) -> "ModelWorkerPool":
+        return self.start() if self.started_at is None else self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,27 +1,23 @@
-from core.document_conversion import extract_images
+from core.document_conversion import extract_images, ImageData
 from llm.utiils import interact
-from core.utilities import  preprocess_image
+from core.utilities import  preprocess_image, to_uint8
 from core.document_generator import generate_output_text
 from constant import MODEL_PATH, FROM_TEXT_2_JSON_PROMPT, FROM_JSON_2_RULE_PROMPT
 import numpy as np
 from PIL import Image
-import io
 
-def get_data() -> bytes:
+def get_data() -> ImageData:
     """
-    Получает данные изображения и возвращает их в формате PNG.
+    Получает тестовое изображение и возвращает его после предварительной обработки.
 
     Возвращает:
-    bytes: Байтовое представление изображения в формате PNG.
+    ImageData: Обработанное изображение в памяти.
     """
     file_path = "test_files/Йогурт Агуша с персиком с 8 месяцев 2.7% 200 г.jpg"
     image_np = np.array(Image.open(file_path))
     image_np = preprocess_image(image_np)
-    image_np = (image_np * 255).astype(np.uint8)
-    with io.BytesIO() as output:
-        Image.fromarray(image_np).save(output, format='PNG')
-        files = output.getvalue()
-    return files
+    image_np = to_uint8(image_np)
+    return ImageData(array=image_np, source=file_path)
 
 def result_pipeline() -> str:
     """
@@ -0,0 +1,487 @@
+from core.document_conversion import extract_images
+from core.document_generator import generate_output_text
+from core.quality_gate import quality_gate, summarize_rejections
+from core.tracing import start_trace, trace_metrics
+from conversation_pipeline import get_data
+from llm.compaction import ocr_compactor
+from llm.model_registry import set_model_factory, warmup
+from llm.verdict_index import lookup_product, remember_product, verdict_index
+from llm.utiils import pipeline, parse_json_string, GenerationCancelled
+from llm.worker_pool import ModelWorkerPool
+from constant import LLM_POOL_THREADS, LLM_POOL_WORKERS, MODEL_PATH
+import numpy as np
+from PIL import Image
+import argparse
+import asyncio
+import contextvars
+import email.parser
+import email.policy
+import functools
+import io
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+MAX_BODY_SIZE = 32 * 1024 * 1024
+DEFAULT_DEADLINE = 120.0
+MIN_OCR_TEXT_LENGTH = 40
+
+
+class QueueFullError(Exception):
+    """
+    Очередь модели заполнена, запрос нужно повторить позже.
+    """
+
+
+class HTTPError(Exception):
+    """
+    Ошибка обработки HTTP-запроса с кодом ответа.
+    """
+
+    def __init__(self, status: int, message: str, details: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.details = details or {}
+
+
+@dataclass
+class LLMJob:
+    """
+    Задание для модели в очереди.
+
+    Параметры:
+    - ocr_text (str): Распознанный текст.
+    - deadline (float): Крайний срок выполнения по часам цикла событий.
+    - future (asyncio.Future): Результат задания.
+    - cancel_event (threading.Event): Событие отмены для прерывания генерации.
+    - context (contextvars.Context): Контекст запроса (с трассой), в котором выполняется генерация.
+    """
+    ocr_text: str
+    deadline: float
+    future: asyncio.Future
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+class LLMWorker:
+    """
+    Исполнитель, владеющий моделью: без пула процессов задания выполняются строго по одному.
+
+    Параметры:
+    - model_path (str): Путь к модели.
+    - queue_size (int): Максимальная длина очереди; при переполнении новые задания отклоняются.
+    - run (Callable): Функция генерации (по умолчанию llm.utiils.pipeline).
+    - pool (Optional[ModelWorkerPool]): Пул процессов модели; задания выполняются в нем
+      параллельно, по одному на процесс.
+
+    Подробности:
+    - Без пула модель используется только из одного выделенного потока, так как Llama не потокобезопасна.
+    - Задания с истекшим сроком или отмененные клиентом пропускаются, не занимая модель;
+      начатая генерация прерывается после ближайшего фрагмента.
+    """
+
+    def __init__(self, model_path: str, queue_size: int = 16, run: Callable[..., Any] = pipeline,
+                 pool: Optional[ModelWorkerPool] = None):
+        self.model_path = model_path
+        self.pool = pool
+        self.run = pool.run if pool is not None else run
+        self.concurrency = pool.workers if pool is not None else 1
+        self.queue: "asyncio.Queue[LLMJob]" = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="llm")
+        self.metrics = {"completed": 0, "failed": 0, "rejected": 0, "expired": 0, "cancelled": 0}
+        self.active = 0
+        self.ready = False
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def busy(self) -> bool:
+        return self.active > 0
+
+    async def start(self, warm: bool = True) -> None:
+        """
+        Загружает модель (или запускает пул процессов) и запускает обработку очереди.
+        """
+        loop = asyncio.get_running_loop()
+        if self.pool is not None:
+            await loop.run_in_executor(self.executor, self.pool.start)
+        elif warm:
+            await loop.run_in_executor(self.executor, warmup, self.model_path)
+        self.ready = True
+        self._tasks = [asyncio.create_task(self._serve()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        """
+        Останавливает обработку очереди, поток исполнителя и пул процессов.
+        """
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.pool is not None:
+            self.pool.close()
+
+    def submit(self, ocr_text: str, timeout: float) -> LLMJob:
+        """
+        Ставит задание в очередь без ожидания.
+
+        Параметры:
+        - ocr_text (str): Распознанный текст.
+        - timeout (float): Оставшееся время на выполнение в секундах.
+
+        Возвращает:
+        LLMJob: Задание, результат которого можно ожидать через job.future.
+
+        Исключения:
+        - QueueFullError: если очередь заполнена.
+        """
+        loop = asyncio.get_running_loop()
+        job = LLMJob(ocr_text=ocr_text, deadline=loop.time() + timeout, future=loop.create_future())
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.metrics["rejected"] += 1
+            raise QueueFullError()
+        return job
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            active = False
+            try:
+                if job.future.done():
+                    self.metrics["cancelled"] += 1
+                    continue
+                if loop.time() >= job.deadline:
+                    self.metrics["expired"] += 1
+                    job.future.set_exception(asyncio.TimeoutError())
+                    continue
+                self.active += 1
+                active = True
+                job.future.add_done_callback(lambda _, event=job.cancel_event: event.set())
+                try:
+                    result = await loop.run_in_executor(
+                        self.executor, job.context.run, lambda: self.run(job.ocr_text, model_path=self.model_path, cancel_event=job.cancel_event)
+                    )
+                except GenerationCancelled:
+                    self.metrics["cancelled"] += 1
+                    continue
+                except Exception as e:
+                    self.metrics["failed"] += 1
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    continue
+                self.metrics["completed"] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.active -= active
+                self.queue.task_done()
+
+
+class ScanService:
+    """
+    Асинхронный HTTP-сервис проверки продуктов по фотографиям.
+
+    Параметры:
+    - model_paths (List[str]): Пути к моделям; для каждой модели запускается свой исполнитель.
+    - queue_size (int): Длина очереди каждой модели.
+    - ocr_workers (int): Количество потоков для предобработки и OCR.
+    - warm (bool): Загружать модели при старте.
+    - pool_workers (int): Процессов модели на каждую модель (1 - модель в процессе сервиса).
+    - pool_threads (Optional[int]): Потоков llama.cpp на процесс пула (None - ядра поровну).
+    - model_factory (Optional[Callable]): Конструктор модели для процессов пула (None - llama_cpp.Llama).
+
+    Маршруты:
+    - POST /scan: фотографии продукта (multipart/form-data или тело image/*), параметры
+      запроса model и deadline (секунды).
+    - POST /analyze: готовый текст OCR в теле запроса (text/plain).
+    - GET /health: состояние сервиса.
+    - GET /metrics: метрики очередей и этапов в текстовом формате Prometheus.
+
+    С параметром запроса trace=1 ответ содержит трассу запроса (core.tracing).
+    """
+
+    def __init__(self, model_paths: List[str], queue_size: int = 16, ocr_workers: int = 4, warm: bool = True,
+                 pool_workers: int = LLM_POOL_WORKERS, pool_threads: Optional[int] = LLM_POOL_THREADS,
+                 model_factory: Optional[Callable[..., Any]] = None):
+        self.workers: Dict[str, LLMWorker] = {}
+        for path in model_paths:
+            pool = ModelWorkerPool(path, workers=pool_workers, threads=pool_threads, factory=model_factory) if pool_workers > 1 else None
+            self.workers[path] = LLMWorker(path, queue_size=queue_size, pool=pool)
+        self.default_model = model_paths[0]
+        self.ocr_executor = ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix="ocr-request")
+        self.warm = warm
+        self.started_at = time.time()
+        self.requests_total = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        """
+        Запускает исполнителей моделей и HTTP-сервер.
+        """
+        for worker in self.workers.values():
+            await worker.start(warm=self.warm)
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    async def stop(self) -> None:
+        """
+        Останавливает HTTP-сервер, исполнителей моделей и пул OCR.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for worker in self.workers.values():
+            await worker.stop()
+        self.ocr_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, content_type, body = await self._dispatch(reader)
+        except HTTPError as e:
+            status, content_type, body = e.status, "application/json", self._json({"error": e.message, **e.details})
+        except Exception as e:
+            status, content_type, body = 500, "application/json", self._json({"error": f"{type(e).__name__}: {e}"})
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 422: "Unprocessable Entity",
+                  500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}.get(status, "")
+        head = (f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        try:
+            writer.write(head.encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, reader: asyncio.StreamReader) -> Tuple[int, str, bytes]:
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            raise HTTPError(400, "Пустой запрос")
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Некорректная строка запроса")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Некорректный заголовок Content-Length")
+        if length < 0:
+            raise HTTPError(400, "Некорректный заголовок Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, "Слишком большой запрос")
+        body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if method == "GET" and url.path == "/health":
+            return 200, "application/json", self._json(self.health())
+        if method == "GET" and url.path == "/metrics":
+            return 200, "text/plain; version=0.0.4", self.metrics().encode("utf-8")
+        if method == "POST" and url.path in ("/scan", "/analyze"):
+            self.requests_total += 1
+            result = await self._analyze(url.path, headers.get("content-type", ""), body, query)
+            return 200, "application/json", self._json(result)
+        raise HTTPError(404, "Маршрут не найден")
+
+    async def _analyze(self, path: str, content_type: str, body: bytes, query: Dict[str, str]) -> Dict[str, Any]:
+        with start_trace(f"service{path}") as trace:
+            result = await self._process(path, content_type, body, query)
+        if trace is not None and query.get("trace") == "1":
+            result["trace"] = trace.to_dict()
+        return result
+
+    async def _process(self, path: str, content_type: str, body: bytes, query: Dict[str, str]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        try:
+            timeout = float(query.get("deadline", DEFAULT_DEADLINE))
+        except ValueError:
+            raise HTTPError(400, "Параметр deadline должен быть числом секунд")
+        if not math.isfinite(timeout) or timeout <= 0:
+            raise HTTPError(400, "Параметр deadline должен быть положительным числом секунд")
+        deadline = loop.time() + timeout
+        worker = self.workers.get(query.get("model", self.default_model))
+        if worker is None:
+            raise HTTPError(400, "Неизвестная модель")
+
+        ean = None
+        if path == "/scan":
+            images = self._read_images(content_type, body)
+            if not images:
+                raise HTTPError(400, "Не найдено ни одного изображения")
+            # Известный по штрихкоду продукт возвращается без OCR и очереди модели
+            ean, cached = await loop.run_in_executor(
+                self.ocr_executor, contextvars.copy_context().run, functools.partial(lookup_product, images, model_path=worker.model_path)
+            )
+            if cached is not None:
+                rules, json_data, answer = cached
+                return {"ocr_text": None, "json": parse_json_string(json_data) or json_data, "rules": rules,
+                        "answer": answer, "barcode": ean, "indexed": True}
+            try:
+                ocr_text = await asyncio.wait_for(
+                    loop.run_in_executor(self.ocr_executor, contextvars.copy_context().run, self._ocr, images), timeout=max(0.0, deadline - loop.time())
+                )
+            except asyncio.TimeoutError:
+                raise HTTPError(504, "Истек срок обработки запроса при распознавании текста")
+        else:
+            ocr_text = body.decode("utf-8", errors="replace")
+        if len(ocr_text.strip()) <= MIN_OCR_TEXT_LENGTH:
+            raise HTTPError(422, "Не удалось распознать текст")
+
+        try:
+            job = worker.submit(ocr_text, timeout=max(0.0, deadline - loop.time()))
+        except QueueFullError:
+            raise HTTPError(503, "Очередь модели заполнена, повторите запрос позже")
+        try:
+            rules, json_data, answer = await asyncio.wait_for(job.future, timeout=max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            raise HTTPError(504, "Истек срок обработки запроса")
+        remember_product(ean, (rules, json_data, answer), model_path=worker.model_path)
+        return {"ocr_text": ocr_text, "json": parse_json_string(json_data) or json_data, "rules": rules, "answer": answer,
+                "barcode": ean, "indexed": False}
+
+    @staticmethod
+    def _read_images(content_type: str, body: bytes) -> List[np.ndarray]:
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+            )
+            payloads = [part.get_payload(decode=True) for part in message.iter_parts() if part.get_filename()]
+        else:
+            payloads = [body] if body else []
+        try:
+            return [np.array(Image.open(io.BytesIO(payload)).convert("RGB")) for payload in payloads]
+        except Exception as e:
+            raise HTTPError(400, f"Не удалось прочитать изображение: {e}")
+
+    @staticmethod
+    def _ocr(images: List[np.ndarray]) -> str:
+        reports = [quality_gate.check(image) for image in images]
+        if not any(report.passed for report in reports):
+            raise HTTPError(422, summarize_rejections(reports), {"quality": [report.to_dict() for report in reports]})
+        files = [get_data(image) for image, report in zip(images, reports) if report.passed]
+        return generate_output_text(extract_images(files=files), detection_threshold=0)
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Возвращает состояние сервиса и исполнителей моделей.
+        """
+        return {
+            "status": "ok" if all(worker.ready for worker in self.workers.values()) else "starting",
+            "uptime": time.time() - self.started_at,
+            "models": {path: {"ready": worker.ready, "busy": worker.busy, "active": worker.active,
+                              "concurrency": worker.concurrency, "queue_depth": worker.queue.qsize()}
+                       for path, worker in self.workers.items()},
+        }
+
+    def metrics(self) -> str:
+        """
+        Возвращает метрики в текстовом формате Prometheus.
+        """
+        lines = [
+            "# TYPE foodscan_requests_total counter",
+            f"foodscan_requests_total {self.requests_total}",
+            "# TYPE foodscan_llm_queue_depth gauge",
+            "# TYPE foodscan_llm_queue_capacity gauge",
+            "# TYPE foodscan_llm_busy gauge",
+            "# TYPE foodscan_llm_active gauge",
+            "# TYPE foodscan_llm_jobs_total counter",
+        ]
+        for path, worker in self.workers.items():
+            label = f'model="{path}"'
+            lines.append(f"foodscan_llm_queue_depth{{{label}}} {worker.queue.qsize()}")
+            lines.append(f"foodscan_llm_queue_capacity{{{label}}} {worker.queue.maxsize}")
+            lines.append(f"foodscan_llm_busy{{{label}}} {int(worker.busy)}")
+            lines.append(f"foodscan_llm_active{{{label}}} {worker.active}")
+            for outcome, value in worker.metrics.items():
+                lines.append(f'foodscan_llm_jobs_total{{{label},outcome="{outcome}"}} {value}')
+        pools = {path: worker.pool.stats() for path, worker in self.workers.items() if worker.pool is not None and worker.ready}
+        if pools:
+            lines.append("# TYPE foodscan_llm_worker_rss_bytes gauge")
+            lines.append("# TYPE foodscan_llm_worker_jobs_total counter")
+            lines.append("# TYPE foodscan_llm_worker_generated_tokens_total counter")
+            lines.append("# TYPE foodscan_llm_worker_busy_seconds_total counter")
+        for path, stats in pools.items():
+            for item in stats:
+                label = f'model="{path}",worker="{item["worker"]}"'
+                for kind in ("rss", "rss_file", "rss_anon"):
+                    if kind in item:
+                        lines.append(f'foodscan_llm_worker_rss_bytes{{{label},kind="{kind}"}} {item[kind]}')
+                for outcome in ("completed", "failed"):
+                    lines.append(f'foodscan_llm_worker_jobs_total{{{label},outcome="{outcome}"}} {item[outcome]}')
+                lines.append(f"foodscan_llm_worker_generated_tokens_total{{{label}}} {item['generated_tokens']}")
+                lines.append(f"foodscan_llm_worker_busy_seconds_total{{{label}}} {item['busy_seconds']:.6f}")
+        gate = quality_gate.stats()
+        lines.append("# TYPE foodscan_quality_checked_total counter")
+        lines.append(f"foodscan_quality_checked_total {gate['checked']}")
+        lines.append("# TYPE foodscan_quality_rejections_total counter")
+        for reason, value in gate["rejections"].items():
+            lines.append(f'foodscan_quality_rejections_total{{reason="{reason}"}} {value}')
+        lines.append("# TYPE foodscan_verdict_index_lookups_total counter")
+        lines.append(f'foodscan_verdict_index_lookups_total{{outcome="hit"}} {verdict_index.hits}')
+        lines.append(f'foodscan_verdict_index_lookups_total{{outcome="miss"}} {verdict_index.misses}')
+        compaction = ocr_compactor.stats()
+        lines.append("# TYPE foodscan_ocr_tokens_total counter")
+        for kind in ("original", "compacted", "saved"):
+            lines.append(f'foodscan_ocr_tokens_total{{kind="{kind}"}} {compaction[kind + "_tokens"]}')
+        return "\n".join(lines) + "\n" + trace_metrics.render_prometheus()
+
+    @staticmethod
+    def _json(data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+async def serve(host: str, port: int, model_paths: List[str], queue_size: int, ocr_workers: int,
+                pool_workers: int = LLM_POOL_WORKERS, pool_threads: Optional[int] = LLM_POOL_THREADS,
+                model_factory: Optional[Callable[..., Any]] = None) -> None:
+    """
+    Запускает сервис и обслуживает запросы до остановки процесса.
+    """
+    service = ScanService(model_paths, queue_size=queue_size, ocr_workers=ocr_workers, pool_workers=pool_workers,
+                          pool_threads=pool_threads, model_factory=model_factory)
+    server = await service.start(host, port)
+    print(f"Сервис запущен на http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HTTP-сервис проверки детского питания по фотографиям.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", action="append", default=None, help="Путь к модели (можно указать несколько).")
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--ocr-workers", type=int, default=4)
+    parser.add_argument("--pool-workers", type=int, default=LLM_POOL_WORKERS, help="Процессов модели (общие веса через mmap).")
+    parser.add_argument("--pool-threads", type=int, default=LLM_POOL_THREADS, help="Потоков llama.cpp на процесс модели.")
+    parser.add_argument("--stub", action="store_true", help="Использовать заглушку llm.stub.StubLlama вместо GGUF.")
+    args = parser.parse_args()
+
+    factory = None
+    if args.stub:
+        from llm.stub import StubLlama
+        factory = StubLlama
+        set_model_factory(StubLlama)
+    asyncio.run(serve(args.host, args.port, args.model or [MODEL_PATH], args.queue_size, args.ocr_workers,
+                      pool_workers=args.pool_workers, pool_threads=args.pool_threads, model_factory=factory))